@@ -0,0 +1,123 @@
+"""
+Fuzz and benchmark the gateway announcement parser of KLWBroadcast
+
+Every datagram is parsed by KLWBroadcast.get_udp_info and by the former byte-loop parser,
+the results must be identical. Random announcements are used unless captured ones are given
+(one hex encoded datagram per line).
+
+Usage: python benchmarks/bench_broadcast.py [--samples N] [--repeat N] [--datagrams FILE]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'cleveroom'))
+
+from klwiot import KLWBroadcast  # noqa: E402
+
+NAMES = [b'KLW-GW', '客厅网关'.encode('gbk'), b'', b'ABCDEFGHIJK', b'\xff\xfe\x80']
+
+
+def legacy_get_udp_info(buf: bytes, rinfo: tuple) -> dict:
+    """The byte-loop parser get_udp_info replaced, kept as the reference"""
+
+    def get_hex(num):
+        hex_str = format(num, '02X')
+        return hex_str if num >= 16 else f"0{hex_str}"
+
+    lenx = 0
+    for i in range(41, 52):
+        if buf[i] == 0:
+            break
+        lenx += 1
+    sid = ''
+    macbyte = []
+    for i in range(34, 40):
+        sid += get_hex(buf[i])
+        macbyte.append(buf[i])
+    localip = f"{buf[3]}.{buf[4]}.{buf[5]}.{buf[6]}"
+    namebyte = bytearray(lenx)
+    for i in range(41, 41 + lenx):
+        namebyte[i - 41] = buf[i]
+    dev_name = "Unknown"
+    try:
+        dev_name = bytes(namebyte).decode('gbk')
+    except Exception:
+        pass
+    return {
+        'ip': localip,
+        'devName': dev_name,
+        'localport': (buf[19] << 8) | buf[20],
+        'destport': (buf[21] << 8) | buf[22],
+        'groupip': f"{buf[108]}.{buf[109]}.{buf[110]}.{buf[111]}",
+        'version': f"V1.{(buf[106] & 0xff) + 383}",
+        'mac': '-'.join(get_hex(b) for b in macbyte),
+        'sid': sid,
+        'workmodel': buf[23]
+    }
+
+
+def random_datagram(rnd: random.Random) -> bytes:
+    buf = bytearray(rnd.getrandbits(8) for _ in range(170))
+    if rnd.random() < 0.8:
+        # Mostly well-formed names, the rest is random bytes up to the terminator
+        name = rnd.choice(NAMES)
+        buf[41:52] = name[:11].ljust(11, b'\0')
+    return bytes(buf)
+
+
+def load_datagrams(path: str):
+    with open(path) as f:
+        return [bytes.fromhex(line.strip()) for line in f if line.strip()]
+
+
+def time_per_call(parse, datagrams, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in datagrams:
+            parse(data, ('0.0.0.0', 1092))
+    return (time.perf_counter() - start) / (repeat * len(datagrams)) * 1e6
+
+
+def run(samples: int, repeat: int, datagrams=None) -> dict:
+    rnd = random.Random(20241019)
+    datagrams = datagrams or [random_datagram(rnd) for _ in range(samples)]
+    broadcast = KLWBroadcast()
+
+    mismatches = 0
+    for data in datagrams:
+        if broadcast.get_udp_info(data, ('0.0.0.0', 1092)) != legacy_get_udp_info(data, ('0.0.0.0', 1092)):
+            mismatches += 1
+
+    def uncached(data, rinfo):
+        return broadcast._parse_udp_info(data)
+
+    # A gateway repeats the same announcement, the cache turns it into a dict lookup
+    repeated = datagrams[:8]
+    return {
+        'datagrams': len(datagrams),
+        'mismatches': mismatches,
+        'legacy_us': round(time_per_call(legacy_get_udp_info, datagrams, repeat), 2),
+        'struct_us': round(time_per_call(uncached, datagrams, repeat), 2),
+        'cached_us': round(time_per_call(broadcast.get_udp_info, repeated, repeat * 10), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--datagrams', help='file of captured datagrams, one hex string per line')
+    args = parser.parse_args()
+    datagrams = load_datagrams(args.datagrams) if args.datagrams else None
+    result = run(args.samples, args.repeat, datagrams)
+    print(json.dumps(result, indent=2))
+    if result['mismatches']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
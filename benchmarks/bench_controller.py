@@ -0,0 +1,68 @@
+"""
+Benchmark the per-command overhead of KLWIOTController.control
+
+Usage: python benchmarks/bench_controller.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'cleveroom'))
+
+from klwiot import KLWIOTClient  # noqa: E402
+from klwiot.klw_type import BufferType  # noqa: E402
+
+BATCH_SIZES = (1, 50, 500)
+ACTIONS = (
+    ('DeviceOn', None),
+    ('SetBrightness', 60),
+    ('SetColor', {"r": 10, "g": 20, "b": 30}),
+    ('SetMode', 2),
+)
+
+
+def create_client(devices: int) -> KLWIOTClient:
+    client = KLWIOTClient(client_id='bench')
+    # Do not go to the network, just collect the instructions
+    client.async_send = lambda inst: None
+    bucket = client.devicebucket
+    for i in range(devices):
+        fid, rid, did = 1 + i // 1000, 1 + (i // 30) % 30, 61 + i % 30
+        uid = f"243-199-{fid}-{rid}-{did}"
+        bucket.save_device_to_database(f"bench.{uid}.{BufferType.DEVICEBUFFER}", {
+            'oid': f"bench.{uid}.{BufferType.DEVICEBUFFER}",
+            'type': BufferType.DEVICEBUFFER,
+            'detail': {'fid': fid, 'rid': rid, 'did': did, 'category': 2},
+        })
+    return client
+
+
+def run(repeat: int) -> dict:
+    client = create_client(max(BATCH_SIZES))
+    oids = client.devicebucket.get_bucket_keys()
+    results = {}
+    for action, value in ACTIONS:
+        for size in BATCH_SIZES:
+            payload = [{'oid': oid, 'value': value} for oid in oids[:size]]
+            start = time.perf_counter()
+            for _ in range(repeat):
+                client.controller.control(action, payload)
+            elapsed = time.perf_counter() - start
+            results[f"{action}/{size}"] = {
+                'per_call_us': round(elapsed / repeat * 1e6, 2),
+                'per_item_us': round(elapsed / repeat / size * 1e6, 3),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark the AES cost of the LC gateway handshake
+
+handshake: one challenge (msg[4] == 1) answered by KLWIOTClientLC.split_datas, i.e. the crypto cost of a reconnect
+legacy: a fresh Cipher and key derivation per call, as Crypto.decrypt used to do
+session / batch: the cached CryptoSession of the secure code, one block per call / many blocks per call
+
+Usage: python benchmarks/bench_crypto.py [--repeat N] [--blocks N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'cleveroom'))
+
+from cryptography.hazmat.backends import default_backend  # noqa: E402
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # noqa: E402
+
+from klwiot import KLWIOTClientLC  # noqa: E402
+from klwiot.klw_common import get_random_code  # noqa: E402
+from klwiot.klw_security import Crypto  # noqa: E402
+
+SECURE_CODE = '8888666688886666'
+
+
+def legacy_decrypt(ran, app_secret: str) -> bytes:
+    key = app_secret.encode('utf-8').ljust(16, b'\0')[:16]
+    decryptor = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend()).decryptor()
+    return decryptor.update(bytes(ran)) + decryptor.finalize()
+
+
+def per_call_us(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def run(repeat: int, blocks: int) -> dict:
+    client = KLWIOTClientLC(code=SECURE_CODE, client_id='bench')
+    # Do not go to the network, just answer the challenge
+    client._send_data = lambda data: None
+    challenge = [0] * 37
+    challenge[4] = 0x01
+    challenge[21:37] = get_random_code(16)
+
+    def handshake():
+        client.data_buffer = list(challenge)
+        client.split_datas()
+
+    ran = bytes(challenge[21:37])
+    many = [bytes(get_random_code(16)) for _ in range(blocks)]
+    session = Crypto.session(SECURE_CODE)
+    assert session.decrypt(ran) == legacy_decrypt(ran, SECURE_CODE)
+    assert session.decrypt_blocks(many) == [legacy_decrypt(b, SECURE_CODE) for b in many]
+    return {
+        'handshake_us': round(per_call_us(handshake, repeat), 2),
+        'legacy_decrypt_us': round(per_call_us(lambda: legacy_decrypt(ran, SECURE_CODE), repeat), 2),
+        'session_decrypt_us': round(per_call_us(lambda: session.decrypt(ran), repeat), 2),
+        'legacy_per_block_us': round(per_call_us(lambda: [legacy_decrypt(b, SECURE_CODE) for b in many],
+                                                 max(1, repeat // blocks)) / blocks, 3),
+        'batch_per_block_us': round(per_call_us(lambda: session.decrypt_blocks(many),
+                                                max(1, repeat // blocks)) / blocks, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20000)
+    parser.add_argument('--blocks', type=int, default=64)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat, args.blocks), indent=2))
+
+
+if __name__ == '__main__':
+    main()
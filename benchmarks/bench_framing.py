@@ -0,0 +1,183 @@
+"""
+Benchmark the frame synchronisation of KLWIOTClient.split_datas
+
+The checksum-validating parser is compared with the former one, which took every 8 bytes as a frame and
+copied the buffer after each of them, and with the same index scanner without the D8 check (unvalidated),
+on the same streams delivered in socket-sized reads:
+clean: aligned frames
+corrupted: one byte dropped or inserted every --every frames
+Only the framing is measured, the frames are counted instead of translated.
+Reported per parser and stream: frames/s, frames accepted, frames accepted with a wrong checksum
+(misparsed), and for the new parser the resyncs and discarded bytes.
+validation_cost is the slowdown of the D8 check alone (validated vs unvalidated),
+scanner_gain the speedup of the index scanning over the former parser, both without the check.
+
+Usage: python benchmarks/bench_framing.py [--frames N] [--every N] [--read 1024] [--repeat N]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'cleveroom'))
+
+from klwiot import KLWIOTClient  # noqa: E402
+from klwiot.klw_common import Instruction  # noqa: E402
+
+
+class FramingClient(KLWIOTClient):
+    """Counts the frames split_datas hands over"""
+
+    def __init__(self):
+        super().__init__(client_id='bench')
+        self.frames = 0
+        self.bad = 0
+
+    def _translate(self, data):
+        self.frames += 1
+        if Instruction.checksum(data) != data[7]:
+            self.bad += 1
+
+    def set_living(self, living):
+        pass
+
+
+def legacy_split_datas(self):
+    """The split_datas the checksum validation replaced, kept as the reference"""
+    buf = self.data_buffer
+    processed_length = 0
+
+    while len(buf) > 0:
+        if len(buf) >= 4 and buf[0] == 0x77 and buf[1] == 0x55 and buf[2] == 0x33 and buf[3] == 0x11:
+            if len(buf) < 14:
+                break
+            data_len = buf[13]
+            pack_len = 14 + data_len + 2
+            if len(buf) >= pack_len:
+                data = buf[:pack_len]
+                processed_length += pack_len
+                self._translate_plc(data)
+                buf = buf[pack_len:]
+            else:
+                break
+        else:
+            if len(buf) >= 8:
+                data = buf[:8]
+                processed_length += 8
+                self._translate(data)
+                buf = buf[8:]
+            else:
+                break
+
+    if processed_length > 0:
+        self.data_buffer = self.data_buffer[processed_length:]
+    self._last_timestamp = time.time() * 1000
+    self.set_living(True)
+
+
+def unvalidated_split_datas(self):
+    """split_datas without the D8 check: the index scanning alone, to isolate the cost of the validation"""
+    buf = self.data_buffer
+    length = len(buf)
+    processed_length = 0
+
+    while processed_length < length:
+        i = processed_length
+        if length - i >= 4 and buf[i] == 0x77 and buf[i + 1] == 0x55 and buf[i + 2] == 0x33 and buf[i + 3] == 0x11:
+            if length - i < 14:
+                break
+            data_len = buf[i + 13]
+            pack_len = 14 + data_len + 2
+            if length - i >= pack_len:
+                data = buf[i:i + pack_len]
+                processed_length += pack_len
+                self._translate_plc(data)
+            else:
+                break
+        else:
+            if length - i >= 8:
+                data = buf[i:i + 8]
+                processed_length += 8
+                self._translate(data)
+            else:
+                break
+
+    if processed_length > 0:
+        del self.data_buffer[:processed_length]
+    self._last_timestamp = time.time() * 1000
+    self.set_living(True)
+
+
+PARSERS = {
+    'legacy': legacy_split_datas,
+    'unvalidated': unvalidated_split_datas,
+    'validated': None,  # KLWIOTClient.split_datas
+}
+
+
+def make_stream(frames: int, every: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    out = bytearray()
+    for n in range(frames):
+        b = [243, rnd.choice((199, 204, 198, 129)), rnd.randint(1, 5), rnd.randint(1, 30), rnd.randint(61, 80),
+             rnd.randint(0, 255), rnd.randint(0, 255)]
+        frame = bytearray(b + [Instruction.checksum(b)])
+        if every and n % every == every - 1:
+            if rnd.random() < 0.5:
+                del frame[rnd.randrange(8)]
+            else:
+                frame.insert(rnd.randrange(8), rnd.randint(0, 255))
+        out += frame
+    return bytes(out)
+
+
+def run(stream: bytes, read: int, parser: str) -> dict:
+    client = FramingClient()
+    reads: List[bytes] = [stream[i:i + read] for i in range(0, len(stream), read)]
+    split = client.split_datas if PARSERS[parser] is None else (lambda: PARSERS[parser](client))
+    start = time.perf_counter()
+    for data in reads:
+        client.data_buffer.extend(data)
+        split()
+    elapsed = time.perf_counter() - start
+    result = {
+        'frames_per_s': round(client.frames / elapsed),
+        'accepted': client.frames,
+        'misparsed': client.bad,
+    }
+    if parser == 'validated':
+        result.update(resyncs=client.resyncs, discarded_bytes=client.discarded_bytes)
+    return result
+
+
+def best(stream: bytes, read: int, parser: str, repeat: int) -> dict:
+    results = [run(stream, read, parser) for _ in range(repeat)]
+    return max(results, key=lambda r: r['frames_per_s'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--every', type=int, default=1000, help='corrupt one frame out of N in the corrupted stream')
+    parser.add_argument('--read', type=int, default=1024, help='bytes per socket read')
+    parser.add_argument('--repeat', type=int, default=5, help='best of N runs')
+    args = parser.parse_args()
+
+    streams = {'clean': make_stream(args.frames, 0), 'corrupted': make_stream(args.frames, args.every)}
+    result = {}
+    for name, stream in streams.items():
+        runs = {parser: best(stream, args.read, parser, args.repeat) for parser in PARSERS}
+        rates = {parser: r['frames_per_s'] for parser, r in runs.items()}
+        result[name] = {
+            **runs,
+            'validation_cost': round(rates['unvalidated'] / rates['validated'] - 1, 3),
+            'scanner_gain': round(rates['unvalidated'] / rates['legacy'] - 1, 3),
+        }
+    print(json.dumps({'python': sys.version.split()[0], 'frames': args.frames, 'results': result}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
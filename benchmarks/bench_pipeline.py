@@ -0,0 +1,175 @@
+"""
+Benchmark the receive pipeline: split_datas -> _translate -> DeviceBuffer -> create_object_detail -> on_device_change
+
+For every install size three streams are fed to an offline client, one 8-byte frame per read:
+dump: the full-state dump of an empty client, every frame creates a device
+change: every frame changes the state of a known device
+unchanged: the dump again, every frame is filtered out by the DeviceBuffer
+A recorded stream can be used instead with --stream: a KLWIOTClient.start_capture file
+(its received records) or raw bytes.
+
+Reported per stream: frames/s, p50/p99 latency per frame, and per frame the transient
+(tracemalloc peak) and retained memory, in a separate traced pass.
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 100,1000,10000] [--output FILE] [--baseline FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'cleveroom'))
+
+from klwiot import KLWIOTClient  # noqa: E402
+from klwiot.klw_capture import RECEIVED, is_capture, read_capture  # noqa: E402
+from klwiot.klw_common import Instruction  # noqa: E402
+
+ROOMS = 30  # rooms per floor
+DIDS = list(range(61, 81))  # toggle lights, 20 per room
+
+
+def frame(*b) -> bytes:
+    b = list(b)
+    return bytes(b + [Instruction.checksum(b)])
+
+
+def synthetic_streams(devices: int) -> Dict[str, List[bytes]]:
+    addresses = []
+    for i in range(devices):
+        per_floor = ROOMS * len(DIDS)
+        fid, rest = 1 + i // per_floor, i % per_floor
+        addresses.append((fid, 1 + rest // len(DIDS), DIDS[rest % len(DIDS)]))
+    dump = [frame(243, 199, f, r, d, 0, 0) for f, r, d in addresses]
+    change = [frame(243, 199, f, r, d, 0, 1) for f, r, d in addresses]
+    return {'dump': dump, 'change': change, 'unchanged': dump}
+
+
+def create_client() -> KLWIOTClient:
+    client = KLWIOTClient(client_id='bench')
+    client.devicebucket.persistence = False
+    client.events = 0
+
+    def on_device_change(raw, is_new):
+        client.events += 1
+
+    client.on('on_device_change', on_device_change)
+    return client
+
+
+def percentile(values: List[int], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(frames: List[bytes], prepare) -> dict:
+    # Timed pass
+    client = prepare()
+    latencies = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for data in frames:
+        t = clock()
+        client._handle_received(data)
+        latencies.append(clock() - t)
+    elapsed = (clock() - start) / 1e9
+    events = client.events
+
+    # Traced pass, tracing slows everything down so it is not timed
+    client = prepare()
+    transient = retained = 0
+    tracemalloc.start()
+    for data in frames:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        client._handle_received(data)
+        current, peak = tracemalloc.get_traced_memory()
+        transient += peak - before
+        retained += current - before
+    tracemalloc.stop()
+
+    n = len(frames)
+    return {
+        'frames': n,
+        'events': events,
+        'frames_per_s': round(n / elapsed),
+        'p50_us': round(percentile(latencies, 0.50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 0.99) / 1000, 2),
+        'transient_bytes_per_frame': round(transient / n),
+        'retained_bytes_per_frame': round(retained / n),
+    }
+
+
+def run_install(devices: int) -> dict:
+    streams = synthetic_streams(devices)
+
+    def empty():
+        return create_client()
+
+    def loaded():
+        client = create_client()
+        for data in streams['dump']:
+            client._handle_received(data)
+        client.events = 0
+        return client
+
+    return {
+        'dump': measure(streams['dump'], empty),
+        'change': measure(streams['change'], loaded),
+        'unchanged': measure(streams['unchanged'], loaded),
+    }
+
+
+def run_recorded(path: str) -> dict:
+    if is_capture(path):
+        # One read per received record, as the socket delivered them
+        frames = [data for direction, _, data in read_capture(path) if direction == RECEIVED]
+        # The 37-byte LC handshake is not part of the frame pipeline
+        while frames and len(frames[0]) == 37:
+            frames.pop(0)
+    else:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        frames = [raw[i:i + 8] for i in range(0, len(raw) - len(raw) % 8, 8)]
+    return {'recorded': measure(frames, create_client)}
+
+
+def compare(result: dict, baseline: dict) -> dict:
+    """Relative change of every metric against a previous run, +0.10 = 10% higher"""
+    diff = {}
+    for install, streams in result.items():
+        for stream, metrics in streams.items():
+            base = baseline.get(install, {}).get(stream, {})
+            for key, value in metrics.items():
+                if base.get(key):
+                    diff[f"{install}/{stream}/{key}"] = round(value / base[key] - 1, 3)
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000', help='install sizes, in devices')
+    parser.add_argument('--stream', help='capture file or raw byte stream to replay instead of the synthetic installs')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    if args.stream:
+        result = {'stream': run_recorded(args.stream)}
+    else:
+        result = {str(size): run_install(size) for size in map(int, args.sizes.split(','))}
+    output = {'python': sys.version.split()[0], 'results': result}
+    if args.baseline:
+        with open(args.baseline) as f:
+            output['vs_baseline'] = compare(result, json.load(f)['results'])
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
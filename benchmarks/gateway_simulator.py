@@ -0,0 +1,347 @@
+"""
+Local Cleveroom gateway simulator, for load, latency and reconnect tests without a real gateway
+
+Speaks the 8-byte frame protocol: password login (243/131 -> 243/130), the query_all_devices dumps,
+199/204 device, 198 sensor and 129 scene state frames, heartbeats and the device commands,
+and in --lc mode the 37-byte AES handshake of KLWIOTClientLC first.
+
+Usage: python benchmarks/gateway_simulator.py [--port 4196] [--floors 1] [--rooms 4] [--devices 8]
+           [--event-rate 5] [--latency 20] [--jitter 5] [--loss 0.01] [--drop-every 60] [--lc --code CODE]
+
+It can also be used from a script:
+    simulator = GatewaySimulator(SimulatedHome(floors=2), port=0)
+    await simulator.start()  # simulator.port is the listening port
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'cleveroom'))
+
+from klwiot.klw_common import Instruction  # noqa: E402
+
+HEARTBEAT = (243, 255, 255, 255, 255, 255, 255)
+TOGGLE_LIGHT, DIMMER, AC, CURTAIN = 'toggle_light', 'dimmer', 'ac', 'curtain'
+SENSOR_TEMPERATURE, SENSOR_LUX, SENSOR_HUMIDITY = 20, 21, 22
+SCENES = (129, 130, 131)
+# Kinds a room/floor wide command reaches, the rule of KLWIOTController.GROUP_CATEGORIES (lights and switches)
+GROUP_KINDS = (TOGGLE_LIGHT, DIMMER)
+
+
+def frame(*b) -> bytes:
+    b = list(b[:7])
+    return bytes(b + [Instruction.checksum(b)])
+
+
+class SimulatedHome:
+    """
+    The state of the simulated installation: per room a few lights, a dimmer, an AC, a curtain and 3 sensors
+    """
+
+    def __init__(self, floors: int = 1, rooms: int = 4, devices: int = 8, seed: int = 0):
+        """
+        :param floors: number of floors (fid 1..floors)
+        :param rooms: rooms per floor (rid 1..rooms)
+        :param devices: devices per room, the first ones are the dimmer, AC and curtain, the rest toggle lights
+        """
+        self.random = random.Random(seed)
+        # (fid, rid, did) -> [kind, value, on]
+        self.devices: Dict[Tuple[int, int, int], list] = {}
+        # (fid, rid, sensor) -> value
+        self.sensors: Dict[Tuple[int, int, int], int] = {}
+        for fid in range(1, floors + 1):
+            for rid in range(1, rooms + 1):
+                kinds = [(DIMMER, 61), (AC, 4), (CURTAIN, 101)][:devices]
+                kinds += [(TOGGLE_LIGHT, 62 + i) for i in range(max(0, devices - 3))]
+                for kind, did in kinds:
+                    self.devices[(fid, rid, did)] = [kind, 24 if kind == AC else 0, False]
+                self.sensors[(fid, rid, SENSOR_TEMPERATURE)] = 22
+                self.sensors[(fid, rid, SENSOR_LUX)] = 80
+                self.sensors[(fid, rid, SENSOR_HUMIDITY)] = 45
+
+    def device_frame(self, key) -> bytes:
+        fid, rid, did = key
+        kind, value, on = self.devices[key]
+        if kind == AC:
+            return frame(243, 204, fid, rid, did, value, 1 if on else 0)
+        if kind == DIMMER:
+            # D7 bit 2: adjustable light, D6: brightness 0~15
+            return frame(243, 199, fid, rid, did, value, 0b100 | (1 if on else 0))
+        return frame(243, 199, fid, rid, did, value, 1 if on else 0)
+
+    def sensor_frame(self, key) -> bytes:
+        fid, rid, sensor = key
+        return frame(243, 198, fid, rid, self.sensors[key], sensor, 0)
+
+    def dump(self, fid: int = 255, rid: int = 255, did: int = 255) -> List[bytes]:
+        """State frames of the devices matching the address, 255 matches everything"""
+
+        def match(key):
+            return ((fid == 255 or key[0] == fid) and (rid == 255 or key[1] == rid)
+                    and (did == 255 or key[2] == did))
+
+        frames = [self.device_frame(key) for key in self.devices if match(key)]
+        if did == 255:
+            frames += [self.sensor_frame(key) for key in self.sensors if match(key[:2] + (255,))]
+            rooms = sorted({key[:2] for key in self.devices if match(key[:2] + (255,))})
+            frames += [frame(243, 129, f, r, SCENES[0], 0, 0) for f, r in rooms]
+        return frames
+
+    def _targets(self, fid, rid, did):
+        """Devices addressed by a command, did/rid 0 address the lights and switches of the whole room/floor"""
+        if did:
+            return [(fid, rid, did)] if (fid, rid, did) in self.devices else []
+        return [key for key in self.devices
+                if key[0] == fid and (rid == 0 or key[1] == rid) and self.devices[key][0] in GROUP_KINDS]
+
+    def apply(self, b: bytes) -> List[bytes]:
+        """Apply a command frame, return the state frames it changed"""
+        d1, d2, d3, d4, d5, d6 = b[0], b[1], b[2], b[3], b[4], b[5]
+        changed = []
+        if d1 == 243 and d2 in (154, 158, 159):
+            for key in self._targets(d3, d4, d5):
+                state = self.devices[key]
+                state[2] = True if d2 == 154 else False if d2 == 158 else not state[2]
+                changed.append(key)
+        elif d1 == 243 and d2 in (160, 161, 164, 165):
+            for key in self._targets(d3, d4, d5):
+                state = self.devices[key]
+                if d2 == 165:
+                    state[1] = min(d6, 15)
+                elif d2 == 164 and state[0] == CURTAIN:
+                    state[1] = min(d6, 100)
+                elif d2 in (160, 161):
+                    state[1] = max(0, min(15, state[1] + (1 if d2 == 160 else -1)))
+                state[2] = True
+                changed.append(key)
+        elif d1 == 46:
+            key = (d2, d3, d4)
+            if key in self.devices:
+                self.devices[key][1] = d5
+                changed.append(key)
+        elif d1 == 237:
+            return [frame(243, 129, d2, d3, d4, 0, 0)]
+        return [self.device_frame(key) for key in changed]
+
+    def random_event(self) -> bytes:
+        """A device switched on the wall or a sensor reading that changed"""
+        if self.random.random() < 0.5:
+            key = self.random.choice(list(self.sensors))
+            self.sensors[key] = max(0, self.sensors[key] + self.random.choice((-1, 1)))
+            return self.sensor_frame(key)
+        key = self.random.choice(list(self.devices))
+        self.devices[key][2] = not self.devices[key][2]
+        return self.device_frame(key)
+
+
+class GatewaySession:
+    """One client connection: login, commands, and the outgoing frames delayed/lost as configured"""
+
+    def __init__(self, simulator: 'GatewaySimulator', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.simulator = simulator
+        self.reader = reader
+        self.writer = writer
+        self.authed = False
+        self._outgoing: asyncio.Queue = asyncio.Queue()
+        self._password: List[int] = []
+
+    def send(self, data: bytes, lossy: bool = True):
+        sim = self.simulator
+        if lossy and sim.loss and sim.random.random() < sim.loss:
+            sim.stats['frames_lost'] += 1
+            return
+        delay = max(0.0, sim.latency + sim.random.uniform(-sim.jitter, sim.jitter))
+        self._outgoing.put_nowait((time.monotonic() + delay, data))
+
+    async def _write_loop(self):
+        # Frames keep their order, each one waits for its own due time
+        while True:
+            due, data = await self._outgoing.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.writer.write(data)
+            self.simulator.stats['frames_sent'] += 1
+            await self.writer.drain()
+
+    async def run(self):
+        writer_task = asyncio.create_task(self._write_loop())
+        try:
+            if self.simulator.code is not None and not await self._lc_handshake():
+                return
+            while True:
+                b = await self.reader.readexactly(8)
+                self.simulator.stats['frames_received'] += 1
+                self._handle(b)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer_task.cancel()
+            self.writer.close()
+
+    async def _lc_handshake(self) -> bool:
+        challenge = bytearray(37)
+        challenge[4] = 0x01
+        challenge[21:37] = os.urandom(16)
+        self.send(bytes(challenge), lossy=False)
+        answer = await self.reader.readexactly(37)
+        expected = self.simulator.crypto.decrypt(challenge[21:37])
+        result = bytearray(37)
+        result[4] = 0x05
+        result[21] = 0x01 if answer[4] == 0x04 and answer[21:37] == expected else 0x00
+        self.send(bytes(result), lossy=False)
+        self.authed = result[21] == 0x01
+        return self.authed
+
+    def _handle(self, b: bytes):
+        if b[7] != Instruction.checksum(b):
+            return
+        d1, d2 = b[0], b[1]
+        if d1 == 243 and d2 == 131:
+            # Password frames, the one full of 255 ends the login
+            digits = [v for v in b[3:7] if v != 255]
+            self._password += digits
+            if len(digits) < 4:
+                ok = self._password == self.simulator.password
+                self.authed = self.authed or ok
+                self._password = []
+                self.send(frame(243, 130, 0, 0, 0, 0, 0) if ok else frame(243, 130, 1, 1, 1, 1, 1))
+            return
+        if not self.authed:
+            return
+        if tuple(b[:7]) == HEARTBEAT:
+            self.send(b)
+        elif d1 == 243 and d2 == 166:
+            # Full (255) or targeted state query
+            for data in self.simulator.home.dump(b[2], b[3] if b[2] != 255 else 255, b[4] if b[2] != 255 else 255):
+                self.send(data)
+        elif d1 == 243 and d2 in (168, 180, 110):
+            # Other parts of the full query, nothing simulated behind them
+            pass
+        else:
+            for data in self.simulator.home.apply(b):
+                self.simulator.broadcast(data)
+
+
+class GatewaySimulator:
+
+    def __init__(self, home: SimulatedHome, host: str = '127.0.0.1', port: int = 4196, password: str = '1234',
+                 code: Optional[str] = None, event_rate: float = 0.0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, loss: float = 0.0, drop_every: float = 0.0, seed: int = 0):
+        """
+        :param code: secure code, enables the LC handshake
+        :param event_rate: spontaneous state changes per second
+        :param latency_ms / jitter_ms: delay of every outgoing frame
+        :param loss: probability that an outgoing state frame is lost
+        :param drop_every: close all the connections every N seconds, 0 never
+        """
+        self.home = home
+        self.host = host
+        self.port = port
+        self.password = [ord(c) - 48 for c in password]
+        self.code = code
+        self.crypto = None
+        if code is not None:
+            from klwiot.klw_security import Crypto
+            self.crypto = Crypto.session(code)
+        self.event_rate = event_rate
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.loss = loss
+        self.drop_every = drop_every
+        self.random = random.Random(seed)
+        self.sessions: List[GatewaySession] = []
+        self.stats = {'connections': 0, 'frames_received': 0, 'frames_sent': 0, 'frames_lost': 0, 'events': 0}
+        self._server = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.event_rate > 0:
+            self._tasks.append(asyncio.create_task(self._events()))
+        if self.drop_every > 0:
+            self._tasks.append(asyncio.create_task(self._drops()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self.drop_connections()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def broadcast(self, data: bytes):
+        for session in self.sessions:
+            if session.authed:
+                session.send(data)
+
+    def drop_connections(self):
+        for session in list(self.sessions):
+            session.writer.close()
+
+    async def _on_connection(self, reader, writer):
+        session = GatewaySession(self, reader, writer)
+        self.sessions.append(session)
+        self.stats['connections'] += 1
+        try:
+            await session.run()
+        finally:
+            self.sessions.remove(session)
+
+    async def _events(self):
+        while True:
+            await asyncio.sleep(self.random.expovariate(self.event_rate))
+            self.stats['events'] += 1
+            self.broadcast(self.home.random_event())
+
+    async def _drops(self):
+        while True:
+            await asyncio.sleep(self.drop_every)
+            self.drop_connections()
+
+
+async def serve(args):
+    home = SimulatedHome(args.floors, args.rooms, args.devices, args.seed)
+    simulator = GatewaySimulator(home, args.host, args.port, args.password, args.code if args.lc else None,
+                                 args.event_rate, args.latency, args.jitter, args.loss, args.drop_every, args.seed)
+    await simulator.start()
+    print(f"Simulating {len(home.devices)} devices and {len(home.sensors)} sensors on {args.host}:{simulator.port}"
+          f"{' (LC handshake)' if args.lc else ''}", flush=True)
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            print(json.dumps(dict(simulator.stats, sessions=len(simulator.sessions))), flush=True)
+    finally:
+        await simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4196)
+    parser.add_argument('--password', default='1234')
+    parser.add_argument('--lc', action='store_true', help='client mode gateway, AES handshake before the frames')
+    parser.add_argument('--code', default='8888666688886666', help='secure code of the LC handshake')
+    parser.add_argument('--floors', type=int, default=1)
+    parser.add_argument('--rooms', type=int, default=4, help='rooms per floor')
+    parser.add_argument('--devices', type=int, default=8, help='devices per room')
+    parser.add_argument('--event-rate', type=float, default=1.0, help='spontaneous state changes per second')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of the outgoing frames, in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- part of the delay, in ms')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability to lose an outgoing frame')
+    parser.add_argument('--drop-every', type=float, default=0.0, help='close the connections every N seconds')
+    parser.add_argument('--stats-interval', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
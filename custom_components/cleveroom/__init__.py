@@ -6,19 +6,24 @@ For more detailed information, please refer to: https://www.cleveroom.com
 
 import asyncio
 import logging
-from typing import cast
+import threading
+import time
+from typing import Dict, List, Optional, cast
 
 import re
 
+import voluptuous as vol
+
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, callback
-from homeassistant.const import CONF_HOST, CONF_PORT, CONF_PASSWORD
+from homeassistant.core import HomeAssistant, ServiceCall, callback
+from homeassistant.const import CONF_HOST, CONF_PORT, CONF_PASSWORD, ATTR_ENTITY_ID, ATTR_DEVICE_ID, ATTR_AREA_ID
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers import translation
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.service import async_extract_entity_ids
 
 from .klwiot import (KLWIOTClientLC, KLWIOTClient, KLWBroadcast, DeviceType, has_method
-, BucketDataManager)
+, BucketDataManager, GatewayManager, GatewayDiscovery, SensorFilter, SensorPolicy, SENSOR_CLASSES)
 
 _LOGGER = logging.getLogger(__name__)
 DOMAIN = "cleveroom"
@@ -29,6 +34,33 @@ CONF_DISCOVERED_DEVICES = "discovered_devices"
 CONF_SYSTEM_LEVEL = "system_level"
 CONF_AUTO_CREATE_AREA = "auto_create_area"
 CONF_SECURE_CODE = "secure_code"
+# options
+CONF_ENABLE_METRICS = "enable_metrics"
+CONF_SENSOR_AVERAGE_WINDOW = "sensor_average_window"
+# per sensor class (SENSOR_CLASSES): "<class>_deadband", "<class>_min_interval"
+CONF_SENSOR_DEADBAND = "{}_deadband"
+CONF_SENSOR_MIN_INTERVAL = "{}_min_interval"
+# services
+SERVICE_PROFILE = "profile"
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_GATEWAY_ID): cv.string,
+        vol.Optional("duration", default=30): vol.All(vol.Coerce(int), vol.Range(min=1, max=600)),
+        vol.Optional("interval", default=5): vol.All(vol.Coerce(int), vol.Range(min=1, max=1000)),
+    }
+)
+SERVICE_REFRESH = "refresh"
+REFRESH_SCHEMA = vol.Schema(
+    {
+        **cv.ENTITY_SERVICE_FIELDS,
+        vol.Optional(CONF_GATEWAY_ID): cv.string,
+        vol.Optional("floor"): vol.All(vol.Coerce(int), vol.Range(min=0, max=254)),
+        vol.Optional("room"): vol.All(vol.Coerce(int), vol.Range(min=0, max=254)),
+        vol.Optional("max_age"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        # unverified protocol: the scoped queries of KLWIOTClient.refresh
+        vol.Optional("scoped", default=False): cv.boolean,
+    }
+)
 # gateway.py work mode
 GATEWAY_TYPE_SERVER = 0
 GATEWAY_TYPE_CLIENT = 1
@@ -82,15 +114,19 @@ async def async_setup_entry(hass: HomeAssistant,
         f"type：{GATEWAY_TYPES[gateway_type]}，address：{host}:{port} language:{language}")
     # zh-Hans
 
-    file_path = f'./{gateway_id}.json'  # Construct the file path
-    bucket_data_manager = BucketDataManager(file_path)
+    bucket_data_manager = BucketDataManager(bucket_file_path(gateway_id))
+
+    async def async_save_bucket():
+        start = time.perf_counter()
+        await bucket_data_manager.async_save_data(device_bucket.get_bucket())
+        if client.metrics.enabled:
+            client.metrics.observe("persist_ms", (time.perf_counter() - start) * 1000)
 
     @callback
     def data_changed_callback():
         """Callback to save data when it changes."""
         if device_bucket:
-            asyncio.run_coroutine_threadsafe(
-                bucket_data_manager.async_save_data(device_bucket.get_bucket()), hass.loop)
+            asyncio.run_coroutine_threadsafe(async_save_bucket(), hass.loop)
 
     client = None
     if gateway_type == GATEWAY_TYPE_SERVER:
@@ -126,6 +162,11 @@ async def async_setup_entry(hass: HomeAssistant,
     # client.enable_logger()
     device_bucket = client.devicebucket
     await device_bucket.async_load_data()
+    # Known states, the full-state dump after connecting only reports the changes
+    client.restore_buffers()
+    client.metrics.enabled = entry.options.get(CONF_ENABLE_METRICS, False)
+    client.tracer.enabled = client.metrics.enabled
+    client.sensor_filter = create_sensor_filter(entry.options)
     # add the listener for client
     client.on("on_login_success", on_login_success)
     client.on("on_login_failed", on_login_failed)
@@ -141,13 +182,36 @@ async def async_setup_entry(hass: HomeAssistant,
         "client": client,
         "auto_area": auto_area,
         "devices": [],
+        # devices per platform, and the new device handler of every platform, see classify_devices
+        "platform_devices": {platform: [] for platform in PLATFORMS},
+        "platform_listeners": {},
+        "options": dict(entry.options),
     }
-
-    # connect_result = await hass.async_add_executor_job(client.connect)
-    if not await hass.async_add_executor_job(client.connect):
-        _LOGGER.error("Cleveroom connect failure")
-        return False
-    await discover_cleveroom_devices(hass, entry, client)
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
+
+    # Follow the gateway when it gets a new address (DHCP), the new host is saved in the entry
+    discovery = GatewayDiscovery()
+    discovery.start()
+    hass.data[DOMAIN][entry.entry_id]["remove_address_listener"] = discovery.on(
+        "on_address_change", on_address_change_wrapper(hass, entry))
+
+    if not hass.services.has_service(DOMAIN, SERVICE_PROFILE):
+        hass.services.async_register(DOMAIN, SERVICE_PROFILE, profile_service_wrapper(hass), schema=PROFILE_SCHEMA)
+    if not hass.services.has_service(DOMAIN, SERVICE_REFRESH):
+        hass.services.async_register(DOMAIN, SERVICE_REFRESH, refresh_service_wrapper(hass), schema=REFRESH_SCHEMA)
+
+    # Fast start: the entities are created from the persisted bucket, unavailable until the gateway link is up,
+    # and the connect runs in the background, off Home Assistant's startup path
+    fast_start = bool(device_bucket.get_bucket_values())
+    if fast_start:
+        restore_cleveroom_devices(hass, entry, client)
+    else:
+        # First start, nothing is known yet: wait for the full-state dump of the gateway
+        # All the gateways are multiplexed by the manager, connects are staggered
+        if not await hass.async_add_executor_job(GatewayManager().connect, client):
+            _LOGGER.error("Cleveroom connect failure")
+            return False
+        await discover_cleveroom_devices(hass, entry, client)
     # 创建 Cleveroom 网关设备
 
     # Register platforms
@@ -155,9 +219,27 @@ async def async_setup_entry(hass: HomeAssistant,
 
     # register listener after all flatfroms config
     client.on("on_device_change", on_device_change_wrapper(hass, entry))
+    client.on("on_connect_change", on_link_change_wrapper(hass, entry))
+    client.on("on_freshness_change", on_freshness_change_wrapper(hass, entry))
+    if fast_start:
+        async def async_connect():
+            # a failed attempt is retried by the manager
+            await hass.async_add_executor_job(GatewayManager().connect, client)
+
+        entry.async_create_background_task(hass, async_connect(), f"cleveroom_connect_{gateway_id}")
     return True
 
 
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry):
+    """
+        Reload the entry when its options changed.
+        Note: the entry data also changes when the gateway moves, that is already handled by the client.
+    """
+    gateway_data = hass.data[DOMAIN].get(entry.entry_id)
+    if gateway_data and gateway_data["options"] != dict(entry.options):
+        await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     """
         Unload a config entry.
@@ -166,15 +248,35 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
         client = hass.data[DOMAIN][entry.entry_id]["client"]  # 使用 entry.entry_id 获取正确的 client
-        # clean cache
+        # clean cache, the persisted devices are kept for the next fast start
+        client.devicebucket.persistence = False
         client.devicebucket.clear_bucket()
         # stop client
         client.stop()
         # remove the client from hass.data
-        hass.data[DOMAIN].pop(entry.entry_id)
+        gateway_data = hass.data[DOMAIN].pop(entry.entry_id)
+        gateway_data["remove_address_listener"]()
+        ENTITY_REGISTRY.pop(entry.entry_id, None)
+        if not hass.data[DOMAIN]:
+            GatewayDiscovery().stop()
+            hass.services.async_remove(DOMAIN, SERVICE_PROFILE)
+            hass.services.async_remove(DOMAIN, SERVICE_REFRESH)
     return unload_ok
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry):
+    """
+        Remove a config entry.
+        Note: called after the unload when the integration is deleted, the persisted devices go with it.
+    """
+    await BucketDataManager(bucket_file_path(entry.data[CONF_GATEWAY_ID])).async_delete_data()
+
+
+def bucket_file_path(gateway_id: str) -> str:
+    """File of the persisted devices of a gateway"""
+    return f'./{gateway_id}.json'
+
+
 def get_translation(hass: HomeAssistant, key: str, default_value) -> str:
     """
     Get the translation for a given key.
@@ -194,14 +296,34 @@ async def discover_cleveroom_devices(hass: HomeAssistant, entry: ConfigEntry, cl
         # Not all devices in the bucket are supported. ！！！
         devices = client.devicebucket.get_bucket_values()
         _LOGGER.debug(f"Discovered {len(devices)} devices")
-        # Save devices to hass.data
+        # Save devices to hass.data, every platform gets its own slice
         hass.data[DOMAIN][entry.entry_id]["devices"] = devices
+        hass.data[DOMAIN][entry.entry_id]["platform_devices"] = classify_devices(devices)
         return devices
     except Exception as e:
         _LOGGER.exception(f"Discover Cleveroom Failure: {e}")
         return []
 
 
+def create_sensor_filter(options) -> SensorFilter:
+    """Report policies of the environment sensors from the entry options, nothing is filtered by default."""
+    policies = {
+        sensor_class: SensorPolicy(options.get(CONF_SENSOR_DEADBAND.format(sensor_class), 0),
+                                   options.get(CONF_SENSOR_MIN_INTERVAL.format(sensor_class), 0))
+        for sensor_class in SENSOR_CLASSES
+    }
+    return SensorFilter(policies, options.get(CONF_SENSOR_AVERAGE_WINDOW, 0))
+
+
+def restore_cleveroom_devices(hass: HomeAssistant, entry: ConfigEntry, client: KLWIOTClient):
+    """Take the devices of the persisted bucket, the live frames refresh them once connected."""
+    devices = client.devicebucket.get_bucket_values()
+    _LOGGER.debug(f"Restored {len(devices)} devices")
+    hass.data[DOMAIN][entry.entry_id]["devices"] = devices
+    hass.data[DOMAIN][entry.entry_id]["platform_devices"] = classify_devices(devices)
+    return devices
+
+
 def on_login_success():
     """
     Cleveroom Login Success
@@ -221,6 +343,130 @@ def on_connect_change(state):
     Cleveroom Connect State Change
     """
     _LOGGER.info(f"Cleveroom connect state Change to: {state}")
+    if not state:
+        # The gateway may have moved, look for it now rather than at the next periodic probe
+        GatewayDiscovery().probe()
+
+
+def on_address_change_wrapper(hass: HomeAssistant, entry: ConfigEntry):
+    """
+    Cleveroom Gateway Address Change
+    """
+    def on_address_change(sid, info):
+        port = info.get("localport") or entry.data.get(CONF_PORT)
+        if sid != entry.data[CONF_GATEWAY_ID] or (entry.data.get(CONF_HOST), entry.data.get(CONF_PORT)) == (
+                info["ip"], port):
+            return
+        _LOGGER.info("Cleveroom gateway %s moved to %s:%s", sid, info["ip"], port)
+        hass.config_entries.async_update_entry(entry, data={**entry.data, CONF_HOST: info["ip"], CONF_PORT: port})
+
+    return on_address_change
+
+
+def profile_service_wrapper(hass: HomeAssistant):
+    """
+        cleveroom.profile: sample the stacks of the gateway threads and of the event loop for a while,
+        then write a flame graph compatible report (folded stacks) per gateway to the config directory.
+    """
+
+    async def profile(client: KLWIOTClient, duration: int, interval: int):
+        loop_thread = {threading.get_ident(): "event_loop"}
+        client.start_profiling(interval / 1000, duration, loop_thread)
+        await asyncio.sleep(duration)
+        profiler = client.stop_profiling()
+        if not profiler:
+            return
+        path = hass.config.path(f"cleveroom_profile_{client.client_id}_{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        await hass.async_add_executor_job(profiler.write_folded, path)
+        _LOGGER.warning("Cleveroom profile of %s written to %s (%d samples)", client.client_id, path,
+                        profiler.samples)
+
+    async def handle_profile(call: ServiceCall):
+        gateway_id = call.data.get(CONF_GATEWAY_ID)
+        clients = [gateway_data["client"] for gateway_data in hass.data.get(DOMAIN, {}).values()
+                   if not gateway_id or gateway_data["gateway_id"] == gateway_id]
+        if not clients:
+            _LOGGER.warning("No Cleveroom gateway %s to profile", gateway_id or "")
+            return
+        # Runs in the background, the service call returns right away
+        for client in clients:
+            hass.async_create_task(profile(client, call.data["duration"], call.data["interval"]))
+
+    return handle_profile
+
+
+def refresh_service_wrapper(hass: HomeAssistant):
+    """
+        cleveroom.refresh: query the states of the targeted entities, of a floor or room, or of all the devices,
+        with max_age only those the gateway did not report for that many seconds.
+        The gateway is asked for a full dump unless scoped (unverified) queries are requested.
+        The known states are kept, only the devices that changed raise an event.
+    """
+
+    async def handle_refresh(call: ServiceCall):
+        gateway_id = call.data.get(CONF_GATEWAY_ID)
+        floor, room, max_age = call.data.get("floor"), call.data.get("room"), call.data.get("max_age")
+        scoped = call.data.get("scoped", False)
+        targeted = any(call.data.get(key) for key in (ATTR_ENTITY_ID, ATTR_DEVICE_ID, ATTR_AREA_ID))
+        entity_ids = await async_extract_entity_ids(hass, call) if targeted else set()
+        for entry_id, gateway_data in hass.data.get(DOMAIN, {}).items():
+            if gateway_id and gateway_data["gateway_id"] != gateway_id:
+                continue
+            client: KLWIOTClient = gateway_data["client"]
+            if targeted:
+                addresses = [client.device_address(oid) for oid, entity in ENTITY_REGISTRY.get(entry_id, {}).items()
+                             if entity.entity_id in entity_ids]
+                queries = client.refresh_devices([a for a in addresses if a], max_age, scoped)
+            elif max_age is not None:
+                queries = client.refresh_devices([a for a in client.stale_devices(max_age)
+                                                  if floor in (None, a[0]) and room in (None, a[1])], scoped=scoped)
+            elif floor is not None:
+                client.refresh(floor, 255 if room is None else room, 255, scoped)
+                queries = 1
+            else:
+                client.refresh()
+                queries = 1
+            _LOGGER.debug("Cleveroom refresh of %s: %d queries", gateway_data["gateway_id"], queries)
+
+    return handle_refresh
+
+
+def on_link_change_wrapper(hass: HomeAssistant, entry: ConfigEntry):
+    """
+    Flip the availability of all the gateway entities when its link goes up or down,
+    and write their states in a single loop callback.
+    The restored states that the gateway confirms raise no device change.
+    """
+    @callback
+    def write_states(state):
+        # The link may have flipped again before the callback ran
+        client = hass.data[DOMAIN].get(entry.entry_id, {}).get("client")
+        available = bool(state and client and client.is_living())
+        for entity in list(ENTITY_REGISTRY.get(entry.entry_id, {}).values()):
+            if entity.set_available(available) and entity.platform:
+                entity.async_write_ha_state()
+
+    def on_link_change(state):
+        hass.loop.call_soon_threadsafe(write_states, state)
+
+    return on_link_change
+
+
+def on_freshness_change_wrapper(hass: HomeAssistant, entry: ConfigEntry):
+    """
+    Mark unavailable the entities of the devices the gateway stopped reporting while its link is up,
+    and write their states in a single loop callback.
+    """
+    @callback
+    def write_states(stale):
+        for oid, entity in list(ENTITY_REGISTRY.get(entry.entry_id, {}).items()):
+            if entity.set_stale(oid in stale) and entity.platform:
+                entity.async_write_ha_state()
+
+    def on_freshness_change(stale):
+        hass.loop.call_soon_threadsafe(write_states, stale)
+
+    return on_freshness_change
 
 
 def on_device_change_wrapper(hass: HomeAssistant, entry: ConfigEntry):
@@ -228,6 +474,15 @@ def on_device_change_wrapper(hass: HomeAssistant, entry: ConfigEntry):
     Cleveroom Device Change
     """
     def on_device_change(device, is_new):
+        if is_new:
+            # Route the new device to its platform
+            gateway_data = hass.data[DOMAIN].get(entry.entry_id)
+            platform = classify_device(device)
+            listener = gateway_data and gateway_data["platform_listeners"].get(platform)
+            if listener:
+                gateway_data["platform_devices"][platform].append(device)
+                listener(device)
+            return
         oid = device.get("oid")
         entity = ENTITY_REGISTRY.get(entry.entry_id, {}).get(oid)
         if entity:
@@ -356,6 +611,48 @@ def is_heater(device):
     return device["detail"]["category"] == DeviceType.FLOOR_HEATING
 
 
+# Candidate platforms of every category, checked in order with their predicate
+CATEGORY_PLATFORMS = {
+    DeviceType.TOGGLE_LIGHT: (("light", is_light),),
+    DeviceType.ADJUST_LIGHT: (("light", is_light),),
+    DeviceType.RGB_LIGHT: (("light", is_light),),
+    DeviceType.WARM_LIGHT: (("light", is_light),),
+    DeviceType.RGBW_LIGHT: (("light", is_light),),
+    DeviceType.SENSOR: (("sensor", is_sensor), ("binary_sensor", is_binary_sensor)),
+    DeviceType.DRY: (("binary_sensor", is_binary_sensor),),
+    DeviceType.AIR_CONDITION: (("climate", is_climate),),
+    DeviceType.FLOOR_HEATING: (("climate", is_heater),),
+    DeviceType.CURTAIN: (("cover", is_cover),),
+    DeviceType.TOGGLE: (("switch", is_switch),),
+    DeviceType.FRESH_AIR: (("fan", is_fan),),
+    DeviceType.SECURITY: (("alarm_control_panel", is_alarm_control_panel),),
+    DeviceType.SCENE: (("scene", is_scene),),
+    DeviceType.MUSIC_PLAYER: (("media_player", is_media_player),),
+}
+
+
+def classify_device(device) -> Optional[str]:
+    """Return the platform of the device, None when it is not supported."""
+    for platform, predicate in CATEGORY_PLATFORMS.get(device["detail"]["category"], ()):
+        if predicate(device):
+            return platform
+    return None
+
+
+def classify_devices(devices) -> Dict[str, List[dict]]:
+    """Split the devices by platform in a single pass."""
+    platform_devices = {platform: [] for platform in PLATFORMS}
+    for device in devices:
+        try:
+            platform = classify_device(device)
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
+            continue
+        if platform:
+            platform_devices[platform].append(device)
+    return platform_devices
+
+
 def generate_object_id(gateway_id: str, oid: str) -> str:
     """
     Generate a unique object ID for the entity.
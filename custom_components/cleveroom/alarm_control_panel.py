@@ -25,7 +25,7 @@ import logging
 
 from .base import KLWEntity
 from . import (DOMAIN, KLWIOTClient, ENTITY_REGISTRY,
-               get_translation, is_alarm_control_panel, generate_object_id)
+               get_translation, generate_object_id)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -36,7 +36,7 @@ async def async_setup_entry(
         async_add_entities: AddEntitiesCallback,
 ) -> None:
     gateway_data = hass.data[DOMAIN][entry.entry_id]
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["alarm_control_panel"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -44,34 +44,31 @@ async def async_setup_entry(
 
     for device in devices:
         try:
-            if is_alarm_control_panel(device):
-                security = CleveroomAlarmControlPanel(hass, device, client, gateway_id,auto_area)
-                securitys.append(security)
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][security.unique_id] = security
+            security = CleveroomAlarmControlPanel(hass, device, client, gateway_id,auto_area)
+            securitys.append(security)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][security.unique_id] = security
         except Exception as e:
             _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
 
     async_add_entities(securitys)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_alarm_control_panel(device):
-                    _LOGGER.info(f"add alarm panel new devices: {device['oid']}")
-                    security = CleveroomAlarmControlPanel(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [security], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][security.unique_id] = security
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add alarm panel new devices: {device['oid']}")
+            security = CleveroomAlarmControlPanel(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(hass, async_add_entities, [security], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][security.unique_id] = security
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
 
     async def async_add_entities_wrapper(hass, async_add_entities, entities,
                                          update_before_add = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["alarm_control_panel"] = async_device_discovered
 
 
 class CleveroomAlarmControlPanel(KLWEntity,AlarmControlPanelEntity):
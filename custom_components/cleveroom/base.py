@@ -18,6 +18,11 @@ class KLWEntity(Entity):
         self._full_name = f"{detail.get("fName", "")} {detail.get("rName", "")} {detail.get("dName", "")}".strip()
         self._object_id = generate_object_id(gateway_id, self._oid)
         self._name = self._full_name
+        # Pushed: follows the gateway link (set_available), the freshness of the device (set_stale)
+        # and its presence in the bucket
+        self._link_available = bool(self._client.is_living())
+        self._stale = self._oid in self._client.stale_oids
+        self._attr_available = self._link_available and not self._stale
 
         if auto_area == 1:
             self._attr_device_info = DeviceInfo(
@@ -41,12 +46,22 @@ class KLWEntity(Entity):
     def name(self) -> str:
         return self._name
 
-    @property
-    def available(self) -> bool:
-        """Return if entity is available."""
-        # 检查设备是否在线或可用
-        device = self._client.devicebucket.get_device_from_database(self._oid)
-        return device is not None
+    def set_available(self, available: bool) -> bool:
+        """Set the gateway link state, return True when the availability changed."""
+        self._link_available = available
+        return self._apply_available()
+
+    def set_stale(self, stale: bool) -> bool:
+        """Set whether the gateway stopped reporting the device, return True when the availability changed."""
+        self._stale = stale
+        return self._apply_available()
+
+    def _apply_available(self) -> bool:
+        available = self._link_available and not self._stale
+        if self._attr_available == available:
+            return False
+        self._attr_available = available
+        return True
 
     # async def async_added_to_hass(self) -> None:
     #     """Run when entity about to be added to hass."""
@@ -59,8 +74,13 @@ class KLWEntity(Entity):
         """
         try:
             device = self._client.devicebucket.get_device_from_database(self._oid)
+            # 检查设备是否在线或可用
+            self._link_available = bool(self._client.is_living())
+            self._attr_available = device is not None and self._link_available and not self._stale
             if device is None:
                 _LOGGER.error(f"Device not found: {self._oid}")
+                if self.entity_id and self.platform:
+                    self.async_write_ha_state()
                 return
             self.init_or_update_entity_state(device)
             if self.entity_id:
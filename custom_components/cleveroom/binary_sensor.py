@@ -24,7 +24,7 @@ from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 from homeassistant.config_entries import ConfigEntry
 from . import (DOMAIN, ENTITY_REGISTRY, KLWIOTClient, DeviceType,
-               device_registry_area_update, is_binary_sensor,
+               device_registry_area_update,
                generate_object_id)
 from homeassistant.helpers import floor_registry as fr
 from homeassistant.helpers import area_registry as ar
@@ -41,7 +41,7 @@ async def async_setup_entry(  # Changed to async_setup_entry
         async_add_entities: AddEntitiesCallback,
 ) -> None:
     gateway_data = hass.data[DOMAIN][entry.entry_id]  # Access data from entry
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["binary_sensor"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -51,14 +51,13 @@ async def async_setup_entry(  # Changed to async_setup_entry
     binary_sensors = []
     for device in devices:
         try:
-            if is_binary_sensor(device):
-                if auto_area == 1:
-                    await device_registry_area_update(
-                        floor_registry, area_registry, device_registry, entry, device)
-                sensor = CleveroomBinarySensor(hass, device, client, gateway_id,auto_area)
-                binary_sensors.append(sensor)
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
+            if auto_area == 1:
+                await device_registry_area_update(
+                    floor_registry, area_registry, device_registry, entry, device)
+            sensor = CleveroomBinarySensor(hass, device, client, gateway_id,auto_area)
+            binary_sensors.append(sensor)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
         except Exception as e:
             _LOGGER.warning(
                 f"Device data is incomplete, skip: {device.get('oid', 'unknow')}"
@@ -66,25 +65,23 @@ async def async_setup_entry(  # Changed to async_setup_entry
 
     async_add_entities(binary_sensors)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_binary_sensor(device):
-                    _LOGGER.info(f"add binary sensor new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    sensor = CleveroomBinarySensor(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(
-                            hass, async_add_entities, [sensor], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')},"
-                                f" error message: {e}")
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add binary sensor new devices: {device['oid']}")
+            if auto_area == 1:
+                asyncio.run_coroutine_threadsafe(
+                    device_registry_area_update(
+                        floor_registry, area_registry, device_registry, entry, device),
+                    hass.loop)
+            sensor = CleveroomBinarySensor(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(
+                    hass, async_add_entities, [sensor], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')},"
+                            f" error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -92,7 +89,7 @@ async def async_setup_entry(  # Changed to async_setup_entry
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["binary_sensor"] = async_device_discovered
 
 
 class CleveroomBinarySensor(KLWEntity,BinarySensorEntity):
@@ -71,10 +71,10 @@ class QueryStatusButton(ButtonEntity):
         self._client = cast(KLWIOTClient, client)
 
     async def async_press(self) -> None:
-        _LOGGER.info("Clear all the buffers then query rediscover devices...")
+        _LOGGER.info("Query the states of all the devices...")
         try:
-            self._client.clear_all_buffers()
-            self._client.query_all_devices()
+            # The known states are kept, only the new and changed devices raise an event
+            self._client.refresh()
         except Exception as e:
             _LOGGER.error(f"Failed to call Query Cleveroom Gateway Devices service: {e}")
 
@@ -77,7 +77,7 @@ async def async_setup_entry(
         async_add_entities: AddEntitiesCallback,
 ) -> None:
     gateway_data = hass.data[DOMAIN][entry.entry_id]
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["climate"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -110,36 +110,35 @@ async def async_setup_entry(
 
     async_add_entities(climates)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_climate(device):
-                    _LOGGER.info(f"add light new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    climate = CleveroomClimate(hass, device, client, gateway_id,auto_area)
+    def async_device_discovered(device):
+        try:
+            if is_climate(device):
+                _LOGGER.info(f"add light new devices: {device['oid']}")
+                if auto_area == 1:
                     asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [climate], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][climate.unique_id] = climate
-                elif is_heater(device):
-                    _LOGGER.info(f"add light new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    climate = CleveroomFloorHeating(hass, device, client, gateway_id,auto_area)
+                        device_registry_area_update(
+                            floor_registry, area_registry, device_registry, entry, device),
+                        hass.loop)
+                climate = CleveroomClimate(hass, device, client, gateway_id,auto_area)
+                asyncio.run_coroutine_threadsafe(
+                    async_add_entities_wrapper(hass, async_add_entities, [climate], False), hass.loop)
+                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+                ENTITY_REGISTRY[entry.entry_id][climate.unique_id] = climate
+            elif is_heater(device):
+                _LOGGER.info(f"add light new devices: {device['oid']}")
+                if auto_area == 1:
                     asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [climate], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][climate.unique_id] = climate
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
-                                f"error message: {e}")
+                        device_registry_area_update(
+                            floor_registry, area_registry, device_registry, entry, device),
+                        hass.loop)
+                climate = CleveroomFloorHeating(hass, device, client, gateway_id,auto_area)
+                asyncio.run_coroutine_threadsafe(
+                    async_add_entities_wrapper(hass, async_add_entities, [climate], False), hass.loop)
+                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+                ENTITY_REGISTRY[entry.entry_id][climate.unique_id] = climate
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
+                            f"error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -147,7 +146,7 @@ async def async_setup_entry(
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["climate"] = async_device_discovered
 
 
 class CleveroomClimate(KLWEntity,ClimateEntity):
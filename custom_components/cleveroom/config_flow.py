@@ -1,11 +1,11 @@
 """Config flow for Cleveroom integration."""
-import asyncio
 import logging
 from typing import Optional
 
 import voluptuous as vol
 from homeassistant import core
 from homeassistant import config_entries
+from homeassistant.core import callback
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_PASSWORD
 from homeassistant.data_entry_flow import FlowResult
 
@@ -19,6 +19,11 @@ from . import (
     CONF_AUTO_CREATE_AREA,
     CREATE_AREA_OPTIONS,
     CONF_SECURE_CODE,
+    CONF_ENABLE_METRICS,
+    CONF_SENSOR_AVERAGE_WINDOW,
+    CONF_SENSOR_DEADBAND,
+    CONF_SENSOR_MIN_INTERVAL,
+    SENSOR_CLASSES,
     SYSTEM_LEVEL_OPTIONS
 )
 from . import KLWBroadcast
@@ -72,9 +77,15 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self.discovered_devices = None
         self.device_options = None  # 添加 device_options 属性
         self._discovery_task = None  # 添加 _discovery_task 属性
+        self._found_gateways = []  # names of the gateways that answered so far, shown while searching
         self._selected_device = None  # 添加 _selected_device 属性
         self.gateway_type = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: config_entries.ConfigEntry) -> config_entries.OptionsFlow:
+        return OptionsFlowHandler(config_entry)
+
     async def async_step_user(self, user_input: Optional[dict] = None) -> FlowResult:
         """Handle the initial step."""
         if user_input is not None:
@@ -129,14 +140,24 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             step_id='discovery',
             progress_task=self._discovery_task,
             progress_action="discovering",
+            description_placeholders={
+                "found": str(len(self._found_gateways)),
+                "gateways": ", ".join(self._found_gateways) or "-",
+            },
         )
 
     async def _async_discover_devices(self):
-        """Discover devices."""
-        await asyncio.sleep(1)
+        """Discover devices, on the event loop: the search stops 1s after the last gateway answered."""
         broadcast = KLWBroadcast()
-        broadcast.init()
-        discovered_devices = broadcast.search()
+
+        def on_device_found(device):
+            # Streamed as the gateways answer: show it right away by running the progress step again
+            _LOGGER.info("Found Cleveroom gateway %s (%s:%s)", device['devName'], device['ip'], device['localport'])
+            self._found_gateways.append(f"{device['devName']} ({device['ip']})")
+            if not self._discovery_task.done():
+                self.hass.async_create_task(self.hass.config_entries.flow.async_configure(flow_id=self.flow_id))
+
+        discovered_devices = await broadcast.async_search(timeout=4.0, idle_timeout=1.0, listener=on_device_found)
         # add a default device to the top
         default_device1 = {'ip': '', 'devName': 'Next Step (Client)',
                            'localport': 4196, 'destport': 0,
@@ -152,6 +173,12 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         discovered_devices.insert(0, default_device1)
         return discovered_devices
 
+    @callback
+    def async_remove(self) -> None:
+        """The flow was closed, stop the search."""
+        if self._discovery_task and not self._discovery_task.done():
+            self._discovery_task.cancel()
+
     async def async_step_device_picker(self,
                                        user_input: Optional[dict] = None) -> FlowResult:
         """Show the device selection form."""
@@ -243,3 +270,32 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     vol.Required(CONF_AUTO_CREATE_AREA): vol.In(CREATE_AREA_OPTIONS),
                 }
             )
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle the options of a Cleveroom gateway."""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry):
+        self._entry = config_entry
+
+    async def async_step_init(self, user_input: Optional[dict] = None) -> FlowResult:
+        if user_input is not None:
+            return self.async_create_entry(title="", data={**self._entry.options, **user_input})
+
+        options = self._entry.options
+        schema = {
+            vol.Optional(CONF_ENABLE_METRICS, default=options.get(CONF_ENABLE_METRICS, False)): bool,
+        }
+        # Report policies of the environment sensors, 0 disables them
+        for sensor_class in SENSOR_CLASSES:
+            deadband = CONF_SENSOR_DEADBAND.format(sensor_class)
+            min_interval = CONF_SENSOR_MIN_INTERVAL.format(sensor_class)
+            schema[vol.Optional(deadband, default=options.get(deadband, 0))] = vol.All(
+                vol.Coerce(float), vol.Range(min=0))
+            schema[vol.Optional(min_interval, default=options.get(min_interval, 0))] = vol.All(
+                vol.Coerce(int), vol.Range(min=0, max=3600))
+        average_window = options.get(CONF_SENSOR_AVERAGE_WINDOW, 0)
+        schema[vol.Optional(CONF_SENSOR_AVERAGE_WINDOW, default=average_window)] = vol.All(
+            vol.Coerce(int), vol.Range(min=0, max=3600))
+
+        return self.async_show_form(step_id="init", data_schema=vol.Schema(schema))
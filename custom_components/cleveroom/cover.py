@@ -20,7 +20,7 @@ from homeassistant.helpers import area_registry as ar
 from homeassistant.helpers import device_registry as dr
 
 from .base import KLWEntity
-from . import DOMAIN, KLWIOTClient, ENTITY_REGISTRY, device_registry_area_update, DeviceType, is_cover, \
+from . import DOMAIN, KLWIOTClient, ENTITY_REGISTRY, device_registry_area_update, DeviceType, \
     generate_object_id
 
 _LOGGER = logging.getLogger(__name__)
@@ -32,7 +32,7 @@ async def async_setup_entry(  # Changed to async_setup_entry
         async_add_entities: AddEntitiesCallback,
 ) -> None:
     gateway_data = hass.data[DOMAIN][entry.entry_id]  # Access data from entry
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["cover"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
     client = hass.data[DOMAIN][entry.entry_id]["client"]
@@ -43,37 +43,34 @@ async def async_setup_entry(  # Changed to async_setup_entry
     covers = []
     for device in devices:
         try:
-            if is_cover(device):
-                if auto_area == 1:
-                    await device_registry_area_update(
-                        floor_registry, area_registry, device_registry, entry, device)
-                cover = CleveroomCover(hass, device, client, gateway_id,auto_area)
-                covers.append(cover)
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][cover.unique_id] = cover
+            if auto_area == 1:
+                await device_registry_area_update(
+                    floor_registry, area_registry, device_registry, entry, device)
+            cover = CleveroomCover(hass, device, client, gateway_id,auto_area)
+            covers.append(cover)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][cover.unique_id] = cover
         except Exception as e:
             _LOGGER.warning(
                 f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
 
     async_add_entities(covers)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_cover(device):
-                    _LOGGER.info(f"add cover new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    cover = CleveroomCover(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [cover], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][cover.unique_id] = cover
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add cover new devices: {device['oid']}")
+            if auto_area == 1:
+                asyncio.run_coroutine_threadsafe(
+                    device_registry_area_update(
+                        floor_registry, area_registry, device_registry, entry, device),
+                    hass.loop)
+            cover = CleveroomCover(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(hass, async_add_entities, [cover], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][cover.unique_id] = cover
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -81,7 +78,7 @@ async def async_setup_entry(  # Changed to async_setup_entry
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["cover"] = async_device_discovered
 
 
 class CleveroomCover(KLWEntity,CoverEntity):
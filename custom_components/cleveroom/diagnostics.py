@@ -0,0 +1,43 @@
+"""
+Cleveroom integration for Home Assistant - Diagnostics
+For more detailed information, please refer to: https://www.cleveroom.com
+"""
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD
+from homeassistant.core import HomeAssistant
+
+from . import DOMAIN, CONF_SECURE_CODE, KLWIOTClient, GatewayManager
+
+TO_REDACT = {CONF_PASSWORD, CONF_SECURE_CODE, "password"}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return the diagnostics of a gateway: connection, throughput, hot-path metrics, command latency"""
+    gateway_data = hass.data[DOMAIN][entry.entry_id]
+    client: KLWIOTClient = gateway_data["client"]
+    return {
+        "entry": {
+            "data": async_redact_data(dict(entry.data), TO_REDACT),
+            "options": dict(entry.options),
+        },
+        "connection": {
+            "host": client.host,
+            "port": client.port,
+            "connected": bool(client.connected),
+            "authed": bool(client._authed),
+            "reconnect_attempts": client.reconnect_policy.attempts,
+        },
+        "gateway": GatewayManager().get_stats().get(client.client_id, {}),
+        "pipeline": {
+            "devices": len(client.devicebucket.get_bucket_keys()),
+            "suppressed_updates": client.suppressed_updates,
+            "resyncs": client.resyncs,
+            "discarded_bytes": client.discarded_bytes,
+        },
+        "metrics": client.metrics.snapshot(),
+        # compile/queue/bus/total per action and device, queue_ms is our pacing, bus_ms the gateway
+        "latency": {**client.tracer.snapshot(), "expired": client.acks.expired},
+    }
@@ -19,7 +19,7 @@ from homeassistant.helpers import area_registry as ar
 from homeassistant.helpers import device_registry as dr
 
 from .base import KLWEntity
-from . import DOMAIN, ENTITY_REGISTRY, KLWIOTClient, device_registry_area_update, DeviceType, is_fan, generate_object_id
+from . import DOMAIN, ENTITY_REGISTRY, KLWIOTClient, device_registry_area_update, DeviceType, generate_object_id
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -31,7 +31,7 @@ async def async_setup_entry(
 ) -> None:
     """Set up Cleveroom ventilation devices."""
     gateway_data = hass.data[DOMAIN][entry.entry_id]
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["fan"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -41,15 +41,14 @@ async def async_setup_entry(
     ventilations = []
     for device in devices:
         try:
-            if is_fan(device):
-                if auto_area == 1:
-                    await device_registry_area_update(
-                        floor_registry, area_registry, device_registry, entry, device)
-                ventilation = CleveroomFan(hass, device, client, gateway_id,auto_area)
-                ventilations.append(ventilation)
-
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][ventilation.unique_id] = ventilation
+            if auto_area == 1:
+                await device_registry_area_update(
+                    floor_registry, area_registry, device_registry, entry, device)
+            ventilation = CleveroomFan(hass, device, client, gateway_id,auto_area)
+            ventilations.append(ventilation)
+
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][ventilation.unique_id] = ventilation
         except Exception as e:
             _LOGGER.warning(
                 f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
@@ -57,24 +56,22 @@ async def async_setup_entry(
 
     async_add_entities(ventilations)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_fan(device):
-                    _LOGGER.info(f"add ventilation new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    ventilation = CleveroomFan(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [ventilation], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][ventilation.unique_id] = ventilation
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
-                                f"error message: {e}")
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add ventilation new devices: {device['oid']}")
+            if auto_area == 1:
+                asyncio.run_coroutine_threadsafe(
+                    device_registry_area_update(
+                        floor_registry, area_registry, device_registry, entry, device),
+                    hass.loop)
+            ventilation = CleveroomFan(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(hass, async_add_entities, [ventilation], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][ventilation.unique_id] = ventilation
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
+                            f"error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -82,7 +79,7 @@ async def async_setup_entry(
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["fan"] = async_device_discovered
 
 
 class CleveroomFan(KLWEntity,FanEntity):
@@ -5,12 +5,29 @@ from .klw_type import DeviceType
 from .klw_common import has_method
 from .klw_bucket import BucketDataManager, DeviceBucket
 from .klw_broadcast import KLWBroadcast
+from .klw_gateway_manager import GatewayManager
+from .klw_discovery import GatewayDiscovery
+from .klw_capture import CaptureWriter, ReplayTransport, read_capture, read_capture_header
+from .klw_metrics import Metrics
+from .klw_profiler import SamplingProfiler
+from .klw_sensor_filter import SensorFilter, SensorPolicy, SENSOR_CLASSES
 
 # Define what should be available when someone uses "from package import *"
 __all__ = [
     'KLWIOTClient',
     'KLWIOTClientLC',
     'KLWBroadcast',
+    'GatewayManager',
+    'GatewayDiscovery',
+    'CaptureWriter',
+    'ReplayTransport',
+    'read_capture',
+    'read_capture_header',
+    'Metrics',
+    'SamplingProfiler',
+    'SensorFilter',
+    'SensorPolicy',
+    'SENSOR_CLASSES',
     'DeviceType',
     'BucketDataManager',
     'DeviceBucket',
@@ -0,0 +1,206 @@
+"""
+Correlation of the control commands with the frames acknowledging them
+
+A command is acknowledged by the next state report of its device: a frame of the same address (fid, rid, did)
+whose kind is one the action produces, D2 of a 243 frame (199, 200, 201, 204 for the devices, 129 for the scenes)
+or 250 for the RGB lights. A room (did=0) or floor (rid=0,did=0) command is acknowledged by any of its devices.
+Sensor reports, echoes of commands and the other frames of the address never acknowledge a command.
+The waiters are indexed by address: a received frame costs at most three dict lookups, none when nothing is awaited.
+A waiter is armed when its command is written to the socket, so a report received while the command waits for its
+send slot does not acknowledge it, and the round trip is measured from that write.
+The same waiters, without a future, trace the fire-and-forget commands (see klw_tracing), those never
+acknowledged are dropped after EXPIRY seconds.
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .klw_common import Instruction
+
+Address = Tuple[int, int, int]
+EXPIRY = 30.0  # seconds
+
+# State reports of the devices, D2 of the 243 frames
+DEVICE_REPLIES = frozenset({199, 200, 201, 204})
+# Actions reported by other frames than the device states
+ACTION_REPLIES = {
+    'SceneTrigger': frozenset({129}),
+    'SetColor': frozenset({250}),
+    'SetColorTemperature': frozenset({250}),
+}
+
+
+def frame_kind(frame) -> Tuple[int, Optional[Address]]:
+    """Kind (D2 of a 243 frame, 250 for RGB) and address of a received frame, None if it addresses no device"""
+    if frame[0] == 243:
+        return frame[1], (frame[2], frame[3], frame[4])
+    if frame[0] == 250:
+        return 250, (frame[1], frame[2], frame[3])
+    return frame[0], None
+
+
+def ack_target(inst: Instruction, action: str = None, device: dict = None) -> Tuple[Address, frozenset]:
+    """
+    Address and reply kinds acknowledging a command, narrowed to the state report of its device when it is known
+    """
+    if device:
+        detail = device.get('detail') or {}
+        address = (detail.get('fid', 0), detail.get('rid', 0), detail.get('did', 0))
+    else:
+        b = inst.get_inst()
+        # 243 commands address D3-D5, the others (46, 112, 237...) D2-D4
+        address = (b[2], b[3], b[4]) if b[0] == 243 else (b[1], b[2], b[3])
+    replies = ACTION_REPLIES.get(action)
+    if replies is None:
+        replies = DEVICE_REPLIES
+        kind = frame_kind(device['data'])[0] if device and device.get('data') else None
+        if kind in DEVICE_REPLIES:
+            replies = frozenset({kind})
+    return address, replies
+
+
+class AckWaiter:
+    """
+    A command waiting for its state report, the monotonic times of its stages:
+    called_at (control call), compiled_at (instructions created), queued_at, sent_at, acked_at
+    """
+    __slots__ = ('address', 'replies', 'future', 'loop', 'action', 'oid', 'called_at', 'compiled_at', 'queued_at',
+                 'sent_at', 'acked_at', 'frame')
+
+    def __init__(self, address: Address, replies: frozenset = DEVICE_REPLIES,
+                 loop: Optional[asyncio.AbstractEventLoop] = None, action: str = None, oid: str = None,
+                 called_at: float = None, compiled_at: float = None):
+        self.address = address
+        self.replies = replies
+        self.loop = loop
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop else None
+        self.action = action
+        self.oid = oid
+        self.compiled_at = compiled_at if compiled_at is not None else time.monotonic()
+        self.called_at = called_at if called_at is not None else self.compiled_at
+        self.queued_at: Optional[float] = None
+        self.sent_at: Optional[float] = None
+        self.acked_at: Optional[float] = None
+        self.frame: Optional[List[int]] = None
+
+    @property
+    def awaited(self) -> bool:
+        return self.future is not None
+
+    @property
+    def latency_ms(self) -> Optional[float]:
+        if self.sent_at is None or self.acked_at is None:
+            return None
+        return (self.acked_at - self.sent_at) * 1000
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(self.frame)
+
+
+class AckTracker:
+    """
+    Waiters of the awaited (KLWIOTClient.execute) and traced commands, keyed by (fid, rid, did),
+    on_ack is called with every acknowledged waiter, in the receiving thread
+    """
+
+    def __init__(self, on_ack: Callable[[AckWaiter], None] = None, expiry: float = EXPIRY):
+        self.on_ack = on_ack
+        self.expiry = expiry
+        self.expired = 0
+        self._waiters: Dict[Address, List[AckWaiter]] = {}
+        self._lock = threading.Lock()
+        self._purged_at = time.monotonic()
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._waiters)
+
+    def expect(self, inst: Instruction, loop: Optional[asyncio.AbstractEventLoop] = None, action: str = None,
+               called_at: float = None, compiled_at: float = None, device: dict = None) -> AckWaiter:
+        """
+        Register the waiter of a command (device: its raw bucket object, if known), it is armed by sent(),
+        with a loop its future is resolved on that loop when the command is acknowledged
+        """
+        address, replies = ack_target(inst, action, device)
+        waiter = AckWaiter(address, replies, loop, action, getattr(inst, 'oid', None), called_at, compiled_at)
+        inst.waiter = waiter
+        with self._lock:
+            if waiter.compiled_at - self._purged_at >= self.expiry:
+                self._purge(waiter.compiled_at)
+            self._waiters.setdefault(waiter.address, []).append(waiter)
+        return waiter
+
+    @staticmethod
+    def sent(inst: Instruction, now: float):
+        """Arm the waiter of a command, or those of the commands a merged room/floor instruction replaces"""
+        waiter = getattr(inst, 'waiter', None)
+        if waiter is not None and waiter.sent_at is None:
+            waiter.sent_at = now
+        for waiter in getattr(inst, 'waiters', ()):
+            if waiter.sent_at is None:
+                waiter.sent_at = now
+
+    def match(self, frame: List[int]):
+        """Resolve the armed waiters acknowledged by a received frame"""
+        kind, address = frame_kind(frame)
+        if address is None:
+            return
+        fid, rid, did = address
+        addresses = [address]
+        if did:
+            addresses.append((fid, rid, 0))
+        if rid:
+            addresses.append((fid, 0, 0))
+        acked = []
+        with self._lock:
+            for address in addresses:
+                waiters = self._waiters.get(address)
+                if not waiters:
+                    continue
+                armed = [w for w in waiters if w.sent_at is not None and kind in w.replies]
+                if not armed:
+                    continue
+                rest = [w for w in waiters if w.sent_at is None or kind not in w.replies]
+                if rest:
+                    self._waiters[address] = rest
+                else:
+                    del self._waiters[address]
+                acked.extend(armed)
+        if not acked:
+            return
+        now = time.monotonic()
+        for waiter in acked:
+            waiter.acked_at = now
+            waiter.frame = frame
+            if self.on_ack is not None:
+                self.on_ack(waiter)
+            if waiter.loop is not None:
+                waiter.loop.call_soon_threadsafe(waiter._resolve)
+
+    def discard(self, waiter: AckWaiter):
+        """Forget a waiter that timed out or whose caller went away"""
+        with self._lock:
+            waiters = self._waiters.get(waiter.address)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[waiter.address]
+
+    def _purge(self, now: float):
+        deadline = now - self.expiry
+        for address in list(self._waiters):
+            waiters = self._waiters[address]
+            alive = [w for w in waiters if w.compiled_at > deadline]
+            self.expired += len(waiters) - len(alive)
+            if alive:
+                self._waiters[address] = alive
+            else:
+                del self._waiters[address]
+        self._purged_at = now
+
+    def clear(self):
+        """Forget every waiter, their callers run into their timeout"""
+        with self._lock:
+            self._waiters.clear()
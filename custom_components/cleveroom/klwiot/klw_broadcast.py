@@ -1,3 +1,5 @@
+import asyncio
+import logging
 import socket
 import time
 from typing import Dict, List, Optional, Callable
@@ -5,6 +7,31 @@ import struct
 
 from .klw_singleton import Singleton
 
+_LOGGER = logging.getLogger(__name__)
+
+
+# Gateway announcement (170 bytes), the fields used out of the first 112:
+# 3-6 local ip, 19-20 local port, 21-22 destination port, 23 work model, 34-39 mac,
+# 41-51 device name (gbk, 0 terminated), 106 version, 108-111 multicast group ip
+_ANNOUNCEMENT = struct.Struct('>3x4B12xHHB10x6sx11s54xBx4B')
+# The sid/mac format of the gateways: values below 16 get an extra leading 0 ('0A' -> '00A'),
+# it is what the config entries store as gateway_id, so it must not change
+_HEX = [format(b, '02X') if b >= 16 else '0' + format(b, '02X') for b in range(256)]
+_INFO_CACHE_SIZE = 64
+
+
+class _SearchProtocol(asyncio.DatagramProtocol):
+    """Hands the gateway answers over to KLWBroadcast"""
+
+    def __init__(self, on_datagram: Callable[[bytes, tuple], None]):
+        self._on_datagram = on_datagram
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self._on_datagram(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        _LOGGER.warning("Error receiving data: %s", exc)
+
 
 class KLWBroadcast(metaclass=Singleton):
     def __init__(self):
@@ -12,21 +39,28 @@ class KLWBroadcast(metaclass=Singleton):
         self.listener: Optional[Callable] = None
         self.udp_client: Optional[socket.socket] = None
         self.multicast_ip = "230.90.76.1"
+        self._info_cache: Dict[bytes, dict] = {}  # raw announcement -> parsed info
 
     def init(self, listener: Callable = None) -> None:
         self.listener = listener
+        if self.udp_client:
+            self.udp_client.close()
+        self.udp_client = self._create_socket()
+
+    def _create_socket(self) -> socket.socket:
         # Create UDP socket
-        self.udp_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # Set broadcast option
-        self.udp_client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        udp_client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         # Set multicast TTL
-        self.udp_client.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 128)
+        udp_client.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 128)
         # Bind to any port
-        self.udp_client.bind(('', 0))
+        udp_client.bind(('', 0))
         # Join multicast group
         mreq = struct.pack("4sl", socket.inet_aton(self.multicast_ip), socket.INADDR_ANY)
-        self.udp_client.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-        self.udp_client.setblocking(False)
+        udp_client.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        udp_client.setblocking(False)
+        return udp_client
 
     def get_devices(self) -> List[dict]:
         return list(self.devices.values())
@@ -36,62 +70,39 @@ class KLWBroadcast(metaclass=Singleton):
         return hex_str if num >= 16 else f"0{hex_str}"
 
     def get_udp_info(self, buf: bytes, rinfo: tuple) -> dict:
-
-        ip = rinfo[0]
-
-        # Get device name length
-        begin = 41
-        lenx = 0
-        for i in range(41, 52):
-            if buf[i] == 0:
-                break
-            lenx += 1
-
-        # Get MAC address
-        sid = ''
-        macbyte = []
-        for i in range(34, 40):
-            sid += self._get_hex(buf[i])
-            macbyte.append(buf[i])
-
-        # Get local IP
-        localip = f"{buf[3]}.{buf[4]}.{buf[5]}.{buf[6]}"
-
-        # Get device name
-        namebyte = bytearray(lenx)
-        for i in range(begin, begin + lenx):
-            namebyte[i - begin] = buf[i]
-
-        # Catch the exception here
+        """
+        Parse the announcement of a gateway, identical datagrams are parsed once
+        """
+        key = bytes(buf)
+        info = self._info_cache.get(key)
+        if info is None:
+            info = self._parse_udp_info(key)
+            if len(self._info_cache) >= _INFO_CACHE_SIZE:
+                self._info_cache.clear()
+            self._info_cache[key] = info
+        return dict(info)
+
+    def _parse_udp_info(self, buf: bytes) -> dict:
+        (ip1, ip2, ip3, ip4, local_port, dest_port, work_model, macbyte, namebyte, version,
+         g1, g2, g3, g4) = _ANNOUNCEMENT.unpack_from(buf)
+
+        # Device name: up to 11 bytes, 0 terminated
         dev_name = "Unknown"
         try:
-            dev_name = self.uint8array_to_string(namebyte)
+            dev_name = self.uint8array_to_string(namebyte.split(b'\0', 1)[0])
         except Exception as e:
-            print(f"Error decoding device name: {e}")
-
-        # Format MAC address
-        mac = '-'.join(self._get_hex(b) for b in macbyte)
-
-        # Get port information
-        local_port = (buf[19] << 8) | buf[20]
-        dest_port = (buf[21] << 8) | buf[22]
-
-        # Get group IP
-        group_ip = f"{buf[108]}.{buf[109]}.{buf[110]}.{buf[111]}"
-
-        # Get version information
-        version = f"V1.{(buf[106] & 0xff) + 383}"
-        work_model = buf[23]
+            _LOGGER.debug("Error decoding device name: %s", e)
 
+        hexes = [_HEX[b] for b in macbyte]
         return {
-            'ip': localip,
+            'ip': f"{ip1}.{ip2}.{ip3}.{ip4}",
             'devName': dev_name,
             'localport': local_port,
             'destport': dest_port,
-            'groupip': group_ip,
-            'version': version,
-            'mac': mac,
-            'sid': sid,
+            'groupip': f"{g1}.{g2}.{g3}.{g4}",
+            'version': f"V1.{version + 383}",
+            'mac': '-'.join(hexes),
+            'sid': ''.join(hexes),
             'workmodel': work_model
         }
 
@@ -105,24 +116,96 @@ class KLWBroadcast(metaclass=Singleton):
         b[2] = 0x00
         return bytes(b)
 
-    def search(self) -> List[dict]:
+    def _on_datagram(self, data: bytes, addr: tuple, listener: Callable = None) -> Optional[dict]:
+        """Record the gateway answering with the datagram"""
+        try:
+            info = self.get_udp_info(data, addr)
+        except Exception as e:
+            _LOGGER.warning("Error receiving data: %s", e)
+            return None
+        self.devices[info['sid']] = info
+        listener = listener or self.listener
+        if listener:
+            listener(info)
+        return info
+
+    def search(self, timeout: float = 4.0, idle_timeout: float = None, max_devices: int = None) -> List[dict]:
+        """
+        Blocking search, prefer async_search in an event loop
+        :param timeout: maximum search time, in seconds
+        :param idle_timeout: stop once no gateway answered for this long (after the first answer)
+        :param max_devices: stop once this many gateways answered
+        """
+        if not self.udp_client:
+            self.init(self.listener)
         params = self._search_params()
         self.udp_client.sendto(params, ('255.255.255.255', 1092))
 
-        # Wait to receive response
-        start_time = time.time()
-        while time.time() - start_time < 4:  # 5 second timeout
-            try:
-                data, addr = self.udp_client.recvfrom(1024)
-                info = self.get_udp_info(data, addr)
-                self.devices[info['sid']] = info
-                if self.listener:
-                    self.listener(info)
-            except BlockingIOError:
-                # print("Blocking Socket timeout.")
-                pass
-                # time.sleep(0.1)  # Short sleep to avoid excessive CPU usage
-            except Exception as e:
-                print(f"Error receiving data: {e}")
+        # Wait to receive response, blocking in recvfrom until a datagram arrives or the time is up
+        found = set()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if found and idle_timeout is not None:
+                    remaining = min(remaining, idle_timeout)
+                if remaining <= 0:
+                    break
+                self.udp_client.settimeout(remaining)
+                try:
+                    data, addr = self.udp_client.recvfrom(1024)
+                except socket.timeout:
+                    break
+                except Exception as e:
+                    _LOGGER.warning("Error receiving data: %s", e)
+                    continue
+                info = self._on_datagram(data, addr)
+                if info:
+                    found.add(info['sid'])
+                    if max_devices and len(found) >= max_devices:
+                        break
+        finally:
+            self.udp_client.setblocking(False)
 
         return self.get_devices()
+
+    async def async_search(self, timeout: float = 4.0, idle_timeout: float = 1.0, max_devices: int = None,
+                           listener: Callable = None) -> List[dict]:
+        """
+        Search the gateways without blocking the event loop, can run as a background task
+        :param timeout: maximum search time, in seconds
+        :param idle_timeout: stop once no gateway answered for this long (after the first answer)
+        :param max_devices: stop once this many gateways answered
+        :param listener: called with each gateway as it answers (defaults to the listener given to init)
+        :return: the gateways that answered this search
+        """
+        loop = asyncio.get_running_loop()
+        found: Dict[str, dict] = {}
+        arrived = asyncio.Event()
+
+        def on_datagram(data: bytes, addr: tuple):
+            info = self._on_datagram(data, addr, listener)
+            if info:
+                found[info['sid']] = info
+                arrived.set()
+
+        transport, _ = await loop.create_datagram_endpoint(lambda: _SearchProtocol(on_datagram),
+                                                           sock=self._create_socket())
+        try:
+            transport.sendto(self._search_params(), ('255.255.255.255', 1092))
+            deadline = loop.time() + timeout
+            while not (max_devices and len(found) >= max_devices):
+                remaining = deadline - loop.time()
+                if found and idle_timeout is not None:
+                    remaining = min(remaining, idle_timeout)
+                if remaining <= 0:
+                    break
+                arrived.clear()
+                try:
+                    await asyncio.wait_for(arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            transport.close()
+
+        return list(found.values())
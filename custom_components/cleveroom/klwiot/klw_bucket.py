@@ -7,7 +7,11 @@ from .klw_nameprovider import *
 from . import utils
 
 import aiofiles
+import aiofiles.os
 import json
+import logging
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class BucketDataManager:
@@ -24,13 +28,13 @@ class BucketDataManager:
                 content = await f.read()
                 return json.loads(content)
         except FileNotFoundError:
-            print(f"File not found: {self.file_path}")
+            _LOGGER.debug("File not found: %s", self.file_path)
             return {}
         except json.JSONDecodeError:
-            print(f"Invalid JSON format in: {self.file_path}")
+            _LOGGER.warning("Invalid JSON format in: %s", self.file_path)
             return {}
         except Exception as e:
-            print(f"Error loading bucket data from {self.file_path}: {e}")
+            _LOGGER.warning("Error loading bucket data from %s: %s", self.file_path, e)
             return {}
 
     async def async_save_data(self, data: dict):
@@ -39,7 +43,16 @@ class BucketDataManager:
             async with aiofiles.open(self.file_path, mode='w') as f:
                 await f.write(json.dumps(data))
         except Exception as e:
-            print(f"Error saving bucket data to {self.file_path}: {e}")
+            _LOGGER.error("Error saving bucket data to %s: %s", self.file_path, e)
+
+    async def async_delete_data(self):
+        """Asynchronously delete the bucket data file."""
+        try:
+            await aiofiles.os.remove(self.file_path)
+        except FileNotFoundError:
+            _LOGGER.debug("File not found: %s", self.file_path)
+        except Exception as e:
+            _LOGGER.error("Error deleting bucket data %s: %s", self.file_path, e)
 
 
 class DeviceBucket:
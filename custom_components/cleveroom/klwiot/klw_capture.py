@@ -0,0 +1,153 @@
+"""
+Wire capture of a gateway connection and its replay
+
+File format (big endian):
+    header: magic b'KLWC', version (1 byte), wall clock start time (double, seconds since epoch),
+            flags (1 byte, FLAG_AUTHED: the client was logged in when the capture started)
+    record: direction (1 byte, 0 received / 1 sent), microseconds since the previous record (uint32),
+            length (uint16), the bytes as they went over the socket
+"""
+import struct
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .klw_iotclient import KLWIOTClient
+
+CAPTURE_MAGIC = b'KLWC'
+CAPTURE_VERSION = 2
+RECEIVED = 0
+SENT = 1
+FLAG_AUTHED = 0x01
+
+_HEADER = struct.Struct('>4sBdB')
+_RECORD = struct.Struct('>BIH')
+_MAX_DELTA = 0xFFFFFFFF
+
+
+class CaptureWriter:
+    """
+    Records the frames of a connection, thread safe (the receive and send threads both write)
+    """
+
+    def __init__(self, path: str, authed: bool = False):
+        """
+        :param authed: the client is already logged in, the capture has no login handshake in front of the frames
+        """
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, time.time(), FLAG_AUTHED if authed else 0))
+        self._last = time.monotonic()
+
+    def record(self, direction: int, data: bytes):
+        with self._lock:
+            if self._file is None:
+                return
+            now = time.monotonic()
+            delta = min(int((now - self._last) * 1e6), _MAX_DELTA)
+            self._last = now
+            data = bytes(data)
+            self._file.write(_RECORD.pack(direction, delta, len(data)))
+            self._file.write(data)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def is_capture(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+
+def _read_header(f, path: str) -> Tuple[float, int]:
+    head = f.read(_HEADER.size)
+    if len(head) < _HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, version, started, flags = _HEADER.unpack(head)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError(f"{path} is not a capture file")
+    return started, flags
+
+
+def read_capture_header(path: str) -> dict:
+    """Start time (seconds since epoch) and login state of a capture"""
+    with open(path, 'rb') as f:
+        started, flags = _read_header(f, path)
+    return {'started': started, 'authed': bool(flags & FLAG_AUTHED)}
+
+
+def read_capture(path: str) -> Iterator[Tuple[int, float, bytes]]:
+    """
+    Yield (direction, seconds since the start of the capture, data) for every record
+    """
+    with open(path, 'rb') as f:
+        _read_header(f, path)
+        t = 0
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            direction, delta, length = _RECORD.unpack(head)
+            t += delta
+            yield direction, t / 1e6, f.read(length)
+
+
+class ReplayTransport:
+    """
+    Feeds a capture back through a client instead of a gateway socket.
+    The client is wired to this transport: what it sends is collected in sent, nothing goes to the network.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        """
+        :param path: capture file
+        :param speed: 1 replays at the recorded pace, 2 twice as fast..., 0 as fast as possible
+        """
+        self.path = path
+        self.speed = speed
+        self.sent: List[bytes] = []
+        self.received = 0
+
+    # The socket methods used by the client
+    def send(self, data: bytes) -> int:
+        self.sent.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        pass
+
+    def run(self, client: 'KLWIOTClient', limit: Optional[int] = None) -> dict:
+        """
+        Replay the received records through the client (blocking), the sent ones are only timing
+        :param limit: stop after this many received records
+        """
+        header = read_capture_header(self.path)
+        records = list(read_capture(self.path))
+        received = [(t, data) for direction, t, data in records if direction == RECEIVED]
+        client.client = self
+        client.connected = True
+        # A capture started after the login has no login handshake in front of the frames
+        client._authed = header['authed']
+        start = time.monotonic()
+        for t, data in received[:limit]:
+            if self.speed > 0:
+                wait = start + t / self.speed - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            client._handle_received(data)
+            self.received += 1
+        client.connected = False
+        return {
+            'records': len(records),
+            'received': self.received,
+            'sent': len(self.sent),
+            'duration': round(time.monotonic() - start, 3),
+            'recorded_duration': round(records[-1][1], 3) if records else 0.0,
+        }
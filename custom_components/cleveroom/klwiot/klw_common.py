@@ -1,26 +1,26 @@
+import logging
 from copy import deepcopy
 from datetime import datetime, timezone
 from typing import Any
 
+_LOGGER = logging.getLogger(__name__)
+
 
 class Instruction:
 
     def __init__(self, inst):
-        self.b = []
-
         if isinstance(inst, str):
             bytes_list = inst.split(',')
         else:
             bytes_list = inst
 
-        num = 0
-        for i in range(7):
-            cmd = int(bytes_list[i])
-            num += cmd * (8 - i)
-            self.b.append(cmd)
+        self.b = [int(v) for v in bytes_list[:7]]
+        self.b.append(Instruction.checksum(self.b))
 
-        check = num % 256
-        self.b.append(check)
+    @staticmethod
+    def checksum(b) -> int:
+        """D8 = sum(Dk * (8 - k)) % 256 over D1-D7"""
+        return (b[0] * 8 + b[1] * 7 + b[2] * 6 + b[3] * 5 + b[4] * 4 + b[5] * 3 + b[6] * 2) % 256
 
     def get_d1(self):
         return self.b[0]
@@ -80,6 +80,7 @@ class DeviceBuffer:
         self.buffer_type = buf_type
         self.devices = {}
         self.listeners = {}
+        self.emit_same = False  # also trigger 'change' for a frame identical to the known one
 
     def create_index(self, ins, idx):
         b = ins.get_inst()
@@ -129,6 +130,8 @@ class DeviceBuffer:
                 if not trigger_update_no_cache:
                     self.devices[uid] = device
                 self._trigger_event('change', device)
+            elif self.emit_same:
+                self._trigger_event('change', device)
 
     def _add2buffer_with_ignore(self, ins, idx, ignore):
         uid = self.create_index(ins, idx)
@@ -174,7 +177,7 @@ class DeviceBuffer:
                     if listener and 'on_change' in listener:
                         listener['on_change'](device, self.buffer_type)
             except Exception as e:
-                print(f"Error triggering event: {e}")
+                _LOGGER.error("Error triggering event: %s", e)
 
     def add_listener(self, key, listener):
         self.listeners[key] = listener
@@ -263,6 +266,20 @@ def get_random_code(length):
 def get_current_time():
     return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
+# Bookkeeping fields of a device detail, they are not part of its state
+BOOKKEEPING_FIELDS = frozenset({'timestamp'})
+
+
+def changed_fields(ori_obj, change_obj) -> set:
+    """
+    The fields whose value the change modifies, bookkeeping fields excluded.
+    The merge keeps every field of ori_obj, so only the fields of change_obj can differ.
+    """
+    missing = object()
+    return {key for key, value in change_obj.items()
+            if key not in BOOKKEEPING_FIELDS and ori_obj.get(key, missing) != value}
+
+
 def safe_merge_objects(ori_obj, change_obj):
     """
     Safely merge two objects, handle None values, and perform a deep copy
@@ -273,7 +290,7 @@ def safe_merge_objects(ori_obj, change_obj):
         try:
             result.update(deepcopy(ori_obj))
         except (TypeError, AttributeError) as e:
-            print(f"Warning: Failed to copy ori_obj: {e}")
+            _LOGGER.warning("Failed to copy ori_obj: %s", e)
             result.update({} if ori_obj is None else dict(ori_obj))
 
     # Safely handle the changed object
@@ -281,7 +298,7 @@ def safe_merge_objects(ori_obj, change_obj):
         try:
             result.update(deepcopy(change_obj))
         except (TypeError, AttributeError) as e:
-            print(f"Warning: Failed to copy change_obj: {e}")
+            _LOGGER.warning("Failed to copy change_obj: %s", e)
             result.update({} if change_obj is None else dict(change_obj))
 
     return result
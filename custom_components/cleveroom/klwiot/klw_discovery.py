@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from .klw_broadcast import KLWBroadcast, _SearchProtocol
+from .klw_eventemitter import KLWEventEmitter
+from .klw_gateway_manager import GatewayManager
+from .klw_singleton import Singleton
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class GatewayDiscovery(KLWEventEmitter, metaclass=Singleton):
+    """
+    Background gateway discovery.
+    Joins the 230.90.76.1 multicast group, sends the search probe periodically and keeps a live sid -> address map,
+    a gateway answering from a new address moves the matching client (client_id == sid) there right away.
+     :events
+        on_gateway_found : a gateway answered, (info)
+        on_address_change: a known gateway answered from a new address, (sid, info)
+    """
+
+    def __init__(self, probe_interval: float = 300.0, min_probe_interval: float = 10.0):
+        """
+        :param probe_interval: delay between two search probes, in seconds
+        :param min_probe_interval: minimum delay between two probes requested by probe(), in seconds
+        """
+        super().__init__()
+        self.probe_interval = probe_interval
+        self.min_probe_interval = min_probe_interval
+        self._probed_at = 0.0
+        self.gateways: Dict[str, dict] = {}  # sid -> announcement (ip, localport, mac, ...)
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._probe_now: Optional[asyncio.Event] = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the discovery in the running event loop"""
+        if self.is_running():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._probe_now = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def probe(self):
+        """
+        Send a search probe now, e.g. when a gateway stops answering (thread safe),
+        at most once per min_probe_interval: every failed reconnect of every gateway asks for one
+        """
+        if not self.is_running():
+            return
+        now = time.monotonic()
+        if now - self._probed_at < self.min_probe_interval:
+            return
+        self._probed_at = now
+        self._loop.call_soon_threadsafe(self._probe_now.set)
+
+    def get_address(self, sid: str) -> Optional[tuple]:
+        info = self.gateways.get(sid)
+        return (info['ip'], info['localport']) if info else None
+
+    async def _run(self):
+        broadcast = KLWBroadcast()
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: _SearchProtocol(self._on_datagram),
+                                                           sock=broadcast._create_socket())
+        try:
+            while True:
+                self._probe_now.clear()
+                transport.sendto(broadcast._search_params(), ('255.255.255.255', 1092))
+                try:
+                    await asyncio.wait_for(self._probe_now.wait(), self.probe_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            transport.close()
+
+    def _on_datagram(self, data: bytes, addr: tuple):
+        try:
+            info = KLWBroadcast().get_udp_info(data, addr)
+        except Exception as e:
+            _LOGGER.warning("Error receiving data: %s", e)
+            return
+        sid = info['sid']
+        ip = info['ip']
+        if not sid or not ip or ip == '0.0.0.0':
+            return
+        previous = self.gateways.get(sid)
+        self.gateways[sid] = info
+        KLWBroadcast().devices[sid] = info
+        self.emit('on_gateway_found', info)
+        if previous and (previous['ip'], previous.get('localport')) == (ip, info.get('localport')):
+            return
+        client = GatewayManager().get_client(sid)
+        if not client:
+            return
+        port = info.get('localport') or client.port
+        if (client.host, client.port) != (ip, port):
+            _LOGGER.info("Gateway %s moved from %s:%s to %s:%s", sid, client.host, client.port, ip, port)
+            client.update_address(ip, port)
+            self.emit('on_address_change', sid, info)
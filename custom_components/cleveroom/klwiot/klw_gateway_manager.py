@@ -0,0 +1,335 @@
+import logging
+import queue
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, TYPE_CHECKING
+
+from .klw_singleton import Singleton
+
+if TYPE_CHECKING:
+    from .klw_iotclient import KLWIOTClient
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class GatewayStats:
+    """
+    Throughput and latency counters of one gateway connection
+    """
+
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.reconnects = 0
+        self.latency_ms = None  # last send -> first response delay
+        self.latency_avg_ms = None  # exponential moving average of latency_ms
+        self._awaiting_since = None
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self.receive_rate = 0.0  # bytes/s over the last window
+
+    def on_send(self, size: int):
+        self.frames_sent += 1
+        self.bytes_sent += size
+        if self._awaiting_since is None:
+            self._awaiting_since = time.monotonic()
+
+    def on_receive(self, size: int):
+        now = time.monotonic()
+        self.bytes_received += size
+        self._window_bytes += size
+        if self._awaiting_since is not None:
+            self.latency_ms = (now - self._awaiting_since) * 1000
+            if self.latency_avg_ms is None:
+                self.latency_avg_ms = self.latency_ms
+            else:
+                self.latency_avg_ms = 0.8 * self.latency_avg_ms + 0.2 * self.latency_ms
+            self._awaiting_since = None
+        elapsed = now - self._window_start
+        if elapsed >= 5:
+            self.receive_rate = self._window_bytes / elapsed
+            self._window_start = now
+            self._window_bytes = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'frames_received': self.bytes_received // 8,
+            'bytes_received': self.bytes_received,
+            'receive_rate': round(self.receive_rate, 1),
+            'latency_ms': None if self.latency_ms is None else round(self.latency_ms, 1),
+            'latency_avg_ms': None if self.latency_avg_ms is None else round(self.latency_avg_ms, 1),
+            'reconnects': self.reconnects,
+        }
+
+
+class GatewayManager(metaclass=Singleton):
+    """
+    Owns the connections of all Cleveroom gateways.
+    One I/O thread multiplexes the non-blocking sockets, paces the outgoing commands and sends the heartbeats,
+    connects, immediate reconnects and full-state queries are staggered so that the gateways don't stampede
+    at startup or after a network blip, and (re)connects run in a small bounded worker pool.
+    """
+
+    def __init__(self, stagger_interval: float = 2.0, max_connecting: int = 2):
+        """
+        :param stagger_interval: minimum delay between two connects/full-state queries, in seconds
+        :param max_connecting: maximum number of gateways connecting at the same time
+        """
+        self.stagger_interval = stagger_interval
+        self._clients: Dict[str, 'KLWIOTClient'] = {}
+        self._lock = threading.RLock()
+        self._selector = selectors.DefaultSelector()
+        self._requests = queue.Queue()  # (action, client) handled by the I/O thread
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._executor = ThreadPoolExecutor(max_workers=max_connecting, thread_name_prefix='klw-connect')
+        self._connecting = set()
+        self._reconnect_at: Dict[str, float] = {}
+        self._query_at: Dict[str, float] = {}
+        self._next_slot = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def _reserve_slot(self) -> float:
+        """Reserve the next staggered start time (monotonic)"""
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self.stagger_interval
+            return slot
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='klw-gateways', daemon=True)
+            self._thread.start()
+
+    def connect(self, client: 'KLWIOTClient') -> bool:
+        """
+        Take over the client and make its first connection attempt in its staggered slot (blocking)
+        """
+        with self._lock:
+            self._clients[client.client_id] = client
+        client.manager = self
+        client.stats = client.stats or GatewayStats()
+        client.running = True
+        self._ensure_running()
+        time.sleep(max(0.0, self._reserve_slot() - time.monotonic()))
+        with self._lock:
+            self._connecting.add(client.client_id)
+        try:
+            # a failed attempt goes through handle_disconnection, which schedules the reconnect
+            client.attempt_connection()
+        finally:
+            with self._lock:
+                self._connecting.discard(client.client_id)
+        return True
+
+    def remove(self, client: 'KLWIOTClient'):
+        """Stop managing the client"""
+        with self._lock:
+            self._clients.pop(client.client_id, None)
+            self._reconnect_at.pop(client.client_id, None)
+            self._query_at.pop(client.client_id, None)
+        self.detach(client)
+
+    def attach(self, client: 'KLWIOTClient'):
+        """Multiplex the freshly connected socket of the client"""
+        self._requests.put(('attach', client, client.client))
+        self.wakeup()
+
+    def want_write(self, client: 'KLWIOTClient'):
+        """Finish the write of the client's outbox when its socket is writable again"""
+        self._requests.put(('write', client, client.client))
+        self.wakeup()
+
+    def detach(self, client: 'KLWIOTClient'):
+        """Stop multiplexing the socket of the client, it is being closed"""
+        self._requests.put(('detach', client, client.client))
+        self.schedule_reconnect(client)
+        self.wakeup()
+
+    def schedule_reconnect(self, client: 'KLWIOTClient', delay: float = None):
+        """
+        Reconnect the client after the delay (default: its backoff policy).
+        The immediate retries take a stagger slot: when a network blip drops all the gateways at once,
+        they reconnect one slot apart instead of together, the later retries are spread by the jittered backoff.
+        """
+        with self._lock:
+            if client.client_id not in self._clients or client.client_id in self._reconnect_at:
+                return
+            if delay is None:
+                delay = client.reconnect_policy.next_delay()
+            reconnect_at = time.monotonic() + delay
+            if delay < self.stagger_interval:
+                reconnect_at = max(reconnect_at, self._reserve_slot())
+            self._reconnect_at[client.client_id] = reconnect_at
+
+    def reconnect_now(self, client: 'KLWIOTClient'):
+        """Reconnect the client right away, e.g. its gateway moved to a new address"""
+        with self._lock:
+            if client.client_id not in self._clients:
+                return
+            self._reconnect_at[client.client_id] = time.monotonic()
+        self.wakeup()
+
+    def get_client(self, client_id: str) -> Optional['KLWIOTClient']:
+        with self._lock:
+            return self._clients.get(client_id)
+
+    def schedule_query(self, client: 'KLWIOTClient'):
+        """Run the full-state query of the client in the next staggered slot"""
+        with self._lock:
+            self._query_at[client.client_id] = self._reserve_slot()
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Per gateway throughput and latency"""
+        with self._lock:
+            clients = list(self._clients.values())
+        result = {}
+        for client in clients:
+            stats = client.stats.as_dict() if client.stats else {}
+            stats['connected'] = bool(client.connected)
+            stats['queue_depth'] = client.waiting_commands.qsize() + len(client._pending_commands)
+            result[client.client_id] = stats
+        return result
+
+    def _process_requests(self):
+        while True:
+            try:
+                action, client, sock = self._requests.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if action == 'attach':
+                    self._selector.register(sock, selectors.EVENT_READ, client)
+                elif action == 'write':
+                    if sock is client.client and client._outbox:
+                        self._selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+                else:
+                    self._selector.unregister(sock)
+            except (KeyError, ValueError, OSError):
+                pass
+
+    def _start_reconnect(self, client: 'KLWIOTClient'):
+        with self._lock:
+            self._connecting.add(client.client_id)
+        if client.stats:
+            client.stats.reconnects += 1
+
+        def run():
+            try:
+                _LOGGER.info("Reconnecting gateway %s", client.client_id)
+                client.attempt_connection()
+            finally:
+                with self._lock:
+                    self._connecting.discard(client.client_id)
+
+        self._executor.submit(run)
+
+    def _run_timers(self, now: float) -> float:
+        """Send due commands, heartbeats, queries and reconnects, return the select timeout"""
+        timeout = 1.0
+        with self._lock:
+            clients = list(self._clients.values())
+        for client in clients:
+            cid = client.client_id
+            if not client.running:
+                continue
+            if client.connected:
+                if client._outbox_since is not None and now - client._outbox_since > client.connect_timeout:
+                    _LOGGER.warning("Gateway %s does not accept data, reconnecting", cid)
+                    client.handle_disconnection()
+                    continue
+                try:
+                    due = client._send_next_command(now)
+                except Exception as e:
+                    _LOGGER.warning("Send error on gateway %s: %s", cid, e)
+                    client.handle_disconnection()
+                    continue
+                if due is not None:
+                    timeout = min(timeout, due - now)
+                if client._login_pending and cid not in self._connecting:
+                    # The client's auto_reconnect does not run in manager mode, the login is followed up here
+                    client.check_login(now)
+                    if not client.connected:
+                        continue
+                    timeout = min(timeout, 0.5)
+                if client._authed and now - client._last_heartbeat >= client.heartbeat_interval:
+                    client.heartbeat()
+                query_at = self._query_at.get(cid)
+                if query_at is not None:
+                    if now >= query_at:
+                        self._query_at.pop(cid, None)
+                        client.query_all_devices()
+                    else:
+                        timeout = min(timeout, query_at - now)
+            elif cid not in self._connecting:
+                reconnect_at = self._reconnect_at.get(cid)
+                if reconnect_at is None:
+                    continue
+                if now >= reconnect_at:
+                    with self._lock:
+                        self._reconnect_at.pop(cid, None)
+                    self._start_reconnect(client)
+                else:
+                    timeout = min(timeout, reconnect_at - now)
+        return max(timeout, 0.0)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._clients:
+                    self._thread = None
+                    return
+            self._process_requests()
+            timeout = self._run_timers(time.monotonic())
+            for key, events in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(1024):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                client = key.data
+                if events & selectors.EVENT_WRITE:
+                    try:
+                        if client.flush_outbox():
+                            self._selector.modify(key.fileobj, selectors.EVENT_READ, client)
+                    except Exception as e:
+                        _LOGGER.warning("Send error on gateway %s: %s", client.client_id, e)
+                        self._selector.unregister(key.fileobj)
+                        client.handle_disconnection()
+                        continue
+                    if not events & selectors.EVENT_READ:
+                        continue
+                try:
+                    data = key.fileobj.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except Exception as e:
+                    _LOGGER.warning("Receive error on gateway %s: %s", client.client_id, e)
+                    data = None
+                if data:
+                    try:
+                        client._handle_received(data)
+                    except Exception as e:
+                        _LOGGER.error("Error processing data of gateway %s: %s", client.client_id, e)
+                else:
+                    self._selector.unregister(key.fileobj)
+                    client.handle_disconnection()
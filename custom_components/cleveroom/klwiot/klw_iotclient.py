@@ -6,14 +6,25 @@ import time
 import queue
 import logging
 import hashlib
-from typing import Union, List, Optional, Callable, Any, Coroutine
+from typing import Union, List, Dict, Optional, Callable, Any, Coroutine, Iterable, Tuple
 
 from .klw_iotcontoller import KLWIOTController
 from .klw_type import BufferType
 from .klw_bucket import DeviceBucket
 from .klw_type import DeviceType
-from .klw_common import Instruction, CRMDevice, DeviceBuffer, safe_merge_objects, ascii_to_hex, get_current_time
+from .klw_common import Instruction, CRMDevice, DeviceBuffer, safe_merge_objects, ascii_to_hex, changed_fields
 from .klw_eventemitter import KLWEventEmitter
+from .klw_reconnect import ReconnectPolicy
+from .klw_capture import CaptureWriter, RECEIVED, SENT
+from .klw_metrics import Metrics
+from .klw_profiler import SamplingProfiler
+from .klw_sensor_filter import SensorFilter
+from .klw_discovery import GatewayDiscovery
+from .klw_ack import AckTracker, DEVICE_REPLIES
+from .klw_tracing import CommandTracer
+from .klw_logging import Decs, enable_debug_logging, disable_debug_logging
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class KLWIOTClient(KLWEventEmitter):
@@ -23,6 +34,7 @@ class KLWIOTClient(KLWEventEmitter):
         on_login_failed  : when login failed
         on_connect_change: connect state change
         on_device_change : device state change
+        on_freshness_change: the set of the oids of the stale devices changed, (stale oids)
 
     """
 
@@ -53,6 +65,12 @@ class KLWIOTClient(KLWEventEmitter):
         # 如果client_id为空，则使用使用host的md5值
         self.__init_client_id(client_id)
         self.reconnect_interval = reconnect_interval
+        # reconnect_interval is the cap of the backoff, the first retry is immediate
+        self.reconnect_policy = ReconnectPolicy(cap=reconnect_interval)
+        self._reconnect_event = threading.Event()  # wakes up auto_reconnect when the connection drops
+        self._login_event = threading.Event()  # set when the gateway answers the login
+        self._login_started = 0.0
+        self._login_pending = False  # manager mode: connected, the login answer did not come in time yet
         self.connect_timeout = connect_timeout
         self.client = None
         self.running = False
@@ -61,7 +79,6 @@ class KLWIOTClient(KLWEventEmitter):
         self.ever_connected = False
         self.waiting_commands = queue.Queue()  # async message queue
         self.input_thread = None  # input thread
-        self.__logger = None  # logger setting
         self._authed = False  # default not authed
         self.system_level = system_level
         self.keeplive = keeplive  # 启动以后就一直尝试重连
@@ -71,6 +88,36 @@ class KLWIOTClient(KLWEventEmitter):
         self.data_buffer = []  # data cache
         self.allowed_d1 = {243, 112, 250, 35, 37, 38, 62, 87, 22}
         self.heartbeat_interval = 15  # headbeat interval
+        self.group_coalesce_window = 0.02  # wait for the rest of a room/floor wide operation, in seconds
+        self._pending_commands: List[Instruction] = []  # dequeued commands waiting for their send slot
+        self._next_send_time = 0.0  # monotonic time the next command may be sent
+        self._last_heartbeat = 0.0
+        self.heartbeat_thread = None
+        # GatewayManager owning the socket, None when the client runs its own threads
+        self.manager = None
+        self.stats = None
+        # Manager mode: bytes the non-blocking socket did not accept yet, and since when (monotonic)
+        self._outbox = bytearray()
+        self._outbox_since: Optional[float] = None
+        self._outbox_lock = threading.Lock()
+        self.capture: Optional[CaptureWriter] = None  # wire capture, see start_capture
+        self.metrics = Metrics()  # disabled until metrics.enabled is set
+        self.suppressed_updates = 0  # decoded frames that left the state of a known device unchanged
+        self._sensor_filter = SensorFilter()  # report policies of the environment sensors, none by default
+        self.resyncs = 0  # times the frame alignment was lost (checksum mismatch) and searched again
+        self.discarded_bytes = 0  # bytes skipped while searching the alignment
+        self._resyncing = False
+        self.profiler: Optional[SamplingProfiler] = None  # see start_profiling
+        self.tracer = CommandTracer()  # round trip of the control commands, disabled until tracer.enabled is set
+        # commands of execute() waiting for their acknowledgement, and the traced ones
+        self.acks = AckTracker(on_ack=self.tracer.record)
+        self.last_seen: Dict[Tuple[int, int, int], float] = {}  # (fid, rid, did) -> monotonic time of its last report
+        # A device the gateway did not report for freshness_heartbeats heartbeats is queried (one full dump),
+        # twice that long it is stale (check_freshness), 0 disables
+        self.freshness_heartbeats = 20
+        self.stale_oids: set = set()
+        self._logged_in_at = 0.0
+        self._freshness_query_at = 0.0
         # Initialize buffers
         self.__devbuffer = DeviceBuffer(BufferType.DEVICEBUFFER)
         self.__scenebuffer = DeviceBuffer(BufferType.SCENEBUFFER)
@@ -99,6 +146,9 @@ class KLWIOTClient(KLWEventEmitter):
                                          bucket_manager=bucket_manager, data_changed_callback=data_changed_callback)
         self.__buffers_register()
         self.__register_controller()
+        self.metrics.gauge('queue_depth', lambda: self.waiting_commands.qsize() + len(self._pending_commands))
+        self.metrics.gauge('bucket_size', lambda: len(self.devicebucket.get_bucket()))
+        self.metrics.gauge('connected', lambda: bool(self.connected and self._authed))
 
     def __buffers_register(self):
         buffers = [
@@ -177,6 +227,22 @@ class KLWIOTClient(KLWEventEmitter):
             return
         ori_obj = cod.get('oriObj')
         change_obj = cod.get('changeObj')
+        # Report policy of the environment sensors (deadband, interval, averaging) on the decoded value
+        if (change_obj and self.sensor_filter.active and change_obj.get('category') == DeviceType.SENSOR
+                and not change_obj.get('twoside') and 'value' in change_obj):
+            value = self.sensor_filter.report(f"{ds_id}.{uid}.{buffer_type}", change_obj.get('did'),
+                                              change_obj['value'])
+            if value is None:
+                if self.metrics.enabled:
+                    self.metrics.count('filtered_sensor_updates')
+                return
+            change_obj['value'] = value
+        # A known device whose state does not change: no event, no state write
+        if ori_obj is not None and not changed_fields(ori_obj, change_obj or {}):
+            self.suppressed_updates += 1
+            if self.metrics.enabled:
+                self.metrics.count('suppressed_updates')
+            return
         # Merge data, deep copy to prevent modification
         merge_obj = safe_merge_objects(ori_obj, change_obj)
 
@@ -212,7 +278,33 @@ class KLWIOTClient(KLWEventEmitter):
             self.devicebucket.save_device_to_database(oid, raw, is_new)
             # self.devicebucket.save_device_to_database(oid, raw, True)
             # Trigger listener
-            self.emit('on_device_change', raw, is_new=is_new)
+            if self.metrics.enabled:
+                start = time.perf_counter()
+                self.emit('on_device_change', raw, is_new=is_new)
+                self.metrics.observe('fanout_ms', (time.perf_counter() - start) * 1000)
+                self.metrics.count('device_events')
+            else:
+                self.emit('on_device_change', raw, is_new=is_new)
+
+    @property
+    def sensor_filter(self) -> SensorFilter:
+        return self._sensor_filter
+
+    @sensor_filter.setter
+    def sensor_filter(self, sensor_filter: SensorFilter):
+        self._sensor_filter = sensor_filter
+        # The filter sees every sample (averaging, pending values), not only the changed frames
+        self.__sensorbuffer.emit_same = sensor_filter.active
+
+    def flush_sensors(self):
+        """Report the sensor values withheld by min_interval once it has passed, called by the heartbeat tick"""
+        for oid, value in self._sensor_filter.flush():
+            raw = self.devicebucket.get_device_from_database(oid)
+            if not raw or raw.get('detail', {}).get('value') == value:
+                continue
+            raw = {**raw, 'detail': {**raw['detail'], 'value': value, 'timestamp': int(time.time() * 1000)}}
+            self.devicebucket.save_device_to_database(oid, raw, False)
+            self.emit('on_device_change', raw, is_new=False)
 
     def get_devicebucket(self) -> DeviceBucket:
         return self.devicebucket
@@ -222,30 +314,18 @@ class KLWIOTClient(KLWEventEmitter):
          Configure the logger
         :return:
         """
-        logger = logging.getLogger('Cleveroom')
-        logger.setLevel(logging.DEBUG)
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.DEBUG)
-        ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        logger.addHandler(ch)
-        self.__logger = logger
-        self.controller.enable_logger()
+        enable_debug_logging()
 
     def disable_logger(self):
         """
         Disable the logger
        :return:
        """
-        self.__logger = None
-        self.controller.disable_logger()
+        disable_debug_logging()
 
-    def log(self, *args):
-        if self.__logger:
-            # Convert all parameters to strings and merge
-            message_parts = [str(arg) for arg in args]
-            message = " - ".join(message_parts)
-            # Log the message according to the level
-            self.__logger.debug(message)
+    def log(self, msg, *args):
+        """Debug record, %-style arguments are only formatted when it is emitted"""
+        _LOGGER.debug(msg, *args)
 
     def create_socket(self):
         if self.client:
@@ -253,8 +333,23 @@ class KLWIOTClient(KLWEventEmitter):
                 self.client.close()
             except:
                 pass
+        self._login_event.clear()
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client.settimeout(self.connect_timeout)  # Connection timeout, in seconds
+        self._enable_keepalive(self.client)
+
+    def _enable_keepalive(self, sock):
+        """Let the OS detect a dead gateway long before the heartbeat timeout"""
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.heartbeat_interval)
+            if hasattr(socket, 'TCP_KEEPINTVL'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 5)
+            if hasattr(socket, 'TCP_KEEPCNT'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        except OSError:
+            pass
 
     def get_crm_key_ins(self):
         pwdb = ascii_to_hex(self.gwpwd)
@@ -283,11 +378,12 @@ class KLWIOTClient(KLWEventEmitter):
 
     def login(self):
         # Log in to the system
+        self.__pwdbuffer.clear()
         inslist = self.get_crm_key_ins()
         for ins in inslist:
             self.async_send(ins)
-        # Wait for login results
-        time.sleep(2)  # 1 second delay to check the result
+        # Wait for login results, at most 2 seconds
+        self._login_event.wait(2)
         if self._is_logined():
             self._authed = True
         else:
@@ -313,13 +409,53 @@ class KLWIOTClient(KLWEventEmitter):
         """
         Processing after successful login
         """
-        # Start the heartbeat thread
-        self.heartbeat_thread = threading.Thread(target=self.heartbeat_handler)
-        self.heartbeat_thread.daemon = True
-        self.heartbeat_thread.start()
-        # Query all devices
+        if self.manager:
+            # The manager sends the heartbeats and staggers the queries of all gateways
+            self.manager.schedule_query(self)
+            return
+        # Start the heartbeat thread, a single one that outlives the reconnects
+        if not (self.heartbeat_thread and self.heartbeat_thread.is_alive()):
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat_handler)
+            self.heartbeat_thread.daemon = True
+            self.heartbeat_thread.start()
+        # Query all devices, the buffers keep the known states so only the changes raise events
         self.query_all_devices()
 
+    def restore_buffers(self):
+        """
+        Seed the device buffers with the states persisted in the bucket,
+        so that the full-state dump after (re)connecting only raises events for the devices that changed
+        """
+        buffers = {
+            BufferType.DEVICEBUFFER: self.__devbuffer,
+            BufferType.SCENEBUFFER: self.__scenebuffer,
+            BufferType.SENSORBUFFER: self.__sensorbuffer,
+            BufferType.SENSOREXBUFFER: self.__sensorextendbuffer,
+            BufferType.VOLBUFFER: self.__volbuffer,
+            BufferType.CACHEBUFFER: self.__cachebuffer,
+            BufferType.SECURITYBUFFER: self.__securitybuffer,
+        }
+        restored = 0
+        for raw in self.devicebucket.get_bucket_values():
+            if not isinstance(raw, dict) or raw.get('nid') != self.client_id:
+                continue
+            buf = buffers.get(raw.get('type'))
+            uid = raw.get('uid')
+            data = raw.get('data')
+            if buf is None or not uid or not data or len(data) != 8:
+                continue
+            # RGB records share the uid of their 199 device but hold a 250 frame
+            if str(data[0]) != uid.split('-')[0] or buf.get_device_by_id(uid):
+                continue
+            ins = Instruction(data)
+            buf.devices[uid] = CRMDevice(uid, ins)
+            if buf is self.__devbuffer and data[1] == 199:
+                key199 = buf.create_index(ins, [1, 2, 3, 4])
+                self.__f199buffer.devices[key199] = CRMDevice(key199, ins)
+            restored += 1
+        self.log("Restored %d device states", restored)
+        return restored
+
     def query_all_devices(self):
         """
         Query all devices
@@ -333,6 +469,89 @@ class KLWIOTClient(KLWEventEmitter):
         for inst in instlist:
             self.async_send(inst)
 
+    def refresh(self, fid: int = 255, rid: int = 255, did: int = 255, scoped: bool = False):
+        """
+        Ask the gateway for the states of all the devices without clearing the buffers:
+        the reports are reconciled against the known states, only the devices that changed raise an event.
+        UNVERIFIED: with scoped, the query 243,166,fid,rid,did (255: all the floors/rooms/devices) targets a floor,
+        a room or a device, no gateway is known to honour it, by default the full dump 243,166,255,0,0,0,0 is sent.
+        """
+        if not scoped or fid == 255:
+            self.query_all_devices()
+        else:
+            self.async_send(Instruction([243, 166, fid, rid, did, 0, 0]))
+
+    def device_address(self, oid: str) -> Optional[Tuple[int, int, int]]:
+        """(fid, rid, did) of a known device, None for the other objects (sensors, scenes...)"""
+        raw = self.devicebucket.get_device_from_database(oid)
+        if not raw or raw.get('type') != BufferType.DEVICEBUFFER:
+            return None
+        detail = raw.get('detail') or {}
+        return detail.get('fid', 0), detail.get('rid', 0), detail.get('did', 0)
+
+    def stale_devices(self, max_age: float) -> List[Tuple[int, int, int]]:
+        """(fid, rid, did) of the known devices the gateway did not report for max_age seconds"""
+        deadline = time.monotonic() - max_age
+        stale = set()
+        for oid in self.devicebucket.get_bucket_keys():
+            address = self.device_address(oid)
+            if address and self.last_seen.get(address, 0.0) < deadline:
+                stale.add(address)
+        return sorted(stale)
+
+    def check_freshness(self, now: float):
+        """
+        Query the devices the gateway did not report for freshness_heartbeats heartbeats (a full dump at most once
+        per period), and emit on_freshness_change when the set of the stale ones changed: those still silent for
+        twice that long, counted from the login so that a device has answered at least one query.
+        The stale devices do not trigger queries, they are fresh again with their next report
+        """
+        max_age = self.freshness_heartbeats * self.heartbeat_interval
+        since_login = now - self._logged_in_at
+        if since_login >= max_age and now - self._freshness_query_at >= max_age:
+            stale_addresses = {self.device_address(oid) for oid in self.stale_oids}
+            if self.refresh_devices([a for a in self.stale_devices(max_age) if a not in stale_addresses]):
+                self._freshness_query_at = now
+        deadline = now - 2 * max_age
+        stale = set()
+        for oid in self.devicebucket.get_bucket_keys():
+            address = self.device_address(oid)
+            if address is None:
+                continue
+            seen = self.last_seen.get(address, 0.0)
+            # Within the grace period only the devices that reported since the login leave the stale set
+            if seen < deadline and (since_login >= 2 * max_age or (oid in self.stale_oids and
+                                                                  seen < self._logged_in_at)):
+                stale.add(oid)
+        if stale != self.stale_oids:
+            self.stale_oids = stale
+            self.emit('on_freshness_change', set(stale))
+
+    def refresh_devices(self, addresses: Iterable[Tuple[int, int, int]], max_age: float = None,
+                        scoped: bool = False) -> int:
+        """
+        Refresh the given devices, with max_age only those not reported for max_age seconds,
+        with one full dump, or (scoped, UNVERIFIED, see refresh) a query per device, per room with several of them.
+        Return the number of queries sent
+        """
+        if max_age is not None:
+            deadline = time.monotonic() - max_age
+            addresses = [a for a in addresses if self.last_seen.get(a, 0.0) < deadline]
+        if not scoped:
+            if not addresses:
+                return 0
+            self.query_all_devices()
+            return 1
+        rooms: Dict[Tuple[int, int], set] = {}
+        for fid, rid, did in addresses:
+            rooms.setdefault((fid, rid), set()).add(did)
+        for (fid, rid), dids in sorted(rooms.items()):
+            if len(dids) > 1:
+                self.refresh(fid, rid, 255, scoped=True)
+            else:
+                self.refresh(fid, rid, next(iter(dids)), scoped=True)
+        return len(rooms)
+
     def connect(self):
         self.running = True
         if not self.attempt_connection():
@@ -359,42 +578,101 @@ class KLWIOTClient(KLWEventEmitter):
             self.client.connect((self.host, self.port))
             self.connected = True
             self.ever_connected = True
-            print(f"{get_current_time()} Successfully connected to {self.host}:{self.port}")
+            _LOGGER.info("Successfully connected to %s:%s", self.host, self.port)
             # Remove timeout limit after successful connection
             self.client.settimeout(None)
-            # Start sending and receiving threads
-            self.receive_thread = threading.Thread(target=self.receive_messages)
-            self.send_thread = threading.Thread(target=self.__async_send_messages_handler)
-            self.receive_thread.daemon = True
-            self.send_thread.daemon = True
-            self.receive_thread.start()
-            self.send_thread.start()
+            self._last_timestamp = time.time() * 1000
+            if self.manager:
+                # The manager multiplexes the socket with the other gateways, on its single I/O thread:
+                # a stalled gateway must not block the others, writes go through the outbox (flush_outbox)
+                with self._outbox_lock:
+                    self._outbox.clear()
+                    self._outbox_since = None
+                self.client.setblocking(False)
+                self.manager.attach(self)
+            else:
+                # Start sending and receiving threads, they exit when the socket is replaced
+                self.receive_thread = threading.Thread(target=self.receive_messages, args=(self.client,))
+                self.send_thread = threading.Thread(target=self.__async_send_messages_handler, args=(self.client,))
+                self.receive_thread.daemon = True
+                self.send_thread.daemon = True
+                self.receive_thread.start()
+                self.send_thread.start()
             # Log in to the system
+            self._login_started = time.monotonic()
             self.login()
-            self.log("Login system:" + str(self._authed))
+            self.log("Login system: %s", self._authed)
             if self._authed:
-                self.emit('on_login_success')
-                self._after_login()
+                self._on_logged_in()
+            elif self.manager and not self._login_event.is_set():
+                # No answer yet, the manager completes the login when it comes or reconnects (check_login)
+                self._login_pending = True
             else:
                 self.emit('on_login_failed')
+                if self.manager and self.connected:
+                    # There is no auto_reconnect thread in manager mode, retry through the reconnect policy
+                    self.handle_disconnection()
 
             return True
         except socket.timeout:
-            print(f"{get_current_time()} Connection timeout after {self.connect_timeout} seconds")
+            _LOGGER.warning("Connection timeout after %s seconds", self.connect_timeout)
             self.connected = False
             self.handle_disconnection()
             return False
         except ConnectionRefusedError:
-            print(f"{get_current_time()} Connection failed. Server not available.")
+            _LOGGER.warning("Connection to %s:%s failed. Server not available.", self.host, self.port)
             self.connected = False
             self.handle_disconnection()
             return False
         except Exception as e:
-            print(f"{get_current_time()} Connection error: {str(e)}")
+            _LOGGER.warning("Connection error: %s", e)
             self.connected = False
             self.handle_disconnection()
             return False
 
+    def _on_logged_in(self):
+        self._login_pending = False
+        self._logged_in_at = time.monotonic()
+        self.reconnect_policy.reset()
+        if self.metrics.enabled:
+            self.metrics.count('logins')
+        self.emit('on_login_success')
+        self._after_login()
+
+    def check_login(self, now: float):
+        """
+        Manager mode: complete a login the gateway answered after login() gave up,
+        or drop the connection when it was refused or not answered within connect_timeout
+        """
+        if not self._login_pending:
+            return
+        if self._authed or (self._login_event.is_set() and self._is_logined()):
+            self._authed = True
+            self._on_logged_in()
+        elif self._login_event.is_set() or now - self._login_started >= self.connect_timeout:
+            self._login_pending = False
+            _LOGGER.warning("Login of %s not accepted, reconnecting", self.client_id)
+            self.emit('on_login_failed')
+            self.handle_disconnection()
+
+    def update_address(self, host: str, port: int = None):
+        """
+        The gateway moved (e.g. new DHCP lease): use the new address and, if the connection is down,
+        reconnect to it right away instead of waiting for the backoff
+        """
+        port = port or self.port
+        if (host, port) == (self.host, self.port):
+            return
+        self.host, self.port = host, port
+        if self.connected and self._authed:
+            # The current connection still works, the next reconnect will use the new address
+            return
+        self.reconnect_policy.reset()
+        if self.manager:
+            self.manager.reconnect_now(self)
+        else:
+            self._reconnect_event.set()
+
     def handle_input(self):
         """New thread (non-daemon thread) to handle user input"""
         while self.running:
@@ -414,65 +692,272 @@ class KLWIOTClient(KLWEventEmitter):
     def async_send(self, inst: Instruction):
         """Asynchronously send a message"""
         if not self.connected:
-            print(f"{get_current_time()} Not connected to server", inst)
+            _LOGGER.warning("Not connected to server, dropped %s", inst)
             return
-        self.log(f"Waiting Send: {inst}")
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Waiting Send: %s", inst)
+        if self.metrics.enabled:
+            inst.queued_at = time.monotonic()
+        waiter = getattr(inst, 'waiter', None)
+        if waiter is not None:
+            waiter.queued_at = time.monotonic()
         self.waiting_commands.put(inst)
+        if self.manager:
+            self.manager.wakeup()
+
+    async def execute(self, action, payload, wait_ack: bool = True, timeout: float = 2.0,
+                      retries: int = 1) -> Dict[str, Any]:
+        """
+        Run an IOT.Control action, with wait_ack until the gateway acknowledges each command
+        (a state report of the same fid/rid/did), resending the unacknowledged ones up to retries times.
+        :param timeout: seconds per attempt, from the queueing of the commands
+        :return: {'acked': all acknowledged (None without wait_ack, False when the action made no command),
+                  'commands': n, 'attempts': n, 'latency_ms': [round trip of each command, None when unacknowledged]}
+        """
+        called_at = time.monotonic()
+        cmds = self.controller.create_commands(action, payload)
+        compiled_at = time.monotonic()
+        if not cmds:
+            return {'acked': False, 'commands': 0, 'attempts': 0, 'latency_ms': []}
+        if not wait_ack:
+            if self.tracer.enabled:
+                self.trace_commands(action, cmds, called_at)
+            self.controller.send_control_commands(cmds)
+            return {'acked': None, 'commands': len(cmds), 'attempts': 1, 'latency_ms': [None] * len(cmds)}
+
+        loop = asyncio.get_running_loop()
+        latencies: List[Optional[float]] = [None] * len(cmds)
+        todo = list(range(len(cmds)))
+        attempts = 0
+        while todo and attempts <= retries and self.connected:
+            attempts += 1
+            waiters = {}
+            for i in todo:
+                # A resent command is a new instruction, the previous one may still be queued
+                inst = cmds[i]
+                if attempts > 1:
+                    inst = Instruction(cmds[i].get_inst())
+                    inst.oid = getattr(cmds[i], 'oid', None)
+                waiters[i] = self.acks.expect(inst, loop, action, called_at, compiled_at, self._device_of(inst))
+                self.async_send(inst)
+            await asyncio.wait([w.future for w in waiters.values()], timeout=timeout)
+            todo = []
+            for i, waiter in waiters.items():
+                if waiter.future.done():
+                    latencies[i] = waiter.latency_ms
+                    if self.metrics.enabled:
+                        self.metrics.observe('ack_latency_ms', waiter.latency_ms)
+                else:
+                    self.acks.discard(waiter)
+                    waiter.future.cancel()
+                    todo.append(i)
+            if todo:
+                _LOGGER.debug("%s: %d of %d commands unacknowledged after attempt %d",
+                              action, len(todo), len(cmds), attempts)
+                if self.metrics.enabled:
+                    self.metrics.count('ack_timeouts', len(todo))
+        return {'acked': not todo, 'commands': len(cmds), 'attempts': attempts, 'latency_ms': latencies}
+
+    def trace_commands(self, action: str, insts: List[Instruction], called_at: float):
+        """Trace the commands of an action until the gateway reports the state of their devices"""
+        compiled_at = time.monotonic()
+        for inst in insts:
+            self.acks.expect(inst, action=action, called_at=called_at, compiled_at=compiled_at,
+                             device=self._device_of(inst))
+
+    def _device_of(self, inst: Instruction) -> Optional[dict]:
+        oid = getattr(inst, 'oid', None)
+        return self.devicebucket.get_device_from_database(oid) if oid else None
 
     def sync_send(self, inst: Instruction):
         """Synchronously send a message"""
         if not self.connected:
-            print(f"{get_current_time()} Not connected to server")
+            _LOGGER.warning("Not connected to server")
             return
         data = inst.get_inst()
-        self.log(f"Sync Send: {self._get_decs(data)}")
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Sync Send: %s", Decs(data))
         self._send_data(data)
 
     async def async_send_list(self, insts: List[Instruction], interval: float = 1.0) -> None:
         """Asynchronously send a list of instructions, with custom interval time"""
         if not self.connected:
-            print(f"{get_current_time()} Not connected to server")
+            _LOGGER.warning("Not connected to server")
             return
         for inst in insts:
             try:
                 data = inst.get_inst()
-                self.log(f"Async Send: {self._get_decs(data)}")
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    _LOGGER.debug("Async Send: %s", Decs(data))
                 self._send_data(data)
                 # Use asynchronous wait instead of time.sleep
                 await asyncio.sleep(interval)
             except Exception as e:
-                print(f"Failed to send instruction: {e}")
+                _LOGGER.warning("Failed to send instruction: %s", e)
                 # You can choose to continue sending or interrupt
                 # break
 
     def _send_data(self, data: Union[bytes, bytearray, List[int]]):
         # Convert to bytearray
         cmds = self.pack_binary_data(data)
-        self.client.send(cmds)
+        if self.manager:
+            with self._outbox_lock:
+                self._outbox += cmds
+            self.flush_outbox()
+        else:
+            self.client.send(cmds)
+        if self.stats:
+            self.stats.on_send(len(cmds))
+        if self.capture:
+            self.capture.record(SENT, cmds)
+        if self.metrics.enabled:
+            self.metrics.count('frames_sent', max(1, len(cmds) // 8))
+
+    def flush_outbox(self) -> bool:
+        """
+        Manager mode: write what the non-blocking socket accepts, the manager is asked to finish the write
+        when the socket is writable again. Return True when everything is written
+        """
+        with self._outbox_lock:
+            while self._outbox:
+                try:
+                    sent = self.client.send(self._outbox)
+                except (BlockingIOError, InterruptedError):
+                    break
+                del self._outbox[:sent]
+            if not self._outbox:
+                self._outbox_since = None
+                return True
+            if self._outbox_since is None:
+                self._outbox_since = time.monotonic()
+        self.manager.want_write(self)
+        return False
 
-    def __async_send_messages_handler(self):
+    def start_capture(self, path: str):
+        """Record every received and sent frame to the file, see klw_capture"""
+        self.stop_capture()
+        self.capture = CaptureWriter(path, authed=self.connected and self._authed)
+
+    def stop_capture(self) -> int:
+        """Stop recording, return the number of records written"""
+        capture, self.capture = self.capture, None
+        if not capture:
+            return 0
+        capture.close()
+        return capture.records
+
+    def start_profiling(self, interval: float = 0.005, max_duration: float = 300.0,
+                        threads: Optional[Dict[int, str]] = None) -> SamplingProfiler:
+        """
+        Sample the stacks of the client threads, those of the gateway manager when it owns the socket,
+        and the given extra threads (ident -> name, e.g. the event loop), see klw_profiler
+        """
+        self.stop_profiling()
+        extra = dict(threads or {})
+        self.profiler = SamplingProfiler(lambda: {**self._profiled_threads(), **extra}, interval, max_duration)
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profiling(self) -> Optional[SamplingProfiler]:
+        """Stop sampling, return the profiler holding the folded stacks"""
+        profiler, self.profiler = self.profiler, None
+        if profiler:
+            profiler.stop()
+        return profiler
+
+    def _profiled_threads(self) -> Dict[int, str]:
+        threads = [(name, getattr(self, f"{name}_thread")) for name in ('receive', 'send', 'heartbeat', 'reconnect')]
+        if self.manager:
+            threads += [(t.name, t) for t in threading.enumerate()
+                        if t.name == 'klw-gateways' or t.name.startswith('klw-connect')]
+        return {thread.ident: name for name, thread in threads if thread and thread.ident and thread.is_alive()}
+
+    def __async_send_messages_handler(self, sock=None):
         """Thread function to send messages"""
-        while self.running:
+        while self.running and sock is self.client:
             if not self.connected:
                 time.sleep(1)
                 continue
             try:
-                # Use the queue to get messages, set a timeout to avoid blocking
-                try:
-                    inst = self.waiting_commands.get(timeout=1)
-                    if self.connected:
-                        data = inst.get_inst()
-                        self.log(f"Async Send: {self._get_decs(data)}")
-                        self._send_data(data)
-                        # Wait to ensure that there is an interval between the sent commands
-                        time.sleep(self.get_sleep_time())
-
-                except queue.Empty:
-                    continue
+                due = self._send_next_command(time.monotonic())
+                if due is None:
+                    # Use the queue to get messages, set a timeout to avoid blocking
+                    try:
+                        inst = self.waiting_commands.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    self._add_pending_command(inst, time.monotonic())
+                else:
+                    # Wait to ensure that there is an interval between the sent commands
+                    time.sleep(max(0.0, due - time.monotonic()))
             except Exception as e:
-                print(f"{get_current_time()} Send error: {str(e)}")
+                _LOGGER.error("Send error: %s", e)
                 time.sleep(1)
 
+    def _add_pending_command(self, inst: Instruction, now: float):
+        self._pending_commands.append(inst)
+        if (len(self._pending_commands) == 1 and self.controller.group_control
+                and self.controller.is_group_member(inst)):
+            # Give the other commands of a room/floor wide operation a chance to arrive
+            self._next_send_time = max(self._next_send_time, now + self.group_coalesce_window)
+
+    def _send_next_command(self, now: float) -> Optional[float]:
+        """
+        Send the next command if its slot has come,
+        return the monotonic time of the next slot, None if there is nothing to send
+        """
+        if not self._pending_commands:
+            try:
+                self._add_pending_command(self.waiting_commands.get_nowait(), now)
+            except queue.Empty:
+                return None
+        if now < self._next_send_time:
+            return self._next_send_time
+        if self._outbox:
+            # The socket is full, the manager runs the timers again once it is writable
+            return None
+        self._pending_commands = self._collect_waiting_commands(self._pending_commands)
+        inst = self._pending_commands.pop(0)
+        if self.connected:
+            data = inst.get_inst()
+            if _LOGGER.isEnabledFor(logging.DEBUG):
+                _LOGGER.debug("Async Send: %s", Decs(data))
+            self._send_data(data)
+            self._next_send_time = now + self.get_sleep_time()
+            if self.acks.pending:
+                AckTracker.sent(inst, time.monotonic())
+            queued_at = getattr(inst, 'queued_at', None)
+            if queued_at is not None and self.metrics.enabled:
+                # Pacing + coalescing delay of the command
+                self.metrics.observe('send_delay_ms', (now - queued_at) * 1000)
+        return self._next_send_time
+
+    def _collect_waiting_commands(self, pending: List[Instruction]) -> List[Instruction]:
+        """
+        Move the queued commands behind the pending ones and merge room/floor wide commands,
+        only the new commands and the run of pending ones they may continue are examined
+        """
+        drained = []
+        while True:
+            try:
+                drained.append(self.waiting_commands.get_nowait())
+            except queue.Empty:
+                break
+        if not drained:
+            return pending
+        if not self.controller.group_control:
+            pending.extend(drained)
+            return pending
+        start = len(pending)
+        controller = self.controller
+        if start and controller.is_group_member(pending[-1]) and not controller.is_awaited(pending[-1]):
+            key = controller.group_key(pending[-1])
+            while (start > 0 and controller.is_group_member(pending[start - 1])
+                   and not controller.is_awaited(pending[start - 1])
+                   and controller.group_key(pending[start - 1]) == key):
+                start -= 1
+        return pending[:start] + controller.merge_group_cmds(pending[start:] + drained)
+
     def get_sleep_time(self):
         """
         Get the instruction interval time according to the system level
@@ -491,88 +976,136 @@ class KLWIOTClient(KLWEventEmitter):
 
     def auto_reconnect(self):
         while self.running:
-            # if not self.connected and self.ever_connected:
-            if self.running and not self._authed:
-                print(f"{get_current_time()} Attempting to reconnect in {self.reconnect_interval} seconds...")
-                time.sleep(self.reconnect_interval)
-                if self.attempt_connection():
-                    print(f"{get_current_time()} Reconnection successful!")
-            time.sleep(1)
+            if not self._authed:
+                # Immediate first retry, then exponential backoff with jitter
+                delay = self.reconnect_policy.next_delay()
+                self._reconnect_event.clear()
+                if delay > 0:
+                    _LOGGER.info("Attempting to reconnect in %.1f seconds...", delay)
+                    self._reconnect_event.wait(delay)
+                if not self.running:
+                    break
+                if self.attempt_connection() and self._authed:
+                    _LOGGER.info("Reconnection successful!")
+            else:
+                # handle_disconnection wakes us up right away
+                self._reconnect_event.wait(1)
 
-    def receive_messages(self):
-        while self.running:
+    def receive_messages(self, sock=None):
+        sock = sock or self.client
+        while self.running and sock is self.client:
             if not self.connected:
                 time.sleep(1)
                 continue
             try:
-                data = self.client.recv(1024)
+                data = sock.recv(1024)
                 if data:
-                    datas_hex = self._get_decs(data)
-                    self.log(f"Received: {datas_hex}")
-                    self.data_buffer.extend(data)
-                    self.split_datas()
-                else:
-                    print(f"{get_current_time()} Server disconnected")
-                    self.handle_disconnection()
-                    break
+                    self._handle_received(data)
+                    continue
+                _LOGGER.warning("Server disconnected")
             except ConnectionResetError:
-                print(f"{get_current_time()} Connection reset by server")
-                self.handle_disconnection()
-                break
+                _LOGGER.warning("Connection reset by server")
             except Exception as e:
-                print(f"{get_current_time()} Receive error: {str(e)}")
+                _LOGGER.warning("Receive error: %s", e)
+            # A late error of a replaced socket must not drop the new connection
+            if sock is self.client:
                 self.handle_disconnection()
-                break
+            break
+
+    def _handle_received(self, data: bytes):
+        """Process the data received from the gateway"""
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Received: %s", Decs(data))
+        if self.stats:
+            self.stats.on_receive(len(data))
+        if self.capture:
+            self.capture.record(RECEIVED, data)
+        if self.metrics.enabled:
+            start = time.perf_counter()
+            self.data_buffer.extend(data)
+            self.split_datas()
+            self.metrics.observe('parse_ms', (time.perf_counter() - start) * 1000)
+            self.metrics.count('frames_received', max(1, len(data) // 8))
+        else:
+            self.data_buffer.extend(data)
+            self.split_datas()
 
     def heartbeat_handler(self):
         while self.running:
-
             time.sleep(self.heartbeat_interval)
             if self.connected and self._authed:
-                # Send heartbeat instruction
-                ins = Instruction([243, 255, 255, 255, 255, 255, 255])
-                self.async_send(ins)
-            # Check if no data has been received for more than 3 cycles, it is considered that the connection is disconnected and a reconnection operation is required
-            if self._last_timestamp and (
-                    time.time() * 1000 - self._last_timestamp > 3 * self.heartbeat_interval * 1000):
-                print(f"{get_current_time()} Connection timeout, reconnecting...")
-                self.handle_disconnection()
-                break
+                self.heartbeat()
+
+    def heartbeat(self) -> bool:
+        """
+        Send the heartbeat, return False when the connection is considered lost
+        """
+        self._last_heartbeat = time.monotonic()
+        if self.connected and self._authed:
+            # Send heartbeat instruction
+            ins = Instruction([243, 255, 255, 255, 255, 255, 255])
+            self.async_send(ins)
+            self.flush_sensors()
+            if self.freshness_heartbeats:
+                self.check_freshness(time.monotonic())
+        # Check if no data has been received for more than 3 cycles, it is considered that the connection is disconnected and a reconnection operation is required
+        if self._last_timestamp and (
+                time.time() * 1000 - self._last_timestamp > 3 * self.heartbeat_interval * 1000):
+            _LOGGER.warning("Connection timeout, reconnecting...")
+            self.handle_disconnection()
+            return False
+        return True
 
     def split_datas(self):
         """
         Split and process the data packets in the data buffer. The processed data will be removed from the buffer to avoid data accumulation
         """
         buf = self.data_buffer
+        length = len(buf)
         processed_length = 0  # Record the length of processed data
 
-        while len(buf) > 0:
-            if len(buf) >= 4 and buf[0] == 0x77 and buf[1] == 0x55 and buf[2] == 0x33 and buf[3] == 0x11:
+        while processed_length < length:
+            i = processed_length
+            if length - i >= 4 and buf[i] == 0x77 and buf[i + 1] == 0x55 and buf[i + 2] == 0x33 and buf[i + 3] == 0x11:
                 # Header verification passed
-                if len(buf) < 14:
+                if length - i < 14:
                     break
-                data_len = buf[13]
+                data_len = buf[i + 13]
                 pack_len = 14 + data_len + 2
 
-                if len(buf) >= pack_len:
-                    data = buf[:pack_len]
+                if length - i >= pack_len:
+                    data = buf[i:i + pack_len]
                     processed_length += pack_len
                     self._translate_plc(data)
-                    buf = buf[pack_len:]
                 else:
                     break
             else:
-                if len(buf) >= 8:
-                    data = buf[:8]
+                if length - i >= 8:
+                    data = buf[i:i + 8]
+                    # D8 = sum(Dk * (8 - k)) % 256, a mismatch means the stream lost its alignment:
+                    # slide one byte and try again.
+                    # Instruction.checksum inlined, this runs for every received frame: keep both in sync
+                    if (data[0] * 8 + data[1] * 7 + data[2] * 6 + data[3] * 5 + data[4] * 4 + data[5] * 3
+                            + data[6] * 2) % 256 != data[7]:
+                        if not self._resyncing:
+                            self._resyncing = True
+                            self.resyncs += 1
+                            if self.metrics.enabled:
+                                self.metrics.count('resyncs')
+                            if _LOGGER.isEnabledFor(logging.DEBUG):
+                                _LOGGER.debug("Checksum mismatch, resync: %s", Decs(data))
+                        self.discarded_bytes += 1
+                        processed_length += 1
+                        continue
+                    self._resyncing = False
                     processed_length += 8
                     self._translate(data)
-                    buf = buf[8:]
                 else:
                     break
 
         # Update the buffer, removing the processed data
         if processed_length > 0:
-            self.data_buffer = self.data_buffer[processed_length:]
+            del self.data_buffer[:processed_length]
 
         # Update timestamp
         self._last_timestamp = time.time() * 1000
@@ -591,6 +1124,13 @@ class KLWIOTClient(KLWEventEmitter):
         if self._is_available_dx(ins.get_d1()):
             self._add_to_device_list(ins)
 
+        if ins.b[0] == 243 and ins.b[1] in DEVICE_REPLIES:
+            # Unchanged reports are dropped by the buffers, the staleness is tracked here,
+            # for the device states only: D5 of the sensor reports is a value, not a device
+            self.last_seen[(ins.b[2], ins.b[3], ins.b[4])] = time.monotonic()
+        if self.acks.pending and (ins.b[0] == 243 or ins.b[0] == 250):
+            self.acks.match(ins.b)
+
         # Respond to asynchronous callbacks
         self.process_callbacks(ins)
 
@@ -602,7 +1142,7 @@ class KLWIOTClient(KLWEventEmitter):
                 if callback:
                     callback(data, is_plc)
             except Exception as e:
-                print(f"Error processing callback {key}: {e}")
+                _LOGGER.error("Error processing callback %s: %s", key, e)
                 # You can choose whether to remove the erroneous callback
                 self.__feedback_callbacks.pop(key, None)
 
@@ -635,6 +1175,7 @@ class KLWIOTClient(KLWEventEmitter):
                     self.__sensorbuffer.add(ins, [0, 1, 2, 3])
             elif cmd == 130:
                 self.__pwdbuffer.add(ins, [0, 1])
+                self._login_event.set()
             elif cmd in [191, 192, 193]:
                 self.__securitybuffer.add(ins, [0])
             elif cmd == 129:
@@ -717,14 +1258,22 @@ class KLWIOTClient(KLWEventEmitter):
                 self.__timebuffer.add(ins, [0, 1])
 
     def handle_disconnection(self):
+        if self.metrics.enabled and self.connected:
+            self.metrics.count('disconnects')
         self.connected = False
         self._authed = False
+        self._login_pending = False
         self.set_living(False)
+        if self.manager:
+            self.manager.detach(self)
         try:
             self.client.close()
         except:
             pass
-        print(f"{get_current_time()} Connection lost. Auto-reconnect enabled.")
+        self._reconnect_event.set()
+        # The gateway may have moved (e.g. new DHCP lease): look for it now rather than at the next periodic probe
+        GatewayDiscovery().probe()
+        _LOGGER.warning("Connection lost. Auto-reconnect enabled.")
 
     def is_alarm(self, inst) -> bool:
         """Determine if it is an alarm."""
@@ -803,13 +1352,19 @@ class KLWIOTClient(KLWEventEmitter):
         """Stop the client"""
         self.running = False
         self.connected = False
+        self._reconnect_event.set()
+        self.stop_capture()
+        self.stop_profiling()
+        self.acks.clear()
+        if self.manager:
+            self.manager.remove(self)
         # clear all listeners
         self.remove_all_listeners()
         try:
             self.client.close()
-            print(f"{()} Connection closed")
+            _LOGGER.info("Connection closed")
         except Exception as e:
-            print(f"{get_current_time()} Error closing connection: {str(e)}")
+            _LOGGER.warning("Error closing connection: %s", e)
 
     def _get_hex(self, num: int) -> str:
         hex_str = format(num, '02X')
@@ -1,10 +1,12 @@
 import asyncio
-import time
+import logging
 from typing import List, Callable
 
 from .klw_iotclient import KLWIOTClient
 from .klw_security import Crypto
 
+_LOGGER = logging.getLogger(__name__)
+
 
 class KLWIOTClientLC(KLWIOTClient):
     def __init__(self, host='192.168.1.178', port=4196, code=None, client_id=None, password="1234", system_level=0,
@@ -16,23 +18,21 @@ class KLWIOTClientLC(KLWIOTClient):
 
     def login(self):
         # Login system, wait for verification to complete
-        # await asyncio.sleep(2)  #
-        time.sleep(2)
-        # Loop non-blocking wait, return when _authed=True is detected, otherwise wait for timeout to return
+        # The handshake runs in split_datas, return as soon as it is answered, at most after 2 seconds
+        self._login_event.wait(2)
         return self._authed
 
     def split_datas(self) -> None:
         """Handle data sharding"""
         buf = self.data_buffer
-        temp = []
         length = len(buf)
         # self.log("Receiving data length:",self._authed,length)
         # If 37 bytes are received, it means an unauthorized connection
         if not self._authed and length >= 37:
             self._authed = False
             # Copy data to a temporary array
-            for _ in range(length):
-                temp.append(buf.pop(0))
+            temp = buf[:]
+            del buf[:]
 
             # Create a message array
             msg = [0] * 37
@@ -42,31 +42,26 @@ class KLWIOTClientLC(KLWIOTClient):
             # Process 01 instruction
             if msg[4] == 0x01:
                 msg[4] = 0x04
-                # Extract random number
-                ran = [0] * 16
-                for i in range(21, 37):
-                    ran[i - 21] = msg[i]
-
-                # Encryption processing
-                cry_ran = Crypto.decrypt(ran, self._code)
-                for i in range(21, 37):
-                    msg[i] = cry_ran[i - 21]
+                # Encryption processing of the random number, the AES context of the secure code is reused
+                msg[21:37] = Crypto.session(self._code).decrypt(msg[21:37])
 
                 self._send_data(msg)
 
             # Process 05 instruction
             elif msg[4] == 0x05:
                 if msg[21] == 0x01:
-                    self.log("Connection successful")
+                    _LOGGER.debug("Connection successful")
                     self._authed = True
+                    self._login_event.set()
                     # self.after_connect()
                 elif msg[21] == 0x00:
                     self._authed = False
-                    self.log("Connection failed")
+                    _LOGGER.warning("Secure code handshake of %s failed", self.host)
+                    self._login_event.set()
                     self.handle_disconnection()
             else:
                 # If neither is 01 or 05, it is a failed instruction
-                self.log(f"Received unknown instruction: {hex(msg[4])}")
+                _LOGGER.warning("Received unknown instruction: %#x", msg[4])
                 self._authed = False
                 self.handle_disconnection()
 
@@ -1,38 +1,160 @@
 import logging
 import math
-from typing import List, Dict, Callable
+import time
+from typing import List, Dict, Callable, Optional
 from typing import TYPE_CHECKING
 
 from .klw_common import Instruction
+from .klw_type import BufferType, DeviceType
 
 if TYPE_CHECKING:
     from .klw_iotclient import KLWIOTClient
 
+_LOGGER = logging.getLogger(__name__)
+
+# Opcodes the gateway also accepts with room (did=0) or floor (rid=0, did=0) addressing
+GROUP_OPCODES = {154, 158}
+# Devices a room/floor wide on/off reaches: the lights and switches, not the ACs, curtains, fresh air...
+GROUP_CATEGORIES = {DeviceType.TOGGLE, DeviceType.TOGGLE_LIGHT, DeviceType.ADJUST_LIGHT, DeviceType.RGB_LIGHT,
+                    DeviceType.WARM_LIGHT, DeviceType.RGBW_LIGHT}
+
+# Placeholders of an action template: the address comes from the device detail,
+# V0..V2 from the (mapped) payload value
+FID, RID, DID = 'fid', 'rid', 'did'
+V0, V1, V2 = 'v0', 'v1', 'v2'
+_VALUE_SLOTS = {V0: 0, V1: 1, V2: 2}
+
+
+def _lookup(table):
+    """Map an index to a protocol value, None if it is out of the table"""
+
+    def mapper(value):
+        return table[value] if 0 <= value < len(table) else None
+
+    return mapper
+
+
+def _rgb(color):
+    return color.get('r', 255), color.get('g', 255), color.get('b', 255)
+
+
+# Declarative action table, action -> spec
+#   template: the 7 instruction bytes D1-D7 with address and value placeholders
+#   default : value used when the payload item has none, otherwise the item is skipped
+#   clamp   : (min, max) the value is clamped into
+#   range   : (min, max) the value must be in, otherwise the item is skipped
+#   map     : converts the value to the protocol value (a tuple for V0..V2), None skips the item
+ACTION_TABLE = {
+    'DeviceOn': {'template': (243, 154, FID, RID, DID, 0, 0)},
+    'DeviceOff': {'template': (243, 158, FID, RID, DID, 0, 0)},
+    'DeviceToggle': {'template': (243, 159, FID, RID, DID, 0, 0)},
+    # Scene control
+    'SceneTrigger': {'template': (237, FID, RID, DID, 0, 0, 0)},
+    # Brightness control, convert brightness value from 0-100 to 0-15
+    'SetBrightness': {'template': (243, 165, FID, RID, DID, V0, 0), 'default': 0,
+                      'map': lambda value: math.floor(value / 100 * 15)},
+    'IncBrightness': {'template': (243, 160, FID, RID, DID, 0, 0)},
+    'DecBrightness': {'template': (243, 161, FID, RID, DID, 0, 0)},
+    # Color control
+    'SetColor': {'template': (112, FID, RID, DID, V0, V1, V2), 'default': {"r": 255, "g": 255, "b": 255},
+                 'map': _rgb},
+    'SetColorTemperature': {'template': (112, FID, RID, DID, V0, 0, 0), 'clamp': (0, 100),
+                            'map': lambda value: 100 - value},
+    # Temperature control
+    'SetTemperature': {'template': (46, FID, RID, DID, V0, 0, 0), 'clamp': (15, 30),
+                       'map': lambda value: value - 15},
+    'IncTemperature': {'template': (243, 160, FID, RID, DID, 0, 0)},
+    'DecTemperature': {'template': (243, 161, FID, RID, DID, 0, 0)},
+    # Gear and mode control
+    'SetGear': {'template': (243, 165, FID, RID, DID, V0, 0), 'clamp': (0, 15)},
+    'SetMode': {'template': (243, 164, FID, RID, DID, V0, 0), 'clamp': (0, 4), 'map': _lookup((18, 17, 4, 5))},
+    # Manual-automatic control
+    'SetAuto': {'template': (243, 164, FID, RID, DID, V0, 0), 'clamp': (0, 1), 'map': _lookup((23, 22))},
+    # Speed control
+    'SetSpeed': {'template': (243, 164, FID, RID, DID, V0, 0), 'clamp': (0, 2), 'map': _lookup((19, 20, 21))},
+    'SetSpeedLow': {'template': (243, 164, FID, RID, DID, 19, 0)},
+    'SetSpeedMid': {'template': (243, 164, FID, RID, DID, 20, 0)},
+    'SetSpeedHigh': {'template': (243, 164, FID, RID, DID, 21, 0)},
+    # Remote control keys 0-23, a total of 24 keys at most
+    'SendRCKey': {'template': (243, 164, FID, RID, DID, V0, 0), 'range': (0, 23)},
+    # Curtain control, convert position from 0-100 to 0-10
+    'ShadeOpen': {'template': (243, 154, FID, RID, DID, 0, 0)},
+    'ShadeClose': {'template': (243, 158, FID, RID, DID, 0, 0)},
+    'ShadePause': {'template': (243, 187, FID, RID, DID, 0, 0)},
+    'SetShadeScale': {'template': (243, 164, FID, RID, DID, V0, 0), 'clamp': (0, 100),
+                      'map': lambda value: math.floor(value / 100 * 10) + 6},
+    # Security, 2 means arming
+    'SetSecurity': {'template': (243, V0, 0, 0, 0, 0, 0), 'map': lambda value: 169 if value == 2 else 170},
+    # Volume control, convert volume value from 0-100 to 0-18
+    'SetVolume': {'template': (243, 165, FID, RID, DID, V0, 136), 'clamp': (0, 100),
+                  'map': lambda value: math.floor(value / 100 * 18)},
+    'IncVolume': {'template': (243, 160, FID, RID, DID, 0, 0)},
+    'DecVolume': {'template': (243, 161, FID, RID, DID, 0, 0)},
+    'SetPrevSong': {'template': (243, 162, FID, RID, DID, 0, 0)},
+    'SetNextSong': {'template': (243, 163, FID, RID, DID, 0, 0)},
+    'SetSongFolder': {'template': (243, 223, FID, RID, DID, V0, 0), 'range': (0, 6),
+                      'map': lambda value: value + 10},
+    'SetSource': {'template': (243, 165, FID, RID, DID, V0, 0), 'range': (1, 4)},
+}
+
+
+def compile_action(spec: dict) -> Callable[[dict, dict], Optional[Instruction]]:
+    """
+    Compile an action spec into the function creating the instruction of a payload item
+    """
+    template = list(spec['template'])
+    address_slots = [(i, field) for i, field in enumerate(template) if field in (FID, RID, DID)]
+    value_slots = [(i, _VALUE_SLOTS[field]) for i, field in enumerate(template) if field in _VALUE_SLOTS]
+    default = spec.get('default')
+    clamp = spec.get('clamp')
+    valid_range = spec.get('range')
+    mapper = spec.get('map')
+
+    def create_inst(info, item):
+        values = template[:]
+        for i, field in address_slots:
+            values[i] = info[field]
+        if value_slots:
+            value = item.get('value', default)
+            if value is None:
+                return None
+            if clamp:
+                value = min(max(value, clamp[0]), clamp[1])
+            if valid_range and not valid_range[0] <= value <= valid_range[1]:
+                return None
+            if mapper:
+                value = mapper(value)
+                if value is None:
+                    return None
+            if isinstance(value, tuple):
+                for i, idx in value_slots:
+                    values[i] = value[idx]
+            else:
+                for i, _ in value_slots:
+                    values[i] = value
+        return Instruction(values)
+
+    return create_inst
+
+
+def compile_action_table(table: dict) -> Dict[str, Callable[[dict, dict], Optional[Instruction]]]:
+    """Compile the action table into a dispatch dict"""
+    return {action: compile_action(spec) for action, spec in table.items()}
+
+
+ACTIONS = compile_action_table(ACTION_TABLE)
+
 
 class KLWIOTController:
     def __init__(self, iotserver):
         self.klwiot: 'KLWIOTClient' = iotserver
-        self.__logger = None
-
-    def enable_logger(self):
-        logger = logging.getLogger('IOTController')
-        logger.setLevel(logging.DEBUG)
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.DEBUG)
-        ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        logger.addHandler(ch)
-        self.__logger = logger
-
-    def disable_logger(self):
-        self.__logger = None
-
-    def log(self, *args):
-        if self.__logger:
-            # Convert all parameters to strings and merge
-            message_parts = [str(arg) for arg in args]
-            message = " - ".join(message_parts)
-            # Log the message according to the level
-            self.__logger.debug(message)
+        # Merge commands covering a whole room/floor into a single group instruction
+        self.group_control = True
+        # Compiled action table, action -> instruction creator
+        self._actions = ACTIONS
+
+    def log(self, msg, *args):
+        _LOGGER.debug(msg, *args)
 
     def execute(self, cmd):
         """
@@ -58,85 +180,33 @@ class KLWIOTController:
         if namespace == 'IOT.Control':
             self.control(action, payload)
 
-    def control(self, action, payload):
+    def control(self, action, payload) -> List[Instruction]:
         """
-            IOT.Control namespace to control devices
+            IOT.Control namespace to control devices, returns the created instructions
         """
         try:
-            if action == 'DeviceOn':
-                self.device_on(payload)
-            elif action == 'DeviceOff':
-                self.device_off(payload)
-            elif action == 'DeviceToggle':
-                self.device_toggle(payload)
-            elif action == 'SceneTrigger':
-                self.scene_trigger(payload)
-            elif action == 'SetBrightness':
-                self.set_brightness(payload)
-            elif action == 'IncBrightness':
-                self.inc_brightness(payload)
-            elif action == 'DecBrightness':
-                self.dec_brightness(payload)
-            elif action == 'SetColor':
-                self.set_color(payload)
-            elif action == 'SetColorTemperature':
-                self.set_color_temperature(payload)
-            elif action == 'SetTemperature':
-                self.set_temperature(payload)
-            elif action == 'IncTemperature':
-                self.inc_temperature(payload)
-            elif action == 'DecTemperature':
-                self.dec_temperature(payload)
-            elif action == 'SetGear':
-                self.set_gear(payload)
-            elif action == 'SetMode':
-                self.set_mode(payload)
-            elif action == 'SetAuto':
-                self.set_auto(payload)
-            elif action == 'SetSpeed':
-                self.set_speed(payload)
-            elif action == 'SetSpeedLow':
-                self.set_speed_low(payload)
-            elif action == 'SetSpeedMid':
-                self.set_speed_mid(payload)
-            elif action == 'SetSpeedHigh':
-                self.set_speed_high(payload)
-            elif action == 'SetVolume':
-                self.set_volume(payload)
-            elif action == 'IncVolume':
-                self.inc_volume(payload)
-            elif action == 'DecVolume':
-                self.dec_volume(payload)
-            elif action == 'SendRCKey':
-                self.set_rckey(payload)
-            elif action == 'ShadeOpen':
-                self.shade_open(payload)
-            elif action == 'ShadeClose':
-                self.shade_close(payload)
-            elif action == 'ShadePause':
-                self.shade_pause(payload)
-            elif action == 'SetShadeScale':
-                self.set_shade_scale(payload)
-            elif action == 'SetSecurity':
-                self.set_security(payload)
-            elif action == 'SetVolume':
-                self.set_volume(payload)
-            elif action == 'IncVolume':
-                self.inc_volume(payload)
-            elif action == 'DecVolume':
-                self.dec_volume(payload)
-            elif action == 'SetPrevSong':
-                self.set_prev_song(payload)
-            elif action == 'SetNextSong':
-                self.set_next_song(payload)
-            elif action == 'SetSongFolder':
-                self.set_song_folder(payload)
-            elif action == 'SetSource':
-                self.set_source(payload)
-
-
+            called_at = time.monotonic()
+            cmds = self.create_commands(action, payload)
+            if self.klwiot.tracer.enabled:
+                self.klwiot.trace_commands(action, cmds, called_at)
+            self.send_control_commands(cmds)
+            return cmds
         except Exception as e:
-            self.log(f"Error in control: {e}")
+            _LOGGER.error("Error in control: %s", e)
+            return []
+
+    def create_commands(self, action, payload) -> List[Instruction]:
+        """
+            Create the instructions of an action, sorted by fid,rid,did, without sending them
+        """
+        create_inst = self._actions.get(action)
+        if create_inst is None:
+            _LOGGER.warning("Unsupported action: %s", action)
+            return []
+        self.log("%s - %s", action, payload)
+        cmds = self.create_action(payload, create_inst)
+        self.sort_cmds_with_frd(cmds)
+        return cmds
 
     def send_control_commands(self, insts) -> None:
         """
@@ -145,6 +215,111 @@ class KLWIOTController:
         for inst in insts:
             self.klwiot.async_send(inst)
 
+    def get_group_members(self) -> Dict[int, Dict[int, set]]:
+        """
+        Collect the devices a room/floor wide command reaches (GROUP_CATEGORIES), grouped as {fid: {rid: {did, ...}}}
+        """
+        members = {}
+        for raw in self.klwiot.devicebucket.get_bucket_values():
+            if raw.get('type') != BufferType.DEVICEBUFFER:
+                continue
+            detail = raw.get('detail') or {}
+            if detail.get('category') not in GROUP_CATEGORIES:
+                continue
+            fid, rid, did = detail.get('fid', 0), detail.get('rid', 0), detail.get('did', 0)
+            # fid=0 or rid=0 are global devices, they never belong to a room
+            if fid == 0 or rid == 0:
+                continue
+            members.setdefault(fid, {}).setdefault(rid, set()).add(did)
+        return members
+
+    def merge_group_cmds(self, cmds: List[Instruction]) -> List[Instruction]:
+        """
+            Replace a contiguous run of identical per-device commands by a single room (did=0) or floor
+            (rid=0,did=0) instruction when it covers every member of that room or floor, otherwise keep
+            the per-device frames. Only runs are merged, so the commands of a device keep their order.
+            Commands awaiting their acknowledgement (KLWIOTClient.execute) are never merged,
+            a merged instruction carries the trace waiters of the commands it replaces.
+        """
+        if len(cmds) < 2:
+            return cmds
+        members = None
+        result = []
+        i = 0
+        while i < len(cmds):
+            inst = cmds[i]
+            if not self.is_group_member(inst) or self.is_awaited(inst):
+                result.append(inst)
+                i += 1
+                continue
+            if members is None:
+                members = self.get_group_members()
+            key = self.group_key(inst)
+            j = i + 1
+            while (j < len(cmds) and self.is_group_member(cmds[j]) and not self.is_awaited(cmds[j])
+                   and self.group_key(cmds[j]) == key):
+                j += 1
+            result.extend(self._merge_run(key, cmds[i:j], members) if j - i > 1 else cmds[i:j])
+            i = j
+        return result
+
+    @staticmethod
+    def group_key(inst: Instruction):
+        """(opcode, d6, d7, fid): the commands of a run only differ by rid/did"""
+        b = inst.get_inst()
+        return b[1], b[5], b[6], b[2]
+
+    def _merge_run(self, key, run: List[Instruction], members: Dict[int, Dict[int, set]]) -> List[Instruction]:
+        """
+            Merge a run of identical commands, the commands of devices out of the group members
+            (an AC in a covered room...) are kept as they are
+        """
+        op, d6, d7, fid = key
+        floor_rooms = members.get(fid, {})
+        rooms = {}
+        for inst in run:
+            rooms.setdefault(inst.get_d4(), set()).add(inst.get_d5())
+        covered = {rid for rid, dids in floor_rooms.items() if dids and dids <= rooms.get(rid, set())}
+        if not covered:
+            return run
+        if covered == set(floor_rooms):
+            self.log("Merge floor command %s - %s", op, fid)
+            group = Instruction([243, op, fid, 0, 0, d6, d7])
+            group_insts = {rid: group for rid in covered}
+        else:
+            group_insts = {}
+            for rid in covered:
+                self.log("Merge room command %s - %s - %s", op, fid, rid)
+                group_insts[rid] = Instruction([243, op, fid, rid, 0, d6, d7])
+        result = []
+        waiters = {}  # id(group instruction) -> trace waiters of the commands it replaces
+        for inst in run:
+            rid, did = inst.get_d4(), inst.get_d5()
+            if rid not in covered or did not in floor_rooms[rid]:
+                result.append(inst)
+                continue
+            group = group_insts[rid]
+            # The group instruction is sent in place of the first command it replaces
+            if id(group) not in waiters:
+                waiters[id(group)] = []
+                result.append(group)
+            if getattr(inst, 'waiter', None) is not None:
+                waiters[id(group)].append(inst.waiter)
+        for group in result:
+            if waiters.get(id(group)):
+                group.waiters = waiters[id(group)]
+        return result
+
+    @staticmethod
+    def is_awaited(inst: Instruction) -> bool:
+        waiter = getattr(inst, 'waiter', None)
+        return waiter is not None and waiter.awaited
+
+    @staticmethod
+    def is_group_member(inst: Instruction) -> bool:
+        d1, d2, d3, d4, d5 = inst.get_inst()[:5]
+        return d1 == 243 and d2 in GROUP_OPCODES and d3 > 0 and d4 > 0 and d5 > 0
+
     def create_action(self, payload, create_instruction) -> List[Instruction]:
         """
         Create action instruction
@@ -161,11 +336,14 @@ class KLWIOTController:
                             # inst may be an array or a single object, determine the type
                             if inst:
                                 if isinstance(inst, list):
+                                    for i in inst:
+                                        i.oid = oid
                                     cmds.extend(inst)
                                 else:
+                                    inst.oid = oid
                                     cmds.append(inst)
         except Exception as e:
-            print(f"Error creating action: {e}")
+            _LOGGER.error("Error creating action: %s", e)
         return cmds
 
     def sort_cmds_with_frd(self, cmds: List[Instruction]) -> None:
@@ -173,487 +351,3 @@ class KLWIOTController:
             Sort commands according to fid,rid,did, and arrange devices in the same area together for batch control
         """
         cmds.sort(key=lambda x: (x.get_d3(), x.get_d4(), x.get_d5()))
-
-    # Device control methods
-    def device_on(self, payload) -> None:
-        """Turn on the device"""
-        self.log("DeviceOn", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,154,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def device_off(self, payload) -> None:
-        """Turn off the device"""
-        self.log("DeviceOff", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,158,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def device_toggle(self, payload) -> None:
-        """Turn off the device"""
-        self.log("DeviceToggle", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,159,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Scene control
-    def scene_trigger(self, payload) -> None:
-        """Trigger a scene"""
-        self.log("SceneTrigger", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"237,{fid},{rid},{did},0,0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Brightness control
-    def set_brightness(self, payload) -> None:
-        """Set brightness"""
-        self.log("SetBrightness", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value', 0)
-            # Convert brightness value from 0-100 to 0-15
-            gear = math.floor(value / 100 * 15)
-            return Instruction(f"243,165,{fid},{rid},{did},{gear},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def inc_brightness(self, payload) -> None:
-        """Increase brightness"""
-        self.log("IncBrightness", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,160,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def dec_brightness(self, payload) -> None:
-        """Decrease brightness"""
-        self.log("DecBrightness", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,161,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Color control
-    def set_color(self, payload) -> None:
-        """Set color"""
-        self.log("SetColor", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            color = item.get('value', {"r": 255, "g": 255, "b": 255})
-            r = color.get('r', 255);
-            g = color.get('g', 255);
-            b = color.get('b', 255)
-            return Instruction(f"112,{fid},{rid},{did},{r},{g},{b}")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_color_temperature(self, payload) -> None:
-        """Set color temperature"""
-        self.log("SetColorTemperature", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value')
-            if value is None:
-                return None
-            if value > 100:
-                value = 100
-            if value < 0:
-                value = 0
-            return Instruction(f"112,{fid},{rid},{did},{100 - value},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Temperature control
-    def set_temperature(self, payload) -> None:
-        """Set temperature"""
-        self.log("SetTemperature", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value')
-            if value is None:
-                return None
-            if value > 30:
-                value = 30
-            if value < 15:
-                value = 15
-            return Instruction(f"46,{fid},{rid},{did},{value - 15},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def inc_temperature(self, payload) -> None:
-        """Increase temperature"""
-        self.log("IncTemperature", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,160,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def dec_temperature(self, payload) -> None:
-        """Decrease temperature"""
-        self.log("DecTemperature", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,161,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Gear and mode control
-    def set_gear(self, payload) -> None:
-        """Set gear"""
-        self.log("SetGear", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value')
-            if value is None:
-                return None
-            if value > 15:
-                value = 15
-            if value < 0:
-                value = 0
-            return Instruction(f"243,165,{fid},{rid},{did},{value},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_mode(self, payload) -> None:
-        """Set mode"""
-        self.log("SetMode", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            mode = item.get('value')
-            if mode is None:
-                return None
-            if mode > 4:
-                mode = 4
-            if mode < 0:
-                mode = 0
-            modes = [18, 17, 4, 5]
-            return Instruction(f"243,164,{fid},{rid},{did},{modes[mode]},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Manual-automatic control
-    def set_auto(self, payload) -> None:
-        """Set automatic mode"""
-        self.log("SetAuto", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value')
-            if value is None:
-                return None
-            if value > 1:
-                value = 1
-            if value < 0:
-                value = 0
-
-            modes = [23, 22]
-            return Instruction(f"243,164,{fid},{rid},{did},{modes[value]},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Speed control
-    def set_speed(self, payload) -> None:
-        """Set speed"""
-        self.log("SetSpeed", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value')
-            if value is None:
-                return None
-            if value > 2:
-                value = 2
-            if value < 0:
-                value = 0
-            modes = [19, 20, 21]
-            return Instruction(f"243,164,{fid},{rid},{did},{modes[value]},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_speed_low(self, payload) -> None:
-        """Set low speed"""
-        self.log("SetSpeedLow", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,164,{fid},{rid},{did},19,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_speed_mid(self, payload) -> None:
-        """Set medium speed"""
-        self.log("SetSpeedMid", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,164,{fid},{rid},{did},20,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_speed_high(self, payload) -> None:
-        """Set high speed"""
-        self.log("SetSpeedHigh", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,164,{fid},{rid},{did},21,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_rckey(self, payload) -> None:
-        """Send remote control key"""
-        self.log("SendRCKey", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            value = item.get('value')
-            if value is None:
-                return None
-            if 0 <= value <= 23:
-                # Remote control keys 0-23, a total of 24 keys at most
-                return Instruction(f"243,164,{fid},{rid},{did},{value},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    # Curtain control
-    def shade_open(self, payload) -> None:
-        """Open the curtain"""
-        self.log("ShadeOpen", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return [Instruction(f"243,154,{fid},{rid},{did},0,0")]
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def shade_close(self, payload) -> None:
-        """Close the curtain"""
-        self.log("ShadeClose", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return [Instruction(f"243,158,{fid},{rid},{did},0,0")]
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def shade_pause(self, payload) -> None:
-        """Pause the curtain"""
-        self.log("ShadePause", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return [Instruction(f"243,187,{fid},{rid},{did},0,0")]
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_shade_scale(self, payload) -> None:
-        """Set curtain position"""
-        self.log("SetShadeScale", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            scale = item.get('value')
-            if scale is None:
-                return None
-            if scale > 100:
-                scale = 100
-            if scale < 0:
-                scale = 0
-            newscale = math.floor(scale / 100 * 10)
-            return Instruction(f"243,164,{fid},{rid},{did},{newscale + 6},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_security(self, payload) -> None:
-        """Set security"""
-        self.log("SetSecurity", payload)
-
-        def create_inst(info, item):
-            value = item.get('value')
-            if value is None:
-                return None
-            if value == 2:
-                return Instruction(f"243,169,0,0,0,0,0")
-            else:
-                return Instruction(f"243,170,0,0,0,0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-        # Volume control
-
-    def set_volume(self, payload) -> None:
-        """Set volume"""
-        self.log("SetVolume", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            volume = item.get('value')
-            if volume is None:
-                return None
-            if volume > 100:
-                volume = 100
-            if volume < 0:
-                volume = 0
-            # Convert volume value from 0-100 to 0-18
-            volume = math.floor(volume / 100 * 18)
-            return Instruction(f"243,165,{fid},{rid},{did},{volume},136")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def inc_volume(self, payload) -> None:
-        """Increase volume"""
-        self.log("IncVolume", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,160,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def dec_volume(self, payload) -> None:
-        """Decrease volume"""
-        self.log("DecVolume", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,161,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-        # Volume control
-
-    def set_prev_song(self, payload) -> None:
-        """Previous song"""
-        self.log("SetPrevSong", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,162,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_next_song(self, payload) -> None:
-        """Next song"""
-        self.log("SetNextSong", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            return Instruction(f"243,163,{fid},{rid},{did},0,0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_song_folder(self, payload) -> None:
-        """Set song folder"""
-        self.log("SetSongFolder", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            folder = item.get('value')
-            if folder is None:
-                return None
-            if 0 <= folder <= 6:
-                return Instruction(f"243,223,{fid},{rid},{did},{folder + 10},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
-
-    def set_source(self, payload) -> None:
-        """Set audio source"""
-        self.log("SetSource", payload)
-
-        def create_inst(info, item):
-            fid, rid, did = info['fid'], info['rid'], info['did']
-            source = item.get('value')
-            if source is None:
-                return None
-            if 1 <= source <= 4:
-                return Instruction(f"243,165,{fid},{rid},{did},{source},0")
-
-        cmds = self.create_action(payload, create_inst)
-        self.sort_cmds_with_frd(cmds)
-        self.send_control_commands(cmds)
@@ -0,0 +1,50 @@
+"""
+Logging of the klwiot package
+
+Every module logs through logging.getLogger(__name__), below the package logger, with %-style
+arguments: a message is only formatted when a record is emitted. The frame payloads are wrapped
+in Decs/Hexes, and the hot paths check isEnabledFor first, so a disabled level costs no string work.
+"""
+import logging
+from typing import Iterable, Optional
+
+PACKAGE_LOGGER = logging.getLogger(__package__)
+
+_handler: Optional[logging.Handler] = None
+
+
+class Decs:
+    """Bytes shown as space separated decimals, formatted when the record is emitted"""
+    __slots__ = ('data',)
+
+    def __init__(self, data: Iterable[int]):
+        self.data = data
+
+    def __str__(self) -> str:
+        return ' '.join(map(str, self.data))
+
+
+class Hexes(Decs):
+    """Bytes shown as space separated hex, formatted when the record is emitted"""
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        return ' '.join(format(b, '02X') for b in self.data)
+
+
+def enable_debug_logging():
+    """Send the debug records of the package to stderr, outside of Home Assistant's logger setup"""
+    global _handler
+    if _handler is None:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        PACKAGE_LOGGER.addHandler(_handler)
+    PACKAGE_LOGGER.setLevel(logging.DEBUG)
+
+
+def disable_debug_logging():
+    global _handler
+    if _handler is not None:
+        PACKAGE_LOGGER.removeHandler(_handler)
+        _handler = None
+    PACKAGE_LOGGER.setLevel(logging.NOTSET)
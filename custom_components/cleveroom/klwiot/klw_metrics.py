@@ -0,0 +1,131 @@
+"""
+Hot-path counters and histograms of a gateway client
+
+Disabled by default: the call sites check Metrics.enabled first, so a disabled instance costs one attribute read.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict
+
+# Upper bounds of the histogram buckets, in milliseconds (the last bucket is open)
+HISTOGRAM_BOUNDS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+RATE_WINDOW = 10.0  # seconds
+
+
+class Counter:
+    """Monotonic total, and its rate per second over the last complete window"""
+
+    def __init__(self):
+        self.total = 0
+        self.rate = 0.0
+        self._window_start = time.monotonic()
+        self._window_total = 0
+
+    def add(self, n: int = 1):
+        self.total += n
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= RATE_WINDOW:
+            self.rate = (self.total - self._window_total) / elapsed
+            self._window_start = now
+            self._window_total = self.total
+
+    def as_dict(self) -> dict:
+        # A counter that stopped moving has no rate any more
+        if time.monotonic() - self._window_start >= 2 * RATE_WINDOW:
+            self.rate = 0.0
+        return {'total': self.total, 'rate': round(self.rate, 2)}
+
+
+class Histogram:
+    """Fixed bucket histogram of durations in milliseconds"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th value (the max for the open bucket)"""
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(HISTOGRAM_BOUNDS_MS[i], self.max) if i < len(HISTOGRAM_BOUNDS_MS) else self.max
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'avg': round(self.sum / self.count, 3) if self.count else 0.0,
+            'min': round(self.min or 0.0, 3),
+            'max': round(self.max or 0.0, 3),
+            'p50': round(self.percentile(0.5), 3),
+            'p99': round(self.percentile(0.99), 3),
+        }
+
+
+class Metrics:
+    """
+    The counters, histograms and gauges of one client
+     counters  : frames_received, frames_sent, device_events, logins, disconnects, ack_timeouts
+     histograms: parse_ms (a read, fan-out included), send_delay_ms, fanout_ms, persist_ms, ack_latency_ms
+     gauges    : evaluated when a snapshot is taken, e.g. queue_depth, bucket_size
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Counter] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = Counter()
+            counter.add(n)
+
+    def observe(self, name: str, value_ms: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value_ms)
+
+    def gauge(self, name: str, func: Callable[[], float]):
+        """Register a value read when a snapshot is taken"""
+        self._gauges[name] = func
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {name: c.as_dict() for name, c in self._counters.items()}
+            histograms = {name: h.as_dict() for name, h in self._histograms.items()}
+        gauges = {}
+        for name, func in self._gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception:
+                gauges[name] = None
+        return {'enabled': self.enabled, 'counters': counters, 'histograms': histograms, 'gauges': gauges}
@@ -0,0 +1,79 @@
+"""
+Sampling profiler of the klwiot threads
+
+A daemon thread takes the stacks of the selected threads (sys._current_frames) at every interval and
+counts them folded, the input format of flamegraph.pl, speedscope or inferno:
+    thread;outermost function (file.py:line);...;innermost function (file.py:line) samples
+The profiled threads are not instrumented, they only hand the GIL over to the sampler.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+
+class SamplingProfiler:
+    """
+    Samples the threads returned by threads() (ident -> name, evaluated at every sample as threads come and go)
+    until stop() or for at most max_duration seconds
+    """
+
+    def __init__(self, threads: Callable[[], Dict[int, str]], interval: float = 0.005, max_duration: float = 300.0):
+        self.interval = interval
+        self.max_duration = max_duration
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._threads = threads
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='klw-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        start = time.monotonic()
+        deadline = start + self.max_duration
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            for ident, name in self._threads().items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[self._fold(name, frame)] += 1
+            self.samples += 1
+        self.duration = time.monotonic() - start
+
+    @staticmethod
+    def _fold(name: str, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.append(name)
+        names.reverse()
+        return ';'.join(names)
+
+    def folded(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def write_folded(self, path: str) -> str:
+        with open(path, 'w') as f:
+            f.write(self.folded())
+        return path
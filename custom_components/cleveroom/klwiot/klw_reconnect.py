@@ -0,0 +1,33 @@
+import random
+
+
+class ReconnectPolicy:
+    """
+    Reconnect delays: an immediate first retry, then exponential backoff with jitter up to a cap
+    """
+
+    def __init__(self, base: float = 0.5, factor: float = 2.0, cap: float = 15.0, jitter: float = 0.5):
+        """
+        :param base: delay of the second retry, in seconds
+        :param factor: growth factor of the following retries
+        :param cap: maximum delay, in seconds
+        :param jitter: part of the delay that is randomized (0~1), spreads the retries of several gateways
+        """
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """Delay before the next attempt, in seconds"""
+        attempts = self.attempts
+        self.attempts += 1
+        if attempts == 0:
+            return 0.0
+        delay = min(self.cap, self.base * self.factor ** (attempts - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        """The connection is up again"""
+        self.attempts = 0
@@ -5,17 +5,67 @@ Encryption utility class
 import hashlib
 import base64
 import hmac
-from typing import Union, Optional
+from functools import lru_cache
+from typing import Union, Optional, Iterable, List
 from . import utils
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 
 
+class CryptoSession:
+    """
+    AES-128-ECB context bound to one key (e.g. the secure code of a gateway),
+    the key and the cipher are derived once and reused by every handshake
+    """
+
+    BLOCK_SIZE = 16
+
+    def __init__(self, app_secret: Union[str, bytes]):
+        """
+        Args:
+            app_secret: Key string, padded with 0 or truncated to 16 bytes
+        """
+        keydata = app_secret.encode('utf-8') if isinstance(app_secret, str) else bytes(app_secret)
+        self.key = keydata.ljust(16, b'\0')[:16]
+        self._cipher = Cipher(algorithms.AES(self.key), modes.ECB(), backend=default_backend())
+
+    def encrypt(self, data: Union[bytes, bytearray, list]) -> bytes:
+        encryptor = self._cipher.encryptor()
+        return encryptor.update(bytes(data)) + encryptor.finalize()
+
+    def decrypt(self, data: Union[bytes, bytearray, list]) -> bytes:
+        decryptor = self._cipher.decryptor()
+        return decryptor.update(bytes(data)) + decryptor.finalize()
+
+    def decrypt_blocks(self, blocks: Iterable[Union[bytes, bytearray, list]]) -> List[bytes]:
+        """
+        Decrypt several 16-byte blocks in one call (ECB blocks are independent)
+        """
+        blocks = [bytes(b) for b in blocks]
+        plain = self.decrypt(b''.join(blocks))
+        size = self.BLOCK_SIZE
+        return [plain[i:i + size] for i in range(0, len(plain), size)]
+
+
 class Crypto:
     """
     Encryption utility class, implemented using the cryptography library
     """
 
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def session(app_secret: Union[str, bytes]) -> CryptoSession:
+        """
+        The shared session of a key
+
+        Args:
+            app_secret: Key string
+
+        Returns:
+            CryptoSession: cached per key
+        """
+        return CryptoSession(app_secret)
+
     @staticmethod
     def encryption(data: bytes, key: bytes) -> bytes:
         """
@@ -29,20 +79,7 @@ class Crypto:
             bytes: Encrypted data
         """
         try:
-            # Ensure the key length is 16 bytes
-            if len(key) != 16:
-                key = key.ljust(16, b'\0')[:16]
-
-            # Create the encryptor
-            cipher = Cipher(
-                algorithms.AES(key),
-                modes.ECB(),
-                backend=default_backend()
-            )
-            encryptor = cipher.encryptor()
-
-            # Encrypt the data
-            return encryptor.update(data) + encryptor.finalize()
+            return Crypto.session(bytes(key)).encrypt(data)
 
         except Exception as e:
             raise Exception(f"Encryption failed: {str(e)}")
@@ -60,23 +97,7 @@ class Crypto:
             bytes: Decrypted data
         """
         try:
-            # Convert input data to bytes
-            data = bytes(ran)
-            keydata = app_secret.encode('utf-8')
-
-            # Create a 16-byte key
-            key = keydata.ljust(16, b'\0')[:16]
-
-            # Create the decryptor
-            cipher = Cipher(
-                algorithms.AES(key),
-                modes.ECB(),
-                backend=default_backend()
-            )
-            decryptor = cipher.decryptor()
-
-            # Decrypt the data
-            return decryptor.update(data) + decryptor.finalize()
+            return Crypto.session(app_secret).decrypt(ran)
 
         except Exception as e:
             raise Exception(f"Decryption failed: {str(e)}")
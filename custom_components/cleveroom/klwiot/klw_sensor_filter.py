@@ -0,0 +1,137 @@
+"""
+Report policies of the environment sensors, to limit the state writes (and the recorder rows) of chatty sensors
+
+Per sensor class, one per unit:
+    deadband    : a value is reported when it moves at least this much from the last reported one
+    min_interval: seconds between two reports of a sensor
+and for all the classes an averaging window: the reported value is the mean of the samples of the last seconds.
+While the filter is active the client hands it every sample, repeated frames included.
+A value withheld by min_interval is pending: the next sample reports it or, when the sensor repeats no frame,
+flush() once the interval has passed.
+"""
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+TEMPERATURE = 'temperature'  # ℃
+HUMIDITY = 'humidity'  # %
+ILLUMINANCE = 'illuminance'  # lx
+AIR_QUALITY = 'air_quality'  # AQI index
+PARTICULATES = 'particulates'  # µg/m³: PM2.5, formaldehyde
+GAS = 'gas'  # ppm: CO2, CO
+PRESSURE = 'pressure'  # kPa
+WIND_SPEED = 'wind_speed'  # m/s
+NOISE = 'noise'  # dB
+RAIN = 'rain'  # mm
+UV = 'uv'  # W/m²
+OTHER = 'other'
+SENSOR_CLASSES = (TEMPERATURE, HUMIDITY, ILLUMINANCE, AIR_QUALITY, PARTICULATES, GAS, PRESSURE, WIND_SPEED, NOISE,
+                  RAIN, UV, OTHER)
+
+# did: D6 of the 198 frames, D2 of the air quality ones
+_CLASS_OF_DID = {
+    20: TEMPERATURE, 22: HUMIDITY, 21: ILLUMINANCE, 44: ILLUMINANCE, 135: AIR_QUALITY,
+    120: PARTICULATES, 124: PARTICULATES, 121: GAS, 123: GAS, 128: PRESSURE, 45: PRESSURE,
+    40: WIND_SPEED, 126: NOISE, 42: RAIN, 43: UV,
+}
+
+
+def sensor_class(did: int) -> str:
+    """Class of a sensor by its did"""
+    return _CLASS_OF_DID.get(did, OTHER)
+
+
+class SensorPolicy:
+
+    def __init__(self, deadband: float = 0.0, min_interval: float = 0.0):
+        self.deadband = deadband
+        self.min_interval = min_interval
+
+
+class _SensorState:
+    __slots__ = ('did', 'value', 'reported_at', 'samples', 'pending')
+
+    def __init__(self, did: int):
+        self.did = did
+        self.value = None
+        self.reported_at = 0.0
+        self.samples: Deque[Tuple[float, float]] = deque()
+        self.pending = None  # value withheld by min_interval
+
+
+class SensorFilter:
+    """Decides, sample by sample, which value of a sensor is reported"""
+
+    def __init__(self, policies: Optional[Dict[str, SensorPolicy]] = None, average_window: float = 0.0):
+        self.policies = dict(policies or {})
+        self.average_window = average_window
+        self.suppressed = 0
+        self._states: Dict[str, _SensorState] = {}
+        self._pending = set()  # oids with a pending value
+
+    @property
+    def active(self) -> bool:
+        return self.average_window > 0 or any(p.deadband > 0 or p.min_interval > 0 for p in self.policies.values())
+
+    def report(self, oid: str, did: int, value, now: float = None):
+        """
+        Take a sample of the sensor, return the value to report or None to withhold it
+        """
+        now = time.monotonic() if now is None else now
+        state = self._states.get(oid)
+        if state is None:
+            state = self._states[oid] = _SensorState(did)
+
+        if self.average_window > 0:
+            samples = state.samples
+            samples.append((now, value))
+            while samples[0][0] <= now - self.average_window:
+                samples.popleft()
+            value = round(sum(v for _, v in samples) / len(samples), 1)
+
+        if state.value is not None:
+            policy = self.policies.get(sensor_class(did))
+            if policy and abs(value - state.value) < policy.deadband:
+                self._set_pending(oid, state, None)
+                self.suppressed += 1
+                return None
+            if policy and now - state.reported_at < policy.min_interval:
+                self._set_pending(oid, state, value)
+                self.suppressed += 1
+                return None
+        self._set_pending(oid, state, None)
+        state.value = value
+        state.reported_at = now
+        return value
+
+    def _set_pending(self, oid: str, state: _SensorState, value):
+        state.pending = value
+        if value is None:
+            self._pending.discard(oid)
+        else:
+            self._pending.add(oid)
+
+    def flush(self, now: float = None) -> List[Tuple[str, float]]:
+        """Report the pending values whose min_interval has passed, as (oid, value)"""
+        if not self._pending:
+            return []
+        now = time.monotonic() if now is None else now
+        flushed = []
+        for oid in list(self._pending):
+            state = self._states[oid]
+            policy = self.policies.get(sensor_class(state.did))
+            if policy is None or now - state.reported_at >= policy.min_interval:
+                flushed.append((oid, state.pending))
+                state.value = state.pending
+                state.reported_at = now
+                self._set_pending(oid, state, None)
+        return flushed
+
+    def forget(self, oid: str = None):
+        """Drop the history of a sensor, of all of them without oid"""
+        if oid is None:
+            self._states.clear()
+            self._pending.clear()
+        else:
+            self._states.pop(oid, None)
+            self._pending.discard(oid)
@@ -0,0 +1,73 @@
+"""
+Round-trip tracing of the control commands
+
+A traced command is timed at each stage (see klw_ack.AckWaiter) and, once the gateway reports the state of its
+device, split into:
+    compile_ms: control call -> instructions created
+    queue_ms  : queued -> written to the socket, our pacing and room/floor coalescing
+    bus_ms    : written -> state report received, the gateway and the Cleveroom bus
+    total_ms  : control call -> state report received
+aggregated per action and per device. Disabled by default, like the metrics.
+"""
+import threading
+from typing import Dict
+
+from .klw_ack import AckWaiter
+from .klw_metrics import Histogram
+
+STAGES = ('compile_ms', 'queue_ms', 'bus_ms', 'total_ms')
+OTHER_DEVICES = 'other'
+
+
+class CommandTracer:
+    """Latency histograms of the acknowledged commands, per action and per device (at most max_devices)"""
+
+    def __init__(self, enabled: bool = False, max_devices: int = 256):
+        self.enabled = enabled
+        self.max_devices = max_devices
+        self.traced = 0
+        self._lock = threading.Lock()
+        self._actions: Dict[str, Dict[str, Histogram]] = {}
+        self._devices: Dict[str, Dict[str, Histogram]] = {}
+
+    def record(self, waiter: AckWaiter):
+        """Aggregate an acknowledged waiter, called by AckTracker in the receiving thread"""
+        if not self.enabled or waiter.action is None or waiter.queued_at is None or waiter.sent_at is None:
+            return
+        durations = (
+            (waiter.compiled_at - waiter.called_at) * 1000,
+            (waiter.sent_at - waiter.queued_at) * 1000,
+            (waiter.acked_at - waiter.sent_at) * 1000,
+            (waiter.acked_at - waiter.called_at) * 1000,
+        )
+        device = waiter.oid or '{}-{}-{}'.format(*waiter.address)
+        with self._lock:
+            self.traced += 1
+            if device not in self._devices and len(self._devices) >= self.max_devices:
+                device = OTHER_DEVICES
+            for histograms in (self._histograms(self._actions, waiter.action),
+                               self._histograms(self._devices, device)):
+                for stage, value in zip(STAGES, durations):
+                    histograms[stage].observe(value)
+
+    @staticmethod
+    def _histograms(table: Dict[str, Dict[str, Histogram]], key: str) -> Dict[str, Histogram]:
+        histograms = table.get(key)
+        if histograms is None:
+            histograms = table[key] = {stage: Histogram() for stage in STAGES}
+        return histograms
+
+    def reset(self):
+        with self._lock:
+            self.traced = 0
+            self._actions.clear()
+            self._devices.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'traced': self.traced,
+                'actions': {key: {stage: h.as_dict() for stage, h in hs.items()} for key, hs in self._actions.items()},
+                'devices': {key: {stage: h.as_dict() for stage, h in hs.items()} for key, hs in self._devices.items()},
+            }
@@ -22,7 +22,7 @@ from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers import area_registry as ar
 from homeassistant.helpers import floor_registry as fr
 from homeassistant.helpers import device_registry as dr
-from . import DOMAIN, ENTITY_REGISTRY, KLWIOTClient, DeviceType, device_registry_area_update, is_light, \
+from . import DOMAIN, ENTITY_REGISTRY, KLWIOTClient, DeviceType, device_registry_area_update, \
     generate_object_id
 from .base import KLWEntity
 
@@ -49,7 +49,7 @@ async def async_setup_entry(
         hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
 ):
     gateway_data = hass.data[DOMAIN][entry.entry_id]
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["light"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -59,41 +59,37 @@ async def async_setup_entry(
     lights = []
     for device in devices:
         try:
-            if is_light(device):
-
-                if auto_area == 1:
-                    await device_registry_area_update(
-                        floor_registry, area_registry, device_registry, entry, device)
-                light = CleveroomLight(hass, device, client, gateway_id,auto_area)
-                lights.append(light)
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][light.unique_id] = light
-                _LOGGER.info(f"restore light: {device['oid']}  unique_id:{light.unique_id} ")
+            if auto_area == 1:
+                await device_registry_area_update(
+                    floor_registry, area_registry, device_registry, entry, device)
+            light = CleveroomLight(hass, device, client, gateway_id,auto_area)
+            lights.append(light)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][light.unique_id] = light
+            _LOGGER.info(f"restore light: {device['oid']}  unique_id:{light.unique_id} ")
         except KeyError as e:
             _LOGGER.warning(
                 f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}"
             )
     async_add_entities(lights)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_light(device):
-                    _LOGGER.info(f"add light new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    light = CleveroomLight(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [light], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][light.unique_id] = light
-                    _LOGGER.info(f"new light: {device['oid']}  unique_id:{light.unique_id} ")
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')},"
-                                f" error message: {e}")
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add light new devices: {device['oid']}")
+            if auto_area == 1:
+                asyncio.run_coroutine_threadsafe(
+                    device_registry_area_update(
+                        floor_registry, area_registry, device_registry, entry, device),
+                    hass.loop)
+            light = CleveroomLight(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(hass, async_add_entities, [light], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][light.unique_id] = light
+            _LOGGER.info(f"new light: {device['oid']}  unique_id:{light.unique_id} ")
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')},"
+                            f" error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -101,7 +97,7 @@ async def async_setup_entry(
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["light"] = async_device_discovered
 
 
 class CleveroomLight(KLWEntity,LightEntity):
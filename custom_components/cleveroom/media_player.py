@@ -24,7 +24,7 @@ from homeassistant.helpers import device_registry as dr
 
 from .base import KLWEntity
 from . import (DOMAIN, ENTITY_REGISTRY, KLWIOTClient, DeviceType,
-               device_registry_area_update, is_media_player,
+               device_registry_area_update,
     generate_object_id)
 
 _LOGGER = logging.getLogger(__name__)
@@ -42,7 +42,7 @@ async def async_setup_entry(
         async_add_entities: AddEntitiesCallback,
 ) -> None:
     gateway_data = hass.data[DOMAIN][entry.entry_id]
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["media_player"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -53,39 +53,36 @@ async def async_setup_entry(
     media_players = []
     for device in devices:
         try:
-            if is_media_player(device):
-                if auto_area == 1:
-                    await device_registry_area_update(
-                        floor_registry, area_registry, device_registry, entry, device)
-                player = CleveroomMediaPlayer(hass, device, client, gateway_id,auto_area)
-                media_players.append(player)
-
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][player.unique_id] = player
+            if auto_area == 1:
+                await device_registry_area_update(
+                    floor_registry, area_registry, device_registry, entry, device)
+            player = CleveroomMediaPlayer(hass, device, client, gateway_id,auto_area)
+            media_players.append(player)
+
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][player.unique_id] = player
         except Exception as e:
             _LOGGER.warning(
                 f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
 
     async_add_entities(media_players)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_media_player(device):
-                    _LOGGER.info(f"add music player new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    player = CleveroomMediaPlayer(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [player], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][player.unique_id] = player
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')},"
-                                f" error message: {e}")
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add music player new devices: {device['oid']}")
+            if auto_area == 1:
+                asyncio.run_coroutine_threadsafe(
+                    device_registry_area_update(
+                        floor_registry, area_registry, device_registry, entry, device),
+                    hass.loop)
+            player = CleveroomMediaPlayer(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(hass, async_add_entities, [player], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][player.unique_id] = player
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')},"
+                            f" error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -93,7 +90,7 @@ async def async_setup_entry(
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["media_player"] = async_device_discovered
 
 
 class CleveroomMediaPlayer(KLWEntity,MediaPlayerEntity):
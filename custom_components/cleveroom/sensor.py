@@ -18,6 +18,7 @@ from homeassistant.components.binary_sensor import (
 )
 from homeassistant.const import (
     PERCENTAGE,
+    EntityCategory,
 )
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity import DeviceInfo
@@ -26,7 +27,8 @@ from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 from homeassistant.config_entries import ConfigEntry  # Import ConfigEntry
 
 from .base import KLWEntity
-from . import DOMAIN, ENTITY_REGISTRY, KLWIOTClient, DeviceType, device_registry_area_update, is_scene, is_sensor, \
+from . import DOMAIN, ENTITY_REGISTRY, KLWIOTClient, DeviceType, device_registry_area_update, is_scene, \
+    CONF_ENABLE_METRICS, get_translation, \
     generate_object_id
 from homeassistant.helpers import floor_registry as fr
 from homeassistant.helpers import area_registry as ar
@@ -41,7 +43,7 @@ async def async_setup_entry(  # Changed to async_setup_entry
         async_add_entities: AddEntitiesCallback,
 ) -> None:
     gateway_data = hass.data[DOMAIN][entry.entry_id]  # Access data from entry
-    devices = gateway_data["devices"]
+    devices = gateway_data["platform_devices"]["sensor"]
     client = gateway_data["client"]
     gateway_id = gateway_data["gateway_id"]
     auto_area = gateway_data["auto_area"]
@@ -51,38 +53,38 @@ async def async_setup_entry(  # Changed to async_setup_entry
     sensors = []
     for device in devices:
         try:
-            if is_sensor(device):
-                if auto_area == 1:
-                    await device_registry_area_update(
-                        floor_registry, area_registry, device_registry, entry, device)
-                sensor = CleveroomSensor(hass, device, client, gateway_id,auto_area)
-                sensors.append(sensor)
-                ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
+            if auto_area == 1:
+                await device_registry_area_update(
+                    floor_registry, area_registry, device_registry, entry, device)
+            sensor = CleveroomSensor(hass, device, client, gateway_id,auto_area)
+            sensors.append(sensor)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
         except Exception as e:
             _LOGGER.warning(
                 f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, error message: {e}")
 
     async_add_entities(sensors)
 
-    def async_device_discovered(device, is_new):
-        if is_new:
-            try:
-                if is_sensor(device):
-                    _LOGGER.info(f"add sensor new devices: {device['oid']}")
-                    if auto_area == 1:
-                        asyncio.run_coroutine_threadsafe(
-                            device_registry_area_update(
-                                floor_registry, area_registry, device_registry, entry, device),
-                            hass.loop)
-                    sensor = CleveroomSensor(hass, device, client, gateway_id,auto_area)
-                    asyncio.run_coroutine_threadsafe(
-                        async_add_entities_wrapper(hass, async_add_entities, [sensor], False), hass.loop)
-                    ENTITY_REGISTRY.setdefault(entry.entry_id, {})
-                    ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
-            except KeyError as e:
-                _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
-                                f"error message: {e}")
+    if gateway_data["options"].get(CONF_ENABLE_METRICS, False):
+        async_add_entities([CleveroomMetricSensor(hass, client, gateway_id, *metric) for metric in METRIC_SENSORS])
+
+    def async_device_discovered(device):
+        try:
+            _LOGGER.info(f"add sensor new devices: {device['oid']}")
+            if auto_area == 1:
+                asyncio.run_coroutine_threadsafe(
+                    device_registry_area_update(
+                        floor_registry, area_registry, device_registry, entry, device),
+                    hass.loop)
+            sensor = CleveroomSensor(hass, device, client, gateway_id,auto_area)
+            asyncio.run_coroutine_threadsafe(
+                async_add_entities_wrapper(hass, async_add_entities, [sensor], False), hass.loop)
+            ENTITY_REGISTRY.setdefault(entry.entry_id, {})
+            ENTITY_REGISTRY[entry.entry_id][sensor.unique_id] = sensor
+        except KeyError as e:
+            _LOGGER.warning(f"Device data is incomplete, skip: {device.get('oid', 'unknow')}, "
+                            f"error message: {e}")
 
     async def async_add_entities_wrapper(hass: HomeAssistant,
                                          async_add_entities: AddEntitiesCallback,
@@ -90,7 +92,7 @@ async def async_setup_entry(  # Changed to async_setup_entry
                                          update_before_add: bool = False):
         async_add_entities(entities, update_before_add)
 
-    client.on("on_device_change", async_device_discovered)
+    gateway_data["platform_listeners"]["sensor"] = async_device_discovered
 
 
 class CleveroomSensor(KLWEntity,SensorEntity):
@@ -190,3 +192,49 @@ class CleveroomSensor(KLWEntity,SensorEntity):
     def native_unit_of_measurement(self):
         return self._attr_unit_of_measurement
 
+
+
+# key, snapshot group ("stats": the GatewayStats of the manager), metric, field ("total": increasing), unit
+METRIC_SENSORS = (
+    ("frames_received_rate", "counters", "frames_received", "rate", "frames/s"),
+    ("frames_sent_rate", "counters", "frames_sent", "rate", "frames/s"),
+    ("parse_time_p99", "histograms", "parse_ms", "p99", "ms"),
+    ("send_delay_p50", "histograms", "send_delay_ms", "p50", "ms"),
+    ("fanout_time_p99", "histograms", "fanout_ms", "p99", "ms"),
+    ("persist_time_p50", "histograms", "persist_ms", "p50", "ms"),
+    ("queue_depth", "gauges", "queue_depth", None, None),
+    ("bucket_size", "gauges", "bucket_size", None, None),
+    ("reconnects", "stats", "reconnects", "total", None),
+)
+
+
+class CleveroomMetricSensor(SensorEntity):
+    """Diagnostic sensor of a gateway client metric, polled"""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, hass, client, gateway_id, key, group, metric, field, unit) -> None:
+        self._hass = hass
+        self._client = cast(KLWIOTClient, client)
+        self._group = group
+        self._metric = metric
+        self._field = field
+        name = get_translation(hass, f"metric_{key}", key.replace("_", " ").capitalize())
+        self._attr_name = f"{name}({gateway_id})"
+        self._attr_unique_id = f"cleveroom_metric_{key}.{gateway_id}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_native_value = None
+        if field == "total":
+            # A count since the start, not a sample: its long-term statistics are a sum
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    async def async_update(self):
+        if self._group == "stats":
+            stats = self._client.stats
+            self._attr_native_value = getattr(stats, self._metric) if stats else None
+            return
+        value = self._client.metrics.snapshot()[self._group].get(self._metric)
+        if isinstance(value, dict):
+            value = value.get(self._field)
+        self._attr_native_value = value